@@ -0,0 +1,123 @@
+"""Artefactos del modelo Whisper incluidos en la imagen (build) y verificados al cargarlos (runtime).
+
+Uso (en el Dockerfile, antes de copiar el código):
+    python asr_models.py fetch small            # descarga a $ASR_MODEL_DIR/small + manifest.json
+    python asr_models.py fetch small base --revision <commit>
+    python asr_models.py verify                 # sha256 de todos los modelos del directorio (exit 1 si falla)
+    python asr_models.py list
+
+Cada modelo queda en <ASR_MODEL_DIR>/<tamaño>/ con un manifest.json (archivos, bytes, sha256,
+revisión). main.py carga sólo desde ahí con ASR_MODEL_OFFLINE=1, sin tocar la red.
+Sólo stdlib aquí (faster-whisper se importa al hacer fetch), para poder copiarlo solo en el build.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+MANIFEST = "manifest.json"
+DEFAULT_ROOT = os.getenv("ASR_MODEL_DIR", "").strip() or os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+
+def model_dir(size: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or DEFAULT_ROOT, size)
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def verify(path: str, full: bool = False) -> List[str]:
+    """Problemas encontrados en el directorio del modelo ([] = OK).
+    Por defecto compara tamaños (instantáneo); full=True recalcula el sha256 de cada archivo."""
+    manifest = read_manifest(path)
+    if not manifest:
+        return [f"{path}: sin {MANIFEST}"]
+    problems = []
+    for name, meta in (manifest.get("files") or {}).items():
+        fp = os.path.join(path, name)
+        if not os.path.isfile(fp):
+            problems.append(f"{name}: falta")
+        elif os.path.getsize(fp) != meta["bytes"]:
+            problems.append(f"{name}: tamaño {os.path.getsize(fp)} != {meta['bytes']}")
+        elif full and _sha256(fp) != meta["sha256"]:
+            problems.append(f"{name}: sha256 no coincide")
+    return problems
+
+
+def fetch(size: str, root: Optional[str] = None, revision: Optional[str] = None) -> Dict[str, Any]:
+    """Descarga los pesos de faster-whisper a <root>/<size> y escribe el manifest."""
+    from faster_whisper import download_model
+
+    out = model_dir(size, root)
+    os.makedirs(out, exist_ok=True)
+    kwargs = {"revision": revision} if revision else {}
+    download_model(size, output_dir=out, **kwargs)
+    files = {}
+    for name in sorted(os.listdir(out)):
+        fp = os.path.join(out, name)
+        if name == MANIFEST or name.startswith(".") or not os.path.isfile(fp):
+            continue
+        files[name] = {"bytes": os.path.getsize(fp), "sha256": _sha256(fp)}
+    manifest = {"model": size, "revision": revision or "main", "fetched_at": int(time.time()), "files": files}
+    with open(os.path.join(out, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _installed(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if read_manifest(os.path.join(root, d)))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("command", choices=("fetch", "verify", "list"))
+    ap.add_argument("sizes", nargs="*", help="tamaños (tiny, base, small...); por defecto $ASR_MODEL o todos los instalados")
+    ap.add_argument("--root", default=DEFAULT_ROOT)
+    ap.add_argument("--revision", default=None, help="commit/tag del repo del modelo en el hub")
+    args = ap.parse_args()
+
+    if args.command == "fetch":
+        for size in args.sizes or [os.getenv("ASR_MODEL", "small")]:
+            t0 = time.time()
+            m = fetch(size, args.root, args.revision)
+            total = sum(f["bytes"] for f in m["files"].values())
+            print(f"{size}: {len(m['files'])} archivos, {total / 1e6:.0f} MB en {time.time() - t0:.0f} s -> {model_dir(size, args.root)}")
+        return 0
+
+    sizes = args.sizes or _installed(args.root)
+    if not sizes:
+        print(f"no hay modelos en {args.root}")
+        return 1 if args.command == "verify" else 0
+    failed = False
+    for size in sizes:
+        path = model_dir(size, args.root)
+        if args.command == "list":
+            m = read_manifest(path) or {}
+            print(f"{size}: revisión {m.get('revision', '?')}, {len(m.get('files') or {})} archivos")
+            continue
+        problems = verify(path, full=True)
+        failed = failed or bool(problems)
+        print(f"{size}: " + ("OK" if not problems else "; ".join(problems)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
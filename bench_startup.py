@@ -0,0 +1,75 @@
+"""Benchmark de arranque en frío: cuánto tarda `import main` en un proceso nuevo.
+
+Uso:
+    python bench_startup.py                 # 5 corridas, mediana + módulos más lentos
+    python bench_startup.py --runs 10 --max-ms 800   # falla (exit 1) si la mediana supera 800 ms
+
+Cada corrida es un intérprete nuevo (como un contenedor autoescalado o un worker recién creado).
+Importar main no debe abrir conexiones ni escribir archivos: eso corre en el lifespan de FastAPI.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _import_once() -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], cwd=HERE, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - t0) * 1000
+
+
+def _baseline_once() -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - t0) * 1000
+
+
+def _slowest_modules(top: int):
+    """Módulos con más tiempo acumulado según `python -X importtime`."""
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=HERE,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in res.stderr.splitlines():
+        # formato: "import time: <self us> | <cumulative us> | <module>"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) < 3:
+            continue
+        rows.append((int(parts[1]), int(parts[0]), parts[2].rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=12, help="módulos más lentos a mostrar (0 = ninguno)")
+    ap.add_argument("--max-ms", type=float, default=0, help="presupuesto para la mediana; 0 = sin límite")
+    args = ap.parse_args()
+
+    _import_once()  # calienta la cache de bytecode / disco
+    times = [_import_once() for _ in range(max(1, args.runs))]
+    base = statistics.median(_baseline_once() for _ in range(3))
+    med = statistics.median(times)
+
+    print(f"import main: mediana {med:.0f} ms | min {min(times):.0f} ms | max {max(times):.0f} ms "
+          f"({len(times)} corridas; intérprete vacío {base:.0f} ms)")
+    if args.top:
+        print("\nmódulos más lentos (acumulado / propio, ms):")
+        for cum_us, self_us, name in _slowest_modules(args.top):
+            print(f"  {cum_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+    if args.max_ms and med > args.max_ms:
+        print(f"\nFAIL: la mediana {med:.0f} ms supera el presupuesto de {args.max_ms:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,251 @@
 
 
-import os, sys, tempfile, subprocess, re
+import os, sys, tempfile, subprocess, re, threading, uuid, asyncio, math
+import importlib.util
+from contextlib import contextmanager, asynccontextmanager
+from dataclasses import dataclass, replace as dc_replace
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, HttpUrl
 from dotenv import load_dotenv
-import json, time, urllib.parse, requests
+import json, time, urllib.parse, requests, hashlib, hmac, sqlite3, statistics
+from requests.adapters import HTTPAdapter
 load_dotenv()
 
-# ===== Optional: PostgreSQL usage counters =====
-try:
-    import psycopg2
-    import psycopg2.extras
-except Exception:
-    psycopg2 = None  # will stay None if package not installed
+# ---------- Startup: lazy initializers ----------
+# Importar main.py no debe tocar red, disco ni base de datos: cada inicialización es un
+# _LazyInit que corre la primera vez que algo la necesita, o en segundo plano desde el lifespan
+# de FastAPI (todas a la vez). Así un reload/test/worker nuevo arranca en milisegundos aunque
+# PostgreSQL esté lento. Si falla (excepción), se reintenta en el siguiente uso con backoff
+# exponencial (BOOT_RETRY_SEC .. BOOT_RETRY_MAX_SEC): un corte de PG al arrancar no deja el
+# componente apagado toda la vida del proceso.
+BOOT_RETRY_SEC = float(os.getenv("BOOT_RETRY_SEC", "5"))
+BOOT_RETRY_MAX_SEC = float(os.getenv("BOOT_RETRY_MAX_SEC", "300"))
+
+class _LazyInit:
+    def __init__(self, name: str, fn: Callable[[], Any]):
+        self.name = name
+        self.fn = fn
+        self._lock = threading.Lock()
+        self.done = False          # ya se intentó al menos una vez
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.ms: Optional[int] = None
+        self.attempts = 0
+        self._retry_at = 0.0
+        _BOOTSTRAP[name] = self
+
+    def get(self) -> Any:
+        if self.done and (self.error is None or time.time() < self._retry_at):
+            return self.result
+        with self._lock:
+            if not self.done or (self.error is not None and time.time() >= self._retry_at):
+                t0 = time.time()
+                self.attempts += 1
+                try:
+                    self.result = self.fn()
+                    self.error = None
+                except Exception as e:
+                    self.result = None
+                    self.error = str(e)
+                    self._retry_at = time.time() + min(BOOT_RETRY_MAX_SEC, BOOT_RETRY_SEC * 2 ** (self.attempts - 1))
+                    print(f"[BOOT] {self.name} failed (attempt {self.attempts}):", e)
+                self.ms = int((time.time() - t0) * 1000)
+                self.done = True
+        return self.result
+
+    def state(self) -> Dict[str, Any]:
+        retry_in = max(0, round(self._retry_at - time.time(), 1)) if self.error is not None else None
+        return {"done": self.done, "ok": self.done and self.error is None, "error": self.error, "ms": self.ms,
+                "attempts": self.attempts, "retry_in": retry_in,
+                "detail": self.result if isinstance(self.result, str) else None}
+
+_BOOTSTRAP: Dict[str, _LazyInit] = {}
+
+@asynccontextmanager
+async def _lifespan(app):
+    loop = asyncio.get_running_loop()
+    # Arranque no bloqueante: las inicializaciones corren en paralelo en el threadpool
+    for init in list(_BOOTSTRAP.values()):
+        loop.run_in_executor(None, init.get)
+    yield
+    _JOB_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+# ---------- Shared HTTP session (keep-alive) ----------
+# Una sesión por proceso: las llamadas a Apify / LLM / servicio ASR reutilizan conexiones TLS
+# en vez de abrir una nueva por request. El warm-up del arranque abre las primeras.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE))
+_HTTP.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE))
 
+# ===== Optional: PostgreSQL usage counters =====
+# psycopg2 se importa al primer uso; aquí sólo se comprueba que esté instalado
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 USAGE_LIMIT_STARTER = int(os.getenv("USAGE_LIMIT_STARTER", "3"))
 USAGE_LIMIT_PRO = int(os.getenv("USAGE_LIMIT_PRO", "7"))
 
-PG_ENABLED = bool(DATABASE_URL and psycopg2)
+PG_ENABLED = bool(DATABASE_URL and importlib.util.find_spec("psycopg2"))
 
-def _pg_connect():
-    if not PG_ENABLED:
-        return None
-    return psycopg2.connect(DATABASE_URL, connect_timeout=5)
+def _psycopg2():
+    import psycopg2
+    import psycopg2.extras
+    return psycopg2
+
+# Pool de conexiones: antes cada llamada de /usage/* abría una conexión nueva (TCP + TLS + auth)
+# para una consulta de milisegundos, y las ráfagas de la UI agotaban las conexiones de la base.
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "8"))
+PG_POOL_TIMEOUT_SEC = float(os.getenv("PG_POOL_TIMEOUT_SEC", "5"))          # espera máxima por una conexión libre
+PG_POOL_CHECK_IDLE_SEC = float(os.getenv("PG_POOL_CHECK_IDLE_SEC", "30"))  # SELECT 1 antes de reusar una conexión inactiva
+PG_POOL_MAX_AGE_SEC = float(os.getenv("PG_POOL_MAX_AGE_SEC", "1800"))      # reciclar conexiones viejas
+
+class _PgPool:
+    """Pool acotado y thread-safe de conexiones psycopg2. Las conexiones se abren bajo demanda
+    (hasta `maxconn`); si están todas ocupadas se espera hasta PG_POOL_TIMEOUT_SEC y luego se
+    responde 503. Una conexión rota (OperationalError/InterfaceError, o que falla el ping tras
+    estar inactiva) se descarta y se reabre, así un reinicio de la base no deja el pool inservible."""
+
+    def __init__(self, minconn: int, maxconn: int):
+        self.maxconn = max(1, maxconn)
+        self.minconn = max(0, min(minconn, self.maxconn))
+        self._cond = threading.Condition()
+        self._idle: List[tuple] = []  # (conn, created_at, last_used), LIFO
+        self._size = 0                # conexiones abiertas (en uso + inactivas) o abriéndose
+        self._waiting = 0
+        self.stats = {"acquired": 0, "created": 0, "discarded": 0, "failed_pings": 0, "timeouts": 0, "wait_ms": 0}
+
+    def _open(self):
+        conn = _psycopg2().connect(DATABASE_URL, connect_timeout=5)
+        # autocommit: cada sentencia es su propia transacción, sin BEGIN/COMMIT extra por consulta
+        conn.autocommit = True
+        self.stats["created"] += 1
+        return conn, time.time()
+
+    def _close(self, conn) -> None:
+        self.stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, created_at: float, last_used: float) -> bool:
+        now = time.time()
+        if conn.closed or now - created_at > PG_POOL_MAX_AGE_SEC:
+            return False
+        if now - last_used <= PG_POOL_CHECK_IDLE_SEC:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            self.stats["failed_pings"] += 1
+            return False
+
+    def _acquire(self) -> tuple:
+        t0 = time.time()
+        deadline = t0 + PG_POOL_TIMEOUT_SEC
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        entry = None
+                        break
+                    left = deadline - time.time()
+                    if left <= 0:
+                        self.stats["timeouts"] += 1
+                        raise _Overloaded("pg", 1, "Todas las conexiones a PostgreSQL están ocupadas; reintenta en un momento.")
+                    self._cond.wait(left)
+            finally:
+                self._waiting -= 1
+            self.stats["acquired"] += 1
+            self.stats["wait_ms"] += int((time.time() - t0) * 1000)
+        if entry is not None:
+            conn, created_at, last_used = entry
+            if self._healthy(conn, created_at, last_used):
+                return conn, created_at
+            self._close(conn)  # el hueco sigue reservado: se reabre abajo
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, conn, created_at: float, broken: bool) -> None:
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != _psycopg2().extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        if broken or conn.closed:
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn, created_at = self._acquire()
+        pg = _psycopg2()
+        try:
+            yield conn
+        except BaseException as e:
+            self._release(conn, created_at, broken=isinstance(e, (pg.OperationalError, pg.InterfaceError)))
+            raise
+        self._release(conn, created_at, broken=False)
+
+    def fill(self) -> str:
+        """Abre las PG_POOL_MIN conexiones iniciales (warm-up del arranque)."""
+        opened = []
+        for _ in range(self.minconn):
+            with self._cond:
+                if self._size >= self.minconn:
+                    break
+                self._size += 1
+            try:
+                opened.append(self._open())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+        with self._cond:
+            self._idle.extend((conn, created_at, time.time()) for conn, created_at in opened)
+            self._cond.notify_all()
+        return f"{self._size}/{self.maxconn} connections"
+
+    def view(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self.stats, min=self.minconn, max=self.maxconn, size=self._size,
+                        idle=len(self._idle), in_use=self._size - len(self._idle), waiting=self._waiting)
+
+_PG_POOL = _PgPool(PG_POOL_MIN, PG_POOL_MAX) if PG_ENABLED else None
+_LazyInit("pg_pool", lambda: _PG_POOL.fill() if _PG_POOL else "disabled")
+
+@contextmanager
+def _pg_conn():
+    """Conexión del pool; vuelve al pool al salir (con rollback si quedó una transacción abierta)."""
+    with _PG_POOL.connection() as conn:
+        yield conn
 
 def _ensure_usage_table():
     if not PG_ENABLED:
@@ -44,19 +261,21 @@ def _ensure_usage_table():
         "  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),\n"
         "  UNIQUE (user_id, feature, month)\n"
         ");\n"
-        "CREATE INDEX IF NOT EXISTS idx_usage_lookup ON usage_counters (user_id, feature, month);"
+        "CREATE INDEX IF NOT EXISTS idx_usage_lookup ON usage_counters (user_id, feature, month);\n"
+        "CREATE TABLE IF NOT EXISTS user_plans (\n"
+        "  user_id TEXT PRIMARY KEY,\n"
+        "  plan TEXT NOT NULL,\n"
+        "  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()\n"
+        ");"
     )
-    try:
-        with _pg_connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute(ddl)
-            conn.commit()
-        return True
-    except Exception as e:
-        print("[USAGE][PG] init failed:", e)
-        return False
+    # Sin try/except: si falla, _LazyInit lo registra y reintenta en el siguiente uso
+    with _pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ddl)
+        conn.commit()
+    return True
 
-_ensure_usage_table()
+_USAGE_TABLE = _LazyInit("usage_table", _ensure_usage_table)
 
 def _usage_limit_for_plan(plan: str) -> int:
     p = (plan or "").lower().strip()
@@ -64,7 +283,8 @@ def _usage_limit_for_plan(plan: str) -> int:
         return USAGE_LIMIT_STARTER
     if p == "pro":
         return USAGE_LIMIT_PRO
-    return 1_000_000_000  # effectively unlimited for other plans
+    # Plan ausente o desconocido: el límite más estricto, nunca ilimitado
+    return min(USAGE_LIMIT_STARTER, USAGE_LIMIT_PRO)
 
 from datetime import datetime
 
@@ -92,14 +312,14 @@ def _init_inline_cookies_env():
         print("[ASR] failed to write inline cookies:", e)
         return None
 
-_init_inline_cookies_env()
+_INLINE_COOKIES = _LazyInit("inline_cookies", _init_inline_cookies_env)
 
 # CORS (allow WP/Railway embeds)
 CORS_ALLOW_ORIGINS = os.getenv("CORS_ALLOW_ORIGINS", "*")
 # Comma-separated list, e.g. "https://creatorhoop.com,https://*.creatorhoop.com,https://automator-production-82f2.up.railway.app"
 origins = [o.strip() for o in CORS_ALLOW_ORIGINS.split(',') if o.strip()] or ["*"]
 
-app = FastAPI(title="CreatorHoop")
+app = FastAPI(title="CreatorHoop", lifespan=_lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -108,6 +328,397 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------- Capacity budgets (admission control / backpressure) ----------
+# Cada clase de recurso tiene un máximo de trabajos simultáneos y una cola de espera acotada.
+# Si la cola está llena (o la espera excede BUDGET_WAIT_TIMEOUT_SEC) se responde 503 + Retry-After
+# en vez de saturar el threadpool y degradar /health, /usage/* o /guideon/rewrite.
+BUDGET_WAIT_TIMEOUT_SEC = float(os.getenv("BUDGET_WAIT_TIMEOUT_SEC", "120"))
+DEBUG_BUDGET = os.getenv("DEBUG_BUDGET", "0").lower() in ("1", "true", "yes")
+DEBUG_CACHE = os.getenv("DEBUG_CACHE", "0").lower() in ("1", "true", "yes")
+
+# Contexto del hilo actual: clase de prioridad (bulk) y dueño del trabajo (user_id, plan).
+# Los jobs ya admitidos marcan bulk=True y esperan turno sin ser rechazados.
+_WORK_CTX = threading.local()
+
+# Peso por plan para el reparto justo entre usuarios (más peso = más capacidad en la misma ventana)
+SCHED_PLAN_WEIGHTS = {
+    "starter": float(os.getenv("SCHED_WEIGHT_STARTER", "1")),
+    "pro": float(os.getenv("SCHED_WEIGHT_PRO", "2")),
+}
+
+def _plan_weight(plan: Optional[str]) -> float:
+    return max(0.1, SCHED_PLAN_WEIGHTS.get((plan or "").strip().lower(), 1.0))
+
+@contextmanager
+def _work_context(bulk: Optional[bool] = None, user_id: Optional[str] = None, plan: Optional[str] = None,
+                  cancel: Optional[threading.Event] = None):
+    """Fija el contexto de scheduling del hilo y lo restaura al salir (los hilos del threadpool se reutilizan).
+    `cancel` es el evento de cancelación del job dueño del trabajo."""
+    prev = {k: getattr(_WORK_CTX, k, None) for k in ("bulk", "user_id", "plan", "cancel")}
+    if bulk is not None:
+        _WORK_CTX.bulk = bulk
+    if user_id is not None:
+        _WORK_CTX.user_id = user_id
+    if plan is not None:
+        _WORK_CTX.plan = plan
+    if cancel is not None:
+        _WORK_CTX.cancel = cancel
+    try:
+        yield
+    finally:
+        for k, v in prev.items():
+            setattr(_WORK_CTX, k, v)
+
+class _Overloaded(Exception):
+    """No hay capacidad para `resource` ahora mismo; reintentar en `retry_after` segundos."""
+
+    def __init__(self, resource: str, retry_after: int, detail: str = ""):
+        super().__init__(detail or f"Capacidad agotada para '{resource}'.")
+        self.resource = resource
+        self.retry_after = max(1, int(retry_after))
+
+class _Cancelled(BaseException):
+    """El trabajo del hilo actual fue cancelado (cliente desconectado o DELETE /job/{id}).
+    Hereda de BaseException (como asyncio.CancelledError) para que los `except Exception`
+    de cada etapa no la conviertan en un error de item y el job pare de verdad."""
+
+def _cancel_requested() -> bool:
+    ev = getattr(_WORK_CTX, "cancel", None)
+    return ev is not None and ev.is_set()
+
+def _check_cancelled() -> None:
+    if _cancel_requested():
+        raise _Cancelled()
+
+def _run_subprocess(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Como subprocess.run(cmd, check=True, capture_output=True), pero mata el proceso
+    (yt-dlp / ffmpeg) en cuanto se cancela el trabajo."""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    while True:
+        try:
+            out, err = proc.communicate(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if _cancel_requested():
+                proc.kill()
+                proc.communicate()
+                raise _Cancelled()
+        except BaseException:
+            proc.kill()
+            proc.communicate()
+            raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, out, err)
+    return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+
+class _Budget:
+    """Semáforo con cola acotada, prioridad y reparto justo por usuario.
+
+    Cuando no hay slot libre, el siguiente en entrar es:
+      1) interactivo antes que bulk;
+      2) el usuario con menos tiempo virtual consumido (segundos de slot / peso del plan);
+      3) el que llegó primero.
+    El tiempo virtual arranca en el reloj virtual actual, así un usuario nuevo no acapara
+    por no tener historial y uno con muchos jobs no bloquea a los demás.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)  # cola de interactivos; bulk espera sin límite
+        self._cond = threading.Condition()
+        self._waiters: List[Dict[str, Any]] = []
+        self._served: Dict[str, float] = {}  # user -> tiempo virtual consumido
+        self._vclock = 0.0
+        self._seq = 0
+        self.active = 0
+        self.rejected = 0
+        self.avg_sec = 0.0  # EMA de la duración de cada slot
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _waiting_interactive(self) -> int:
+        return sum(1 for w in self._waiters if w["prio"] == 0)
+
+    def retry_after(self) -> int:
+        per_slot = self.avg_sec or 5.0
+        return math.ceil(per_slot * (self._waiting_interactive() + 1) / self.limit)
+
+    def _charge(self, user: str, seconds: float, weight: float) -> None:
+        self._served[user] = self._served.get(user, self._vclock) + seconds / weight
+
+    def _grant(self) -> None:
+        """Reparte los slots libres entre los que esperan (se llama con el lock tomado)."""
+        while self._waiters and self.active < self.limit:
+            w = min(self._waiters, key=lambda x: (x["prio"], self._served.get(x["user"], self._vclock), x["seq"]))
+            self._waiters.remove(w)
+            self._vclock = max(self._vclock, self._served.get(w["user"], self._vclock))
+            self._charge(w["user"], w["est"], w["weight"])  # reserva el coste estimado al entrar
+            w["granted"] = True
+            self.active += 1
+        if len(self._served) > 1000:
+            self._served = {u: v for u, v in self._served.items() if v > self._vclock}
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        bulk = bool(getattr(_WORK_CTX, "bulk", False))
+        user = getattr(_WORK_CTX, "user_id", None) or "anon"
+        weight = _plan_weight(getattr(_WORK_CTX, "plan", None))
+        with self._cond:
+            me = {"prio": 1 if bulk else 0, "user": user, "weight": weight, "seq": self._seq,
+                  "est": self.avg_sec or 1.0, "granted": False}
+            self._seq += 1
+            if user not in self._served:
+                self._served[user] = self._vclock
+            if self.active >= self.limit or self._waiters:
+                if not bulk and self._waiting_interactive() >= self.max_waiting:
+                    self.rejected += 1
+                    raise _Overloaded(self.name, self.retry_after(),
+                                      f"Cola de '{self.name}' llena ({self.waiting} en espera).")
+                self._waiters.append(me)
+                self._grant()
+                # _cancel_job() despierta a los que esperan: un job cancelado suelta su lugar en la cola
+                self._cond.wait_for(lambda: me["granted"] or _cancel_requested(),
+                                    timeout=None if bulk else (timeout or BUDGET_WAIT_TIMEOUT_SEC))
+                if not me["granted"]:
+                    self._waiters.remove(me)
+                    _check_cancelled()
+                    self.rejected += 1
+                    raise _Overloaded(self.name, self.retry_after(),
+                                      f"Tiempo de espera agotado para '{self.name}'.")
+            else:
+                self._charge(user, me["est"], weight)
+                self.active += 1
+        if DEBUG_BUDGET:
+            print(f"[BUDGET] {self.name} acquire user={user} bulk={bulk} active={self.active}/{self.limit} waiting={self.waiting}")
+        t0 = time.time()
+        try:
+            _check_cancelled()
+            yield
+        finally:
+            elapsed = time.time() - t0
+            with self._cond:
+                self.active -= 1
+                self.avg_sec = elapsed if not self.avg_sec else (0.8 * self.avg_sec + 0.2 * elapsed)
+                self._charge(user, elapsed - me["est"], weight)  # ajusta la reserva al coste real
+                self._grant()
+
+    def wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def view(self) -> Dict[str, Any]:
+        with self._cond:
+            interactive = self._waiting_interactive()
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "waiting": self.waiting,
+                "waiting_interactive": interactive,
+                "waiting_bulk": self.waiting - interactive,
+                "waiting_users": len({w["user"] for w in self._waiters}),
+                "max_waiting": self.max_waiting,
+                "avg_sec": round(self.avg_sec, 2),
+                "rejected": self.rejected,
+            }
+
+def _make_budget(name: str, default_limit: int, default_queue: int = 16) -> _Budget:
+    key = name.upper()
+    return _Budget(name, int(os.getenv(f"BUDGET_{key}", str(default_limit))),
+                   int(os.getenv(f"BUDGET_{key}_QUEUE", str(default_queue))))
+
+_BUDGETS: Dict[str, _Budget] = {
+    "scrape": _make_budget("scrape", 4),      # actores Apify / yt-dlp de perfil
+    "download": _make_budget("download", 4),  # descargas de media (requests / yt-dlp)
+    "ffmpeg": _make_budget("ffmpeg", 2),      # conversiones a WAV 16 kHz
+    "asr": _make_budget("asr", 1),            # Whisper (CPU/RAM intensivo)
+    "llm": _make_budget("llm", 8),            # llamadas a Claude / OpenAI
+}
+
+@app.exception_handler(_Overloaded)
+async def _overloaded_handler(request: Request, exc: _Overloaded):
+    return JSONResponse(
+        {"error": "overloaded", "detail": str(exc), "resource": exc.resource, "retry_after": exc.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# ---------- Shared cross-process cache (SQLite WAL) ----------
+# Con varios workers (WEB_CONCURRENCY > 1) cada proceso tiene su propia memoria: las caches que
+# vale la pena compartir (rutas OpenAI, transcripciones, eventos de jobs) viven en un SQLite local
+# en modo WAL, con TTL y tope de entradas por namespace (LRU por último acceso) iguales para todos.
+SERVE_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "automator_cache.sqlite3"))
+
+def _sqlite_connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+_SHARED_CACHE_READY = set()
+_SHARED_CACHE_INIT_LOCK = threading.Lock()
+
+def _shared_cache_conn(path: str = SHARED_CACHE_PATH) -> sqlite3.Connection:
+    conn = _sqlite_connect(path)
+    if path not in _SHARED_CACHE_READY:
+        with _SHARED_CACHE_INIT_LOCK:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv_cache (ns TEXT NOT NULL, k TEXT NOT NULL, v TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (ns, k))")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_cache_lru ON kv_cache (ns, accessed_at)")
+            # Namespaces retirados (claves o huellas incorrectas): nunca se leen, se borran al abrir
+            conn.execute("DELETE FROM kv_cache WHERE ns IN ('transcript', 'audio_fp')")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events (job_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+                "ev TEXT NOT NULL, ts REAL NOT NULL, PRIMARY KEY (job_id, seq))")
+            conn.commit()
+            _SHARED_CACHE_READY.add(path)
+    return conn
+
+class _SharedCache:
+    """Cache clave -> valor JSON compartida entre procesos, con interfaz tipo dict (get / pop / []=).
+    Best-effort: si el SQLite falla, se comporta como una cache vacía (y lo registra con DEBUG_CACHE)."""
+
+    def __init__(self, namespace: str, ttl_sec: int, max_entries: int = 1000, path: str = SHARED_CACHE_PATH):
+        self.ns = namespace
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.path = path
+
+    @staticmethod
+    def _key(key: Any) -> str:
+        return key if isinstance(key, str) else json.dumps(key, ensure_ascii=False, default=str)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        now = time.time()
+        try:
+            conn = _shared_cache_conn(self.path)
+            try:
+                row = conn.execute("SELECT v, expires_at, accessed_at FROM kv_cache WHERE ns = ? AND k = ?",
+                                   (self.ns, self._key(key))).fetchone()
+                if not row or row[1] < now:
+                    return default
+                if now - row[2] > 60:  # refresca el LRU sin escribir en cada lectura
+                    conn.execute("UPDATE kv_cache SET accessed_at = ? WHERE ns = ? AND k = ?", (now, self.ns, self._key(key)))
+                    conn.commit()
+                return json.loads(row[0])
+            finally:
+                conn.close()
+        except Exception as e:
+            if DEBUG_CACHE:
+                print(f"[CACHE][{self.ns}] get failed:", e)
+            return default
+
+    def get_many(self, keys: List[Any]) -> Dict[str, Any]:
+        """Varias claves en una sola consulta: {clave (str): valor} sólo con las presentes y vigentes."""
+        wanted = list(dict.fromkeys(self._key(k) for k in keys))
+        if not wanted:
+            return {}
+        now = time.time()
+        try:
+            conn = _shared_cache_conn(self.path)
+            try:
+                out = {}
+                for i in range(0, len(wanted), 500):  # límite de parámetros de SQLite
+                    chunk = wanted[i:i + 500]
+                    rows = conn.execute(f"SELECT k, v FROM kv_cache WHERE ns = ? AND expires_at >= ? "
+                                        f"AND k IN ({','.join('?' * len(chunk))})", (self.ns, now, *chunk)).fetchall()
+                    out.update((k, json.loads(v)) for k, v in rows)
+                return out
+            finally:
+                conn.close()
+        except Exception as e:
+            if DEBUG_CACHE:
+                print(f"[CACHE][{self.ns}] get_many failed:", e)
+            return {}
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.set_many({key: value})
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        # Evicción: primero lo vencido, luego lo menos usado por encima del tope
+        conn.execute("DELETE FROM kv_cache WHERE ns = ? AND expires_at < ?", (self.ns, now))
+        conn.execute(
+            "DELETE FROM kv_cache WHERE ns = ? AND k IN (SELECT k FROM kv_cache WHERE ns = ? "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.ns, self.ns, self.max_entries))
+
+    def update(self, key: Any, fn: Callable[[Any], Any]) -> Any:
+        """Lee-modifica-escribe una clave de forma atómica entre procesos: BEGIN IMMEDIATE toma el
+        lock de escritura antes de leer, así dos workers no se pisan. `fn(valor o None)` devuelve el
+        nuevo valor, que es lo que se retorna; si devuelve None no se escribe nada (None también si
+        el SQLite falló)."""
+        now = time.time()
+        k = self._key(key)
+        try:
+            conn = _shared_cache_conn(self.path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT v, expires_at FROM kv_cache WHERE ns = ? AND k = ?", (self.ns, k)).fetchone()
+                value = fn(json.loads(row[0]) if row and row[1] >= now else None)
+                if value is None:
+                    conn.rollback()
+                    return None
+                conn.execute("INSERT OR REPLACE INTO kv_cache (ns, k, v, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                             (self.ns, k, json.dumps(value, ensure_ascii=False, default=str), now + self.ttl_sec, now))
+                self._evict(conn, now)
+                conn.commit()
+                return value
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        except Exception as e:
+            if DEBUG_CACHE:
+                print(f"[CACHE][{self.ns}] update failed:", e)
+            return None
+
+    def set_many(self, items: Dict[Any, Any]) -> None:
+        """Escribe varias claves en una sola transacción."""
+        if not items:
+            return
+        now = time.time()
+        try:
+            conn = _shared_cache_conn(self.path)
+            try:
+                conn.executemany("INSERT OR REPLACE INTO kv_cache (ns, k, v, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                                 [(self.ns, self._key(k), json.dumps(v, ensure_ascii=False, default=str),
+                                   now + self.ttl_sec, now) for k, v in items.items()])
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            if DEBUG_CACHE:
+                print(f"[CACHE][{self.ns}] set failed:", e)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Borra la clave y devuelve su valor vigente (o `default`); lectura y borrado en la misma
+        transacción, así dos procesos no se llevan el mismo valor."""
+        now = time.time()
+        k = self._key(key)
+        try:
+            conn = _shared_cache_conn(self.path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT v, expires_at FROM kv_cache WHERE ns = ? AND k = ?", (self.ns, k)).fetchone()
+                conn.execute("DELETE FROM kv_cache WHERE ns = ? AND k = ?", (self.ns, k))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        except Exception as e:
+            if DEBUG_CACHE:
+                print(f"[CACHE][{self.ns}] pop failed:", e)
+            return default
+        return json.loads(row[0]) if row and row[1] >= now else default
+
 # ---------- Consent log endpoint ----------
 @app.post("/consent/log")
 async def consent_log(req: Request):
@@ -123,48 +734,221 @@ async def consent_log(req: Request):
 class UsageIncReq(BaseModel):
     user_id: str
     feature: str  # e.g., 'analyze_profiles' | 'generate_scripts'
-    plan: str     # 'starter' | 'pro' | others
+    plan: Optional[str] = None  # ignorado: el límite sale de user_plans
+
+# Lecturas calientes: la UI pide el restante en cada render. Cache por proceso con TTL corto;
+# el incremento la actualiza con el valor que devuelve la base. Con varios workers otro proceso
+# puede ver un `remaining` viejo hasta USAGE_CACHE_TTL_SEC, pero el límite lo impone el upsert
+# condicional en PostgreSQL, no la cache.
+USAGE_CACHE_TTL_SEC = float(os.getenv("USAGE_CACHE_TTL_SEC", "10"))
+USAGE_FEATURES = ("analyze_profiles", "generate_scripts")
+_USAGE_CACHE: Dict[tuple, tuple] = {}  # (user_id, feature, month) -> (used, expires_at)
+_USAGE_CACHE_LOCK = threading.Lock()
+
+def _usage_cache_get(user_id: str, feature: str, month: str) -> Optional[int]:
+    with _USAGE_CACHE_LOCK:
+        hit = _USAGE_CACHE.get((user_id, feature, month))
+    return hit[0] if hit and hit[1] > time.time() else None
+
+def _usage_cache_put(user_id: str, feature: str, month: str, used: int) -> None:
+    now = time.time()
+    with _USAGE_CACHE_LOCK:
+        if len(_USAGE_CACHE) > 10_000:
+            for k in [k for k, (_, exp) in _USAGE_CACHE.items() if exp <= now]:
+                _USAGE_CACHE.pop(k, None)
+        _USAGE_CACHE[(user_id, feature, month)] = (used, now + USAGE_CACHE_TTL_SEC)
+
+# El plan que cuenta para el cupo es el de la base (user_plans, la mantiene el backend de pagos),
+# no el `plan` que manda el cliente: con plan="business" o vacío se saltaba el límite. Sin fila
+# o si la lectura falla se aplica el límite más estricto. Cache corta por proceso como la de uso.
+USAGE_PLAN_CACHE_TTL_SEC = float(os.getenv("USAGE_PLAN_CACHE_TTL_SEC", "60"))
+_USAGE_PLANS: Dict[str, tuple] = {}  # user_id -> (plan, expires_at)
+
+def _usage_plan_for_user(user_id: str) -> str:
+    now = time.time()
+    with _USAGE_CACHE_LOCK:
+        hit = _USAGE_PLANS.get(user_id)
+    if hit and hit[1] > now:
+        return hit[0]
+    try:
+        with _pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT plan FROM user_plans WHERE user_id=%s", (user_id,))
+                row = cur.fetchone()
+    except _Overloaded:
+        raise
+    except Exception as e:
+        print("[USAGE][PG] plan lookup failed (strictest limit):", e)
+        return ""
+    plan = (row[0] or "").strip().lower() if row else ""
+    with _USAGE_CACHE_LOCK:
+        if len(_USAGE_PLANS) > 10_000:
+            for k in [k for k, (_, exp) in _USAGE_PLANS.items() if exp <= now]:
+                _USAGE_PLANS.pop(k, None)
+        _USAGE_PLANS[user_id] = (plan, now + USAGE_PLAN_CACHE_TTL_SEC)
+    return plan
+
+def _usage_try_increment(user_id: str, feature: str, plan: str, month: str, limit: int) -> tuple:
+    """Suma 1 al contador si sigue por debajo de `limit`, en un solo round trip.
+    Devuelve (ok, used): used es el valor nuevo, o el actual si se alcanzó el límite."""
+    with _pg_conn() as conn:
+        with conn.cursor() as cur:
+            if limit <= 0:
+                # El WHERE sólo filtra la rama UPDATE: sin esto el INSERT de la primera unidad
+                # pasaría siempre y un plan con límite 0 tendría un uso gratis al mes.
+                cur.execute("SELECT used FROM usage_counters WHERE user_id=%s AND feature=%s AND month=%s",
+                            (user_id, feature, month))
+                row = cur.fetchone()
+                used = int(row[0]) if row else 0
+                _usage_cache_put(user_id, feature, month, used)
+                return False, used
+            cur.execute(
+                "INSERT INTO usage_counters (user_id, feature, month, plan, used) VALUES (%s, %s, %s, %s, 1) "
+                "ON CONFLICT (user_id, feature, month) DO UPDATE "
+                "SET used = usage_counters.used + 1, plan = EXCLUDED.plan, updated_at = NOW() "
+                "WHERE usage_counters.used < %s RETURNING used",
+                (user_id, feature, month, plan, limit))
+            row = cur.fetchone()
+            if row:
+                used, ok = int(row[0]), True
+            else:
+                # Límite alcanzado (la fila existe y no se tocó): sólo en este caso, una lectura más
+                cur.execute("SELECT used FROM usage_counters WHERE user_id=%s AND feature=%s AND month=%s",
+                            (user_id, feature, month))
+                row = cur.fetchone()
+                used, ok = (int(row[0]) if row else limit), False
+    _usage_cache_put(user_id, feature, month, used)
+    return ok, used
+
+# ---- Reservas de uso alrededor de los jobs ----
+# Antes el uso se contaba en localStorage al terminar el job: el servidor gastaba Apify/ASR/LLM en
+# usuarios ya sin cupo. Ahora /job/start y /job/submit reservan una unidad (el mismo upsert
+# condicional) antes de encolar nada; el job la confirma si termina bien y la devuelve si falla
+# o se cancela. Si el proceso muere a mitad, la unidad queda gastada (falla del lado seguro).
+class _LimitReached(Exception):
+    def __init__(self, feature: str, used: int, limit: int):
+        super().__init__(f"Límite mensual alcanzado ({limit}).")
+        self.feature, self.used, self.limit = feature, used, limit
+
+@app.exception_handler(_LimitReached)
+async def _limit_reached_handler(request: Request, exc: _LimitReached):
+    return JSONResponse({"error": "limit_reached", "detail": str(exc), "feature": exc.feature,
+                         "used": exc.used, "limit": exc.limit, "remaining": 0}, status_code=409)
+
+def _usage_feature_for_mode(mode: Optional[str]) -> str:
+    return "generate_scripts" if (mode or "").strip().lower() == "creative" else "analyze_profiles"
+
+def _usage_reserve(user_id: str, feature: str) -> Optional[Dict[str, Any]]:
+    """Reserva una unidad del plan del usuario (según la base) o lanza _LimitReached. None = no se
+    cuenta (sin PostgreSQL, o la base falló: en ese caso se deja pasar el job y se registra)."""
+    if not PG_ENABLED or not user_id:
+        return None
+    _USAGE_TABLE.get()
+    plan = _usage_plan_for_user(user_id)
+    limit = _usage_limit_for_plan(plan)
+    month = _usage_month_key()
+    try:
+        ok, used = _usage_try_increment(user_id, feature, plan, month, limit)
+    except _Overloaded:
+        raise
+    except Exception as e:
+        print("[USAGE][PG] reserve failed (job allowed):", e)
+        return None
+    if not ok:
+        raise _LimitReached(feature, used, limit)
+    return {"user_id": user_id, "feature": feature, "month": month, "state": "reserved"}
+
+def _usage_commit(resv: Optional[Dict[str, Any]]) -> None:
+    if resv and resv["state"] == "reserved":
+        resv["state"] = "committed"
+
+def _usage_release(resv: Optional[Dict[str, Any]]) -> None:
+    """Devuelve la unidad reservada (job fallido, cancelado o no admitido)."""
+    if not resv or resv["state"] != "reserved":
+        return
+    resv["state"] = "released"
+    try:
+        with _pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE usage_counters SET used = GREATEST(used - 1, 0), updated_at = NOW() "
+                            "WHERE user_id=%s AND feature=%s AND month=%s RETURNING used",
+                            (resv["user_id"], resv["feature"], resv["month"]))
+                row = cur.fetchone()
+        if row:
+            _usage_cache_put(resv["user_id"], resv["feature"], resv["month"], int(row[0]))
+    except Exception as e:
+        print("[USAGE][PG] release failed:", e)
 
 @app.get("/usage/remaining")
-def usage_remaining(user_id: str, feature: str, plan: str):
+def usage_remaining(user_id: str, feature: str, plan: Optional[str] = None):
+    """`plan` se acepta por compatibilidad pero el límite sale del plan guardado en la base."""
     month = _usage_month_key()
-    limit = _usage_limit_for_plan(plan)
     if not PG_ENABLED:
         return JSONResponse({"error": "pg_disabled", "detail": "PostgreSQL no disponible (instala psycopg2 y define DATABASE_URL)."}, status_code=503)
+    _USAGE_TABLE.get()
+    plan = _usage_plan_for_user(user_id)
+    limit = _usage_limit_for_plan(plan)
     try:
-        with _pg_connect() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                cur.execute("SELECT used FROM usage_counters WHERE user_id=%s AND feature=%s AND month=%s", (user_id, feature, month))
-                row = cur.fetchone()
-                used = int(row[0]) if row else 0
+        used = _usage_cache_get(user_id, feature, month)
+        if used is None:
+            with _pg_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT used FROM usage_counters WHERE user_id=%s AND feature=%s AND month=%s", (user_id, feature, month))
+                    row = cur.fetchone()
+                    used = int(row[0]) if row else 0
+            _usage_cache_put(user_id, feature, month, used)
         remaining = max(0, limit - used)
         return {"user_id": user_id, "feature": feature, "plan": plan, "month": month, "limit": limit, "used": used, "remaining": remaining}
+    except _Overloaded:
+        raise
     except Exception as e:
         return JSONResponse({"error": "pg_error", "detail": str(e)}, status_code=500)
 
+@app.get("/usage/summary")
+def usage_summary(user_id: str, plan: Optional[str] = None, features: Optional[str] = None):
+    """Todos los contadores del mes de un usuario en una sola consulta (para pintar la UI de una vez).
+    `features` (separadas por coma) fija cuáles devolver; por defecto las conocidas + las que tengan uso.
+    El límite sale del plan guardado en la base (`plan` se ignora)."""
+    month = _usage_month_key()
+    if not PG_ENABLED:
+        return JSONResponse({"error": "pg_disabled", "detail": "PostgreSQL no disponible (instala psycopg2 y define DATABASE_URL)."}, status_code=503)
+    _USAGE_TABLE.get()
+    plan = _usage_plan_for_user(user_id)
+    limit = _usage_limit_for_plan(plan)
+    try:
+        with _pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT feature, used FROM usage_counters WHERE user_id=%s AND month=%s", (user_id, month))
+                used_by_feature = {f: int(u) for f, u in cur.fetchall()}
+    except _Overloaded:
+        raise
+    except Exception as e:
+        return JSONResponse({"error": "pg_error", "detail": str(e)}, status_code=500)
+    wanted = [f.strip() for f in features.split(",") if f.strip()] if features else \
+        list(dict.fromkeys(list(USAGE_FEATURES) + sorted(used_by_feature)))
+    out = {}
+    for feature in wanted:
+        used = used_by_feature.get(feature, 0)
+        _usage_cache_put(user_id, feature, month, used)
+        out[feature] = {"limit": limit, "used": used, "remaining": max(0, limit - used)}
+    return {"user_id": user_id, "plan": plan, "month": month, "features": out}
+
 @app.post("/usage/increment")
 def usage_increment(req: UsageIncReq):
     month = _usage_month_key()
-    limit = _usage_limit_for_plan(req.plan)
     if not PG_ENABLED:
         return JSONResponse({"error": "pg_disabled", "detail": "PostgreSQL no disponible (instala psycopg2 y define DATABASE_URL)."}, status_code=503)
+    _USAGE_TABLE.get()
+    plan = _usage_plan_for_user(req.user_id)
+    limit = _usage_limit_for_plan(plan)
     try:
-        with _pg_connect() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                # read current
-                cur.execute("SELECT used FROM usage_counters WHERE user_id=%s AND feature=%s AND month=%s FOR UPDATE", (req.user_id, req.feature, month))
-                row = cur.fetchone()
-                used = int(row[0]) if row else 0
-                if used >= limit:
-                    conn.rollback()
-                    return JSONResponse({"error": "limit_reached", "detail": f"Límite mensual alcanzado ({limit}).", "used": used, "limit": limit, "remaining": 0}, status_code=409)
-                if row:
-                    cur.execute("UPDATE usage_counters SET used=used+1, plan=%s, updated_at=NOW() WHERE user_id=%s AND feature=%s AND month=%s", (req.plan, req.user_id, req.feature, month))
-                else:
-                    cur.execute("INSERT INTO usage_counters (user_id, feature, month, plan, used) VALUES (%s, %s, %s, %s, 1)", (req.user_id, req.feature, month, req.plan))
-            conn.commit()
-        remaining = max(0, limit - (used + 1))
-        return {"ok": True, "used": used + 1, "limit": limit, "remaining": remaining, "month": month}
+        ok, used = _usage_try_increment(req.user_id, req.feature, plan, month, limit)
+        if not ok:
+            return JSONResponse({"error": "limit_reached", "detail": f"Límite mensual alcanzado ({limit}).", "used": used, "limit": limit, "remaining": 0}, status_code=409)
+        remaining = max(0, limit - used)
+        return {"ok": True, "used": used, "limit": limit, "remaining": remaining, "month": month}
+    except _Overloaded:
+        raise
     except Exception as e:
         return JSONResponse({"error": "pg_error", "detail": str(e)}, status_code=500)
 
@@ -177,6 +961,7 @@ GUIDEON_PROVIDER = os.getenv("GUIDEON_PROVIDER", "anthropic").strip().lower()
 # Anthropic (Claude)
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY", "").strip()
 CLAUDE_MODEL   = os.getenv("CLAUDE_MODEL", "claude-3-haiku-20240307").strip()
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").strip().rstrip("/")
 
 # OpenAI (o4-mini, etc.)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
@@ -186,9 +971,22 @@ OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").stri
 GUIDEON_LANG_DEFAULT = os.getenv("GUIDEON_LANG", "es").strip()
 GUIDEON_MAX_TOKENS   = int(os.getenv("GUIDEON_MAX_TOKENS", "1400"))
 GUIDEON_TEMP         = float(os.getenv("GUIDEON_TEMP", "0.5"))
+GUIDEON_MAX_VARIANTS = int(os.getenv("GUIDEON_MAX_VARIANTS", "5"))
+# Tope de tokens de salida por llamada que acepta el modelo (claude-3-haiku: 4096). Las variantes
+# comparten ese tope: si no caben todas con su presupuesto completo, se piden menos.
+GUIDEON_MAX_OUTPUT_TOKENS = int(os.getenv("GUIDEON_MAX_OUTPUT_TOKENS", "4096"))
+# Reescrituras por sección (gancho/CTA): salida corta + contexto mínimo
+GUIDEON_SECTION_MAX_TOKENS    = int(os.getenv("GUIDEON_SECTION_MAX_TOKENS", "300"))
+GUIDEON_SECTION_CONTEXT_CHARS = int(os.getenv("GUIDEON_SECTION_CONTEXT_CHARS", "400"))
+
+# Batch (offline) mode for creative jobs: Anthropic Message Batches / OpenAI Batch
+GUIDEON_BATCH_POLL_SEC    = int(os.getenv("GUIDEON_BATCH_POLL_SEC", "30"))
+GUIDEON_BATCH_TIMEOUT_SEC = int(os.getenv("GUIDEON_BATCH_TIMEOUT_SEC", str(24 * 3600)))
+GUIDEON_BATCH_TTL_SEC     = int(os.getenv("GUIDEON_BATCH_TTL_SEC", str(6 * 3600)))  # estado consultable tras terminar
 
 
 _PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+# Por proceso a propósito: son unos KB leídos de archivos que ya están en disco en cada worker
 _PROMPT_CACHE: Dict[str, str] = {}
 
 def _load_prompt(name: str) -> str:
@@ -231,18 +1029,21 @@ DEBUG_GUIDEON = os.getenv("DEBUG_GUIDEON", "0").lower() in ("1", "true", "yes")
 # ---- ASR debug flag ----
 DEBUG_ASR = os.getenv("DEBUG_ASR", "0").lower() in ("1", "true", "yes")
 
-if DEBUG_APIFY:
-    print("[APIFY] Config:", {
-        "APIFY_TOKEN": bool(os.getenv("APIFY_TOKEN")),
-        "APIFY_IG_ACTOR": APIFY_IG_ACTOR,
-        "APIFY_TT_ACTOR": APIFY_TT_ACTOR,
-        "APIFY_ONLY": APIFY_ONLY,
-    })
+def _log_config() -> bool:
+    """Config de GUIDEON/APIFY al arrancar el servidor (no al importar el módulo)."""
+    if DEBUG_APIFY:
+        print("[APIFY] Config:", {
+            "APIFY_TOKEN": bool(os.getenv("APIFY_TOKEN")),
+            "APIFY_IG_ACTOR": APIFY_IG_ACTOR,
+            "APIFY_TT_ACTOR": APIFY_TT_ACTOR,
+            "APIFY_ONLY": APIFY_ONLY,
+        })
+    print(f"[GUIDEON] Provider: {GUIDEON_PROVIDER} | ClaudeModel={CLAUDE_MODEL} | OpenAIModel={OPENAI_MODEL}")
+    if DEBUG_GUIDEON:
+        print("[GUIDEON] DEBUG enabled")
+    return True
 
-# Print GUIDEON provider config at startup
-print(f"[GUIDEON] Provider: {GUIDEON_PROVIDER} | ClaudeModel={CLAUDE_MODEL} | OpenAIModel={OPENAI_MODEL}")
-if DEBUG_GUIDEON:
-    print("[GUIDEON] DEBUG enabled")
+_LazyInit("log_config", _log_config)
 
 # Serve static UI from /public
 PUBLIC_DIR = os.path.join(os.path.dirname(__file__), "public")
@@ -272,9 +1073,32 @@ class JobReq(BaseModel):
     # nuevos campos para ordenamiento
     sort_by: Optional[str] = "score"   # "score" | "views" | "likes" | "comments"
     order: Optional[str] = "desc"      # "asc" | "desc"
+    plan: Optional[str] = None         # "starter" | "pro" (peso en el reparto de capacidad)
+    refresh: Optional[bool] = False    # True = recalcular aunque haya un resultado reciente guardado
 
 class TranscribeReq(BaseModel):
     url: HttpUrl
+    user_id: Optional[str] = None
+    plan: Optional[str] = None
+
+class TranscribeBatchItem(BaseModel):
+    url: HttpUrl
+    media_url: Optional[str] = None    # pista: URL directa del video/HLS si ya se conoce
+    segments: Optional[bool] = False   # incluir segmentos de Whisper con timestamps
+
+class TranscribeBatchReq(BaseModel):
+    items: List[TranscribeBatchItem]
+    user_id: Optional[str] = None
+    plan: Optional[str] = None
+
+class RankWindowsReq(BaseModel):
+    profiles: List[Profile]
+    windows: List[str] = ["7d", "21d", "60d"]
+    num_scripts: int = 5
+    sort_by: Optional[str] = "score"
+    order: Optional[str] = "desc"
+    user_id: Optional[str] = None
+    plan: Optional[str] = None
 
 # --- Inserted: RewriteReq model for per-card rewrites ---
 class RewriteReq(BaseModel):
@@ -286,9 +1110,58 @@ class RewriteReq(BaseModel):
     rules_source: Optional[str] = "guideon"       # 'guideon' | 'custom'
     custom_rules: Optional[str] = ""
     lang: Optional[str] = None
+    n_variants: Optional[int] = 1                  # K alternativas en una sola generación
+    section: Optional[str] = "auto"               # 'auto' | 'hook' | 'cta' | 'full'
+    user_id: Optional[str] = None
+    plan: Optional[str] = None
 
 # ---------- Data types ----------
-Post = Dict[str, Any]  # {platform_post_id, url, posted_at, views, likes, comments, duration_sec}
+@dataclass(slots=True)
+class Post:
+    """Post normalizado de cualquier fetcher. Compacto (slots, sin dict por instancia), fecha como
+    epoch UTC en segundos y strings repetidos (plataforma, tipo de media) internados. Sólo se
+    convierte a dict en el borde JSON (`metrics()` / `to_dict()`)."""
+    platform: str
+    platform_post_id: str
+    url: str
+    posted_ts: int
+    views: int = 0
+    likes: int = 0
+    comments: int = 0
+    duration_sec: int = 0
+    media_url: str = ""
+    is_video: bool = False
+    media_type: str = ""   # "video" | "image" | "carousel" ("" si el fetcher no lo sabe)
+    score: float = 0.0
+    profile: str = ""      # handle del perfil de origen (lo asigna _collect_posts)
+
+    @property
+    def posted_at(self) -> str:
+        return datetime.fromtimestamp(self.posted_ts, tz=timezone.utc).isoformat()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"views": self.views, "likes": self.likes, "comments": self.comments, "score": self.score}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"platform": self.platform, "platform_post_id": self.platform_post_id, "url": self.url,
+                "posted_at": self.posted_at, "duration_sec": self.duration_sec, "media_url": self.media_url,
+                "is_video": self.is_video, "media_type": self.media_type, **self.metrics()}
+
+def _new_post(platform: str, post_id: Any, url: Any, dt: datetime, views: Any = 0, likes: Any = 0,
+              comments: Any = 0, duration: Any = 0, media_url: Any = "", media_type: str = "") -> Post:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return Post(
+        platform=sys.intern(platform), platform_post_id=str(post_id), url=str(url),
+        posted_ts=int(dt.timestamp()),
+        views=int(views) if views else 0,
+        likes=int(likes) if likes else 0,
+        comments=int(comments) if comments else 0,
+        duration_sec=int(duration) if duration else 0,
+        media_url=str(media_url) if media_url else "",
+        is_video=media_type == "video",
+        media_type=sys.intern(media_type),
+    )
 
 # ---------- Window parsing ----------
 def parse_window(window: str) -> tuple[datetime, datetime]:
@@ -298,23 +1171,6 @@ def parse_window(window: str) -> tuple[datetime, datetime]:
     start = now - timedelta(days=days)
     return (start, now)
 
-# ---------- Scoring ----------
-def compute_baseline(posts: List[Post]) -> float:
-    if not posts:
-        return 1.0
-    views = [max(int(p.get("views") or 0), 0) for p in posts][:10]
-    avg = sum(views) / max(len(views), 1)
-    return max(avg, 1.0)
-
-def score_post(post: Post, baseline: float) -> float:
-    views = max(int(post.get("views") or 0), 0)
-    likes = max(int(post.get("likes") or 0), 0)
-    comments = max(int(post.get("comments") or 0), 0)
-    eng = (likes + comments) / max(views, 1)
-    growth = (views - baseline) / max(baseline, 1)
-    score = 100.0 * (0.6 * growth + 0.4 * eng)
-    return round(score, 2)
-
 # ---------- YouTube provider (auto-select best videos by profile + date range) ----------
 def fetch_youtube_posts(profile_url: str, start: datetime, end: datetime) -> List[Post]:
     """
@@ -403,15 +1259,8 @@ def fetch_youtube_posts(profile_url: str, start: datetime, end: datetime) -> Lis
         likes = v.get("like_count") or 0
         comments = v.get("comment_count") or 0
 
-        posts.append({
-            "platform_post_id": v.get("id") or video_url,
-            "url": v.get("webpage_url") or video_url,
-            "posted_at": dt.isoformat(),
-            "views": int(views) if views else 0,
-            "likes": int(likes) if likes else 0,
-            "comments": int(comments) if comments else 0,
-            "duration_sec": int(duration) if duration else 0,
-        })
+        posts.append(_new_post("youtube", v.get("id") or video_url, v.get("webpage_url") or video_url, dt,
+                               views, likes, comments, duration))
 
     return posts
 
@@ -423,7 +1272,7 @@ def _run_apify_actor(actor: str, token: str, payload: dict, run_timeout_sec: int
     """
     run_url = f"https://api.apify.com/v2/acts/{urllib.parse.quote(actor)}/runs?token={token}"
     try:
-        run = requests.post(run_url, json=payload, timeout=30)
+        run = _HTTP.post(run_url, json=payload, timeout=30)
         run.raise_for_status()
         run_id = (run.json().get("data") or {}).get("id")
         if not run_id:
@@ -441,8 +1290,18 @@ def _run_apify_actor(actor: str, token: str, payload: dict, run_timeout_sec: int
     deadline = time.time() + run_timeout_sec
     dataset_items = []
     while time.time() < deadline:
+        if _cancel_requested():
+            # Job cancelado: aborta el run en Apify para no seguir consumiendo cómputo
+            try:
+                _HTTP.post(f"https://api.apify.com/v2/actor-runs/{run_id}/abort?token={token}", timeout=10)
+                if DEBUG_APIFY:
+                    print(f"[APIFY][{debug_tag}] run aborted (job cancelled) run_id={run_id}")
+            except Exception as e:
+                if DEBUG_APIFY:
+                    print(f"[APIFY][{debug_tag}] abort failed: {e}")
+            raise _Cancelled()
         try:
-            st = requests.get(status_url, timeout=15).json()
+            st = _HTTP.get(status_url, timeout=15).json()
         except Exception:
             break
         data = st.get("data") or {}
@@ -454,7 +1313,7 @@ def _run_apify_actor(actor: str, token: str, payload: dict, run_timeout_sec: int
             if status == "SUCCEEDED" and dataset_id:
                 items_url = f"https://api.apify.com/v2/datasets/{dataset_id}/items?clean=true"
                 try:
-                    resp = requests.get(items_url, timeout=60)
+                    resp = _HTTP.get(items_url, timeout=60)
                     resp.raise_for_status()
                     dataset_items = resp.json() or []
                     if DEBUG_APIFY:
@@ -473,8 +1332,9 @@ def _run_apify_actor_sync_items(actor: str, token: str, payload: dict, debug_tag
     Devuelve directamente la lista de items (array JSON) o [] si falla.
     """
     url = f"https://api.apify.com/v2/acts/{urllib.parse.quote(actor)}/run-sync-get-dataset-items?token={token}"
+    _check_cancelled()
     try:
-        resp = requests.post(url, json=payload, timeout=120)
+        resp = _HTTP.post(url, json=payload, timeout=120)
         if resp.status_code >= 400:
             if DEBUG_APIFY:
                 print(f"[APIFY][{debug_tag}] sync HTTP {resp.status_code}: {resp.text[:300]} ...")
@@ -618,18 +1478,8 @@ def fetch_instagram_posts_apify(profile_url: str, start: datetime, end: datetime
         else:
             media_type = "image"
 
-        posts.append({
-            "platform_post_id": str(it.get("id") or it.get("shortCode") or url),
-            "url": str(url),
-            "posted_at": dt.isoformat(),
-            "views": int(views) if views else 0,
-            "likes": int(likes) if likes else 0,
-            "comments": int(comments) if comments else 0,
-            "duration_sec": int(duration) if duration else 0,
-            "media_url": str(media_url) if media_url else "",
-            "is_video": (media_type == "video"),
-            "media_type": media_type,
-        })
+        posts.append(_new_post("instagram", it.get("id") or it.get("shortCode") or url, url, dt,
+                               views, likes, comments, duration, media_url, media_type))
     return posts
 
 # ---- Helper: Resolve Instagram media via Apify for a direct post URL ----
@@ -665,13 +1515,14 @@ def _resolve_instagram_media_via_apify(post_url: str) -> str:
     payloads.append((C, "IG-post-C:resultsType=posts"))
 
     items = []
-    for payload, tag in payloads:
-        items = _run_apify_actor_sync_items(actor, token, payload, debug_tag=tag)
-        if items:
-            break
-        items = _run_apify_actor(actor, token, payload, run_timeout_sec=int(os.getenv("APIFY_RUN_TIMEOUT_SEC", "120")), debug_tag=tag)
-        if items:
-            break
+    with _BUDGETS["scrape"].slot():
+        for payload, tag in payloads:
+            items = _run_apify_actor_sync_items(actor, token, payload, debug_tag=tag)
+            if items:
+                break
+            items = _run_apify_actor(actor, token, payload, run_timeout_sec=int(os.getenv("APIFY_RUN_TIMEOUT_SEC", "120")), debug_tag=tag)
+            if items:
+                break
 
     if not items:
         if DEBUG_APIFY:
@@ -810,19 +1661,8 @@ def fetch_tiktok_posts_apify(profile_url: str, start: datetime, end: datetime, l
             or ""
         )
 
-        is_video = True
-        posts.append({
-            "platform_post_id": str(it.get("id") or url),
-            "url": str(url),
-            "posted_at": dt.isoformat(),
-            "views": int(views) if views else 0,
-            "likes": int(likes) if likes else 0,
-            "comments": int(comments) if comments else 0,
-            "duration_sec": int(duration) if duration else 0,
-            "media_url": str(media_url) if media_url else "",
-            "is_video": bool(is_video),
-            "media_type": "video",
-        })
+        posts.append(_new_post("tiktok", it.get("id") or url, url, dt,
+                               views, likes, comments, duration, media_url, "video"))
 
     return posts
 
@@ -842,6 +1682,7 @@ def mock_fetch_instagram_posts(profile_url: str, start: datetime, end: datetime)
         return []
 
     ua = os.getenv("YTDLP_UA", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+    _INLINE_COOKIES.get()
     cookie_file = os.getenv("YTDLP_COOKIES", "").strip()
     cookies_from_browser = os.getenv("YTDLP_COOKIES_FROM_BROWSER", "").strip()
 
@@ -921,15 +1762,8 @@ def mock_fetch_instagram_posts(profile_url: str, start: datetime, end: datetime)
         likes = v.get("like_count") or 0
         comments = v.get("comment_count") or 0
 
-        posts.append({
-            "platform_post_id": v.get("id") or video_url,
-            "url": v.get("webpage_url") or video_url,
-            "posted_at": dt.isoformat(),
-            "views": int(views) if views else 0,
-            "likes": int(likes) if likes else 0,
-            "comments": int(comments) if comments else 0,
-            "duration_sec": int(duration) if duration else 0,
-        })
+        posts.append(_new_post("instagram", v.get("id") or video_url, v.get("webpage_url") or video_url, dt,
+                               views, likes, comments, duration))
     return posts
 
 def mock_fetch_tiktok_posts(profile_url: str, start: datetime, end: datetime) -> List[Post]:
@@ -946,6 +1780,7 @@ def mock_fetch_tiktok_posts(profile_url: str, start: datetime, end: datetime) ->
         return []
 
     ua = os.getenv("YTDLP_UA", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+    _INLINE_COOKIES.get()
     cookie_file = os.getenv("YTDLP_COOKIES", "").strip()
     cookies_from_browser = os.getenv("YTDLP_COOKIES_FROM_BROWSER", "").strip()
 
@@ -1016,78 +1851,197 @@ def mock_fetch_tiktok_posts(profile_url: str, start: datetime, end: datetime) ->
         likes = v.get("like_count") or 0
         comments = v.get("comment_count") or 0
 
-        posts.append({
-            "platform_post_id": v.get("id") or video_url,
-            "url": v.get("webpage_url") or video_url,
-            "posted_at": dt.isoformat(),
-            "views": int(views) if views else 0,
-            "likes": int(likes) if likes else 0,
-            "comments": int(comments) if comments else 0,
-            "duration_sec": int(duration) if duration else 0,
-        })
+        posts.append(_new_post("tiktok", v.get("id") or video_url, v.get("webpage_url") or video_url, dt,
+                               views, likes, comments, duration))
     return posts
 
 def filter_by_window(posts: List[Post], start: datetime, end: datetime) -> List[Post]:
-    keep: List[Post] = []
-    for p in posts:
-        try:
-            dt = datetime.fromisoformat(str(p.get("posted_at")))
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-        except Exception:
-            continue
-        if start <= dt <= end:
-            keep.append(p)
-    return keep
-
-def select_top_posts(all_posts: List[Post], num_scripts: int, sort_by: str = "score", order: str = "desc") -> List[Post]:
-    sort_by = (sort_by or "score").lower()
-    order = (order or "desc").lower()
-    reverse = (order != "asc")
-
-    # Precalcula score si hace falta
-    ranked = []
-    if sort_by == "score":
-        baseline = compute_baseline(all_posts)
-        for p in all_posts:
-            q = p.copy()
-            q["score"] = score_post(p, baseline)
-            ranked.append(q)
-    else:
-        for p in all_posts:
-            # asegura que exista una key de score por compatibilidad de UI
-            q = p.copy()
-            q.setdefault("score", 0.0)
-            ranked.append(q)
-
-    # Clave de ordenamiento
-    if sort_by in ("views", "likes", "comments", "score"):
-        keyfn = lambda x: (x.get(sort_by) or 0)
+    lo, hi = start.timestamp(), end.timestamp()
+    return [p for p in posts if lo <= p.posted_ts <= hi]
+
+# ---------- Ranking engine (columnar, NumPy) ----------
+# Con miles de posts (APIFY_DATASET_LIMIT alto, varios perfiles) el ranking se hace sobre columnas:
+# una pasada para armar los arrays, scores de todos los posts en bloque y Top-N por selección
+# parcial (argpartition) en vez de copiar cada post y ordenar la lista entera.
+_RANK_KEYS = ("score", "views", "likes", "comments")
+
+def _rank_columns(posts: List[Post]) -> Dict[str, Any]:
+    import numpy as np
+    n = len(posts)
+    return {"views": np.fromiter((p.views for p in posts), dtype=np.float64, count=n),
+            "likes": np.fromiter((p.likes for p in posts), dtype=np.float64, count=n),
+            "comments": np.fromiter((p.comments for p in posts), dtype=np.float64, count=n),
+            "ts": np.fromiter((p.posted_ts for p in posts), dtype=np.float64, count=n)}
+
+def _rank_baseline(cols: Dict[str, Any], sample: int = 10) -> float:
+    """Promedio de views de los `sample` posts más recientes (antes: los 10 primeros en el orden
+    en que llegaron del fetcher, que dependía del proveedor)."""
+    import numpy as np
+    views = np.maximum(cols["views"], 0)
+    if not len(views):
+        return 1.0
+    # Empates de fecha: gana el que llegó después (igual que la cola de un orden estable por fecha)
+    recent = _top_n_indices(cols["ts"], sample, descending=True, tiebreak=-np.arange(len(views)))
+    return max(float(views[recent].mean()), 1.0)
+
+def _rank_scores(cols: Dict[str, Any], baseline):
+    """Score de cada fila: 100·(0.6·crecimiento sobre el baseline + 0.4·engagement), redondeado a
+    2 decimales (`baseline` escalar o uno por fila)."""
+    import numpy as np
+    views = np.maximum(cols["views"], 0)
+    eng = (np.maximum(cols["likes"], 0) + np.maximum(cols["comments"], 0)) / np.maximum(views, 1)
+    growth = (views - baseline) / np.maximum(baseline, 1)
+    return np.round(100.0 * (0.6 * growth + 0.4 * eng), 2)
+
+def _top_n_indices(values, n: int, descending: bool = True, tiebreak=None):
+    """Índices de los n mejores por selección parcial, en orden; empates en orden de llegada
+    (igual que el sort estable de antes) o por `tiebreak` si se pasa."""
+    import numpy as np
+    key = -values if descending else values
+    total = len(key)
+    n = min(n, total)
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    if n < total:
+        kth = np.partition(key, n - 1)[n - 1]
+        cand = np.flatnonzero(key <= kth)  # incluye todos los empatados con el n-ésimo
     else:
-        # default a score
-        keyfn = lambda x: (x.get("score") or 0)
+        cand = np.arange(total)
+    return cand[np.lexsort((cand if tiebreak is None else tiebreak[cand], key[cand]))][:n]
+
+# ---------- Per-profile rolling engagement stats ----------
+# Baseline propio de cada creador en vez del promedio de los primeros posts de la lista mezclada:
+# cada recolección actualiza (platform, handle) con sus posts más recientes (medias, medianas y
+# EWMA de views y engagement) y el ranking consulta el baseline ya calculado en O(1).
+PROFILE_STATS_TTL_SEC = int(os.getenv("PROFILE_STATS_TTL_SEC", str(90 * 86400)))
+PROFILE_STATS_WINDOW = int(os.getenv("PROFILE_STATS_WINDOW", "50"))      # posts recientes por perfil
+PROFILE_STATS_ALPHA = float(os.getenv("PROFILE_STATS_ALPHA", "0.2"))     # peso del post nuevo en la EWMA
+PROFILE_STATS_MIN_POSTS = int(os.getenv("PROFILE_STATS_MIN_POSTS", "3")) # menos posts -> baseline de la ventana
+PROFILE_BASELINE_STAT = os.getenv("PROFILE_BASELINE_STAT", "median_views").strip().lower()  # median_views | mean_views | ewma_views
+
+def _profile_handle(url: str) -> str:
+    """instagram.com/foo, tiktok.com/@foo, youtube.com/@foo, youtube.com/channel/ID -> handle en minúsculas."""
+    segs = [s for s in urllib.parse.urlsplit(_normalize_post_url(url)).path.split("/") if s]
+    if len(segs) > 1 and segs[0] in ("channel", "c", "user"):
+        segs = segs[1:]
+    return segs[0].lstrip("@").lower() if segs else ""
+
+class _ProfileStats:
+    """Agregados por perfil sobre sus últimos PROFILE_STATS_WINDOW posts (guardados con su último
+    conteo de views, así un post re-scrapeado se actualiza en vez de contarse dos veces).
+    Vive en la cache compartida: todos los workers ven el mismo baseline."""
+
+    def __init__(self):
+        self._cache = _SharedCache("profile_stats", ttl_sec=PROFILE_STATS_TTL_SEC, max_entries=20000)
+
+    def ingest(self, platform: str, handle: str, posts: List[Post]) -> Optional[Dict[str, Any]]:
+        if not handle or not posts:
+            return None
 
-    ranked.sort(key=keyfn, reverse=reverse)
+        def apply(state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            state = state or {"posts": {}, "ewma_views": None, "ewma_eng": None, "last_ts": 0}
+            seen = state["posts"]
+            for p in posts:
+                seen[p.platform_post_id] = [p.posted_ts, p.views, (p.likes + p.comments) / max(p.views, 1)]
+            # EWMA en orden cronológico, sólo con posts más nuevos que el último ya incorporado
+            a = PROFILE_STATS_ALPHA
+            for p in sorted((p for p in posts if p.posted_ts > state["last_ts"]), key=lambda p: p.posted_ts):
+                ts, views, eng = seen[p.platform_post_id]
+                state["ewma_views"] = views if state["ewma_views"] is None else a * views + (1 - a) * state["ewma_views"]
+                state["ewma_eng"] = eng if state["ewma_eng"] is None else a * eng + (1 - a) * state["ewma_eng"]
+                state["last_ts"] = ts
+            if len(seen) > PROFILE_STATS_WINDOW:
+                keep = sorted(seen.items(), key=lambda kv: kv[1][0])[-PROFILE_STATS_WINDOW:]
+                state["posts"] = seen = dict(keep)
+            views = [v for _, v, _ in seen.values()]
+            engs = [e for _, _, e in seen.values()]
+            state.update(n=len(views), mean_views=statistics.fmean(views), median_views=statistics.median(views),
+                         mean_eng=statistics.fmean(engs), median_eng=statistics.median(engs), updated_at=time.time())
+            return state
+
+        # Una sola transacción en la cache compartida: ingestas concurrentes de otros workers no se pierden
+        return self._cache.update(f"{platform}:{handle}", apply)
+
+    def get(self, platform: str, handle: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get(f"{platform}:{handle}") if handle else None
+
+    def baseline(self, platform: str, handle: str) -> Optional[float]:
+        state = self.get(platform, handle)
+        if not state or state.get("n", 0) < PROFILE_STATS_MIN_POSTS:
+            return None
+        value = state.get(PROFILE_BASELINE_STAT)
+        return max(float(value), 1.0) if value is not None else None
+
+_PROFILE_STATS = _ProfileStats()
+
+def _profile_baselines(posts: List[Post]):
+    """Baseline del perfil de cada post (NaN si no tiene estadísticas), o None si ninguno tiene."""
+    import numpy as np
+    per_profile = {}
+    for key in {(p.platform, p.profile) for p in posts if p.profile}:
+        per_profile[key] = _PROFILE_STATS.baseline(*key)
+    if not any(v is not None for v in per_profile.values()):
+        return None
+    nan = float("nan")
+    return np.fromiter((per_profile.get((p.platform, p.profile)) or nan for p in posts), dtype=np.float64, count=len(posts))
 
-    # Fallbacks si quedara vacía la lista
-    if not ranked:
-        tmp = []
-        for p in all_posts:
-            q = p.copy()
-            q["score"] = (int(p.get("likes") or 0) + int(p.get("comments") or 0))
-            tmp.append(q)
-        tmp.sort(key=lambda x: (x.get("score", 0), x.get("likes", 0)), reverse=True)
-        if tmp:
-            return tmp[: max(1, min(num_scripts, 5))]
-        return all_posts[: max(1, min(num_scripts, 5))]
+def _with_fallback(per_row, fallback: float):
+    import numpy as np
+    return fallback if per_row is None else np.where(np.isnan(per_row), fallback, per_row)
 
-    return ranked[: max(1, min(num_scripts, 5))]
+def select_top_posts(all_posts: List[Post], num_scripts: int, sort_by: str = "score", order: str = "desc") -> List[Post]:
+    sort_by = (sort_by or "score").lower()
+    if sort_by not in _RANK_KEYS:
+        sort_by = "score"
+    if not all_posts:
+        return []
+    cols = _rank_columns(all_posts)
+    cols["score"] = _rank_scores(cols, _with_fallback(_profile_baselines(all_posts), _rank_baseline(cols)))
+    top = _top_n_indices(cols[sort_by], max(1, min(num_scripts, 5)), descending=(order or "desc").lower() != "asc")
+    # Sólo se copian los posts elegidos
+    return [dc_replace(all_posts[i], score=float(cols["score"][i])) for i in top]
+
+def rank_windows(posts: List[Post], windows: Dict[str, tuple], num_scripts: int,
+                 sort_by: str = "score", order: str = "desc") -> Dict[str, Dict[str, Any]]:
+    """Top-N de varias ventanas {label: (start, end)} sobre una sola colección de posts.
+    Se ordena una vez por fecha; cada ventana es un tramo contiguo [lo, hi) encontrado por
+    búsqueda binaria, su baseline de respaldo (views medias de sus 10 posts más recientes, para
+    posts sin estadísticas de perfil) sale de sumas acumuladas en O(1), y su Top-N igual que
+    select_top_posts (mismo score, mismos empates)."""
+    import numpy as np
+    sort_by = (sort_by or "score").lower()
+    if sort_by not in _RANK_KEYS:
+        sort_by = "score"
+    descending = (order or "desc").lower() != "asc"
+    n = max(1, min(num_scripts, 5))
+    cols = _rank_columns(posts)
+    by_time = np.argsort(cols["ts"], kind="stable")
+    ts = cols["ts"][by_time]
+    cum_views = np.concatenate(([0.0], np.cumsum(np.maximum(cols["views"][by_time], 0))))
+    per_row = _profile_baselines(posts)
+    out: Dict[str, Dict[str, Any]] = {}
+    for label, (start, end) in windows.items():
+        lo = int(np.searchsorted(ts, start.timestamp(), side="left"))
+        hi = int(np.searchsorted(ts, end.timestamp(), side="right"))
+        k = min(10, hi - lo)
+        if k <= 0:
+            out[label] = {"posts": 0, "baseline": 1.0, "top": []}
+            continue
+        baseline = max(float(cum_views[hi] - cum_views[hi - k]) / k, 1.0)
+        idx = by_time[lo:hi]
+        sub = {key: cols[key][idx] for key in ("views", "likes", "comments")}
+        scores = _rank_scores(sub, _with_fallback(None if per_row is None else per_row[idx], baseline))
+        top = _top_n_indices(scores if sort_by == "score" else sub[sort_by], n, descending, tiebreak=idx)
+        out[label] = {"posts": hi - lo, "baseline": round(baseline, 2),
+                      "top": [dc_replace(posts[idx[i]], score=float(scores[i])) for i in top]}
+    return out
 
 # ---------- ASR helpers (yt-dlp + ffmpeg + faster-whisper) ----------
 def _download_audio(url: str, out_dir: str) -> str:
     out_tmpl = os.path.join(out_dir, "input.%(ext)s")
     out_wav = os.path.join(out_dir, "input.wav")
     ua = os.getenv("YTDLP_UA", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+    _INLINE_COOKIES.get()
     cookie_file = os.getenv("YTDLP_COOKIES", "").strip()
     cookies_from_browser = os.getenv("YTDLP_COOKIES_FROM_BROWSER", "").strip()
 
@@ -1123,7 +2077,8 @@ def _download_audio(url: str, out_dir: str) -> str:
         try:
             if DEBUG_ASR:
                 print("[ASR] yt-dlp cmd:", " ".join(base_cmd))
-            res = subprocess.run(base_cmd, check=True, capture_output=True)
+            with _BUDGETS["download"].slot():
+                res = _run_subprocess(base_cmd)
             if DEBUG_ASR:
                 try:
                     print("[ASR] yt-dlp stdout:", res.stdout.decode('utf-8','ignore')[:1000])
@@ -1144,8 +2099,11 @@ def _download_audio(url: str, out_dir: str) -> str:
                     raise RuntimeError("No se pudo descargar el audio (no se encontró archivo de salida de yt-dlp).")
                 # convierte a wav
                 latest = max(files, key=lambda p: os.path.getmtime(p))
-                subprocess.run(["ffmpeg", "-y", "-i", latest, "-ac", "1", "-ar", "16000", out_wav], check=True, capture_output=True)
+                with _BUDGETS["ffmpeg"].slot():
+                    _run_subprocess(["ffmpeg", "-y", "-i", latest, "-ac", "1", "-ar", "16000", out_wav])
             return out_wav
+        except _Overloaded:
+            raise
         except subprocess.CalledProcessError as e:
             stdout = e.stdout.decode('utf-8','ignore')[:400]
             stderr = e.stderr.decode('utf-8','ignore')[:800]
@@ -1195,7 +2153,9 @@ def _download_media_direct(media_url: str, out_dir: str) -> str:
             "-ac", "1", "-ar", "16000",
             wav_path,
         ]
-        subprocess.run(cmd, check=True, capture_output=True)
+        # HLS: ffmpeg descarga y convierte a la vez
+        with _BUDGETS["download"].slot(), _BUDGETS["ffmpeg"].slot():
+            _run_subprocess(cmd)
         if DEBUG_ASR:
             print("[ASR] ffmpeg HLS ->", wav_path, os.path.exists(wav_path))
         return wav_path
@@ -1204,36 +2164,435 @@ def _download_media_direct(media_url: str, out_dir: str) -> str:
     mp4_path = os.path.join(out_dir, "input.mp4")
     for attempt in (1, 2):
         try:
-            with requests.get(media_url, headers=headers, stream=True, timeout=60) as r:
-                r.raise_for_status()
-                with open(mp4_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=1024 * 256):
-                        if chunk:
-                            f.write(chunk)
+            with _BUDGETS["download"].slot():
+                with _HTTP.get(media_url, headers=headers, stream=True, timeout=60) as r:
+                    r.raise_for_status()
+                    with open(mp4_path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size=1024 * 256):
+                            _check_cancelled()
+                            if chunk:
+                                f.write(chunk)
             break
+        except _Overloaded:
+            raise
         except Exception as e:
             if attempt >= 2:
                 raise RuntimeError(f"media direct download failed: {str(e)[:300]}")
             time.sleep(1)
 
-    subprocess.run(["ffmpeg", "-y", "-i", mp4_path, "-ac", "1", "-ar", "16000", wav_path], check=True, capture_output=True)
+    with _BUDGETS["ffmpeg"].slot():
+        _run_subprocess(["ffmpeg", "-y", "-i", mp4_path, "-ac", "1", "-ar", "16000", wav_path])
     if DEBUG_ASR:
         print("[ASR] ffmpeg file ->", wav_path, os.path.exists(wav_path))
     return wav_path
 
-def _whisper_transcribe(audio_path: str) -> str:
+# Servicio ASR compartido: con varios workers, uno solo carga Whisper y el resto le envía el WAV
+ASR_SERVICE_URL = os.getenv("ASR_SERVICE_URL", "").strip().rstrip("/")
+ASR_SERVICE_TOKEN = os.getenv("ASR_SERVICE_TOKEN", "").strip()
+ASR_SERVICE_TIMEOUT_SEC = int(os.getenv("ASR_SERVICE_TIMEOUT_SEC", "900"))
+# Esta instancia ES el servicio ASR: expone POST /asr/segments (sólo si además hay ASR_SERVICE_TOKEN)
+ASR_SERVICE_MODE = os.getenv("ASR_SERVICE_MODE", "0").lower() in ("1", "true", "yes")
+ASR_SERVICE_MAX_BYTES = int(os.getenv("ASR_SERVICE_MAX_BYTES", str(64 * 1024 * 1024)))  # ~30 min de WAV 16 kHz mono
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "0"))  # 0 = default de faster-whisper
+ASR_MODEL = os.getenv("ASR_MODEL", "small")
+# Pesos incluidos en la imagen (python asr_models.py fetch <tamaño> en el build). Con
+# ASR_MODEL_OFFLINE=1 sólo se carga desde ASR_MODEL_DIR y nunca se descarga del hub.
+ASR_MODEL_DIR = os.getenv("ASR_MODEL_DIR", "").strip() or os.path.join(os.path.dirname(__file__), "models")
+ASR_MODEL_OFFLINE = os.getenv("ASR_MODEL_OFFLINE", "0").lower() in ("1", "true", "yes")
+ASR_MODEL_VERIFY = os.getenv("ASR_MODEL_VERIFY", "size").strip().lower()  # size | full | off
+_ASR_PLACEHOLDER = "Transcripción de ejemplo (instala/configura faster-whisper para texto real)."
+
+_WHISPER_MODELS: Dict[str, Any] = {}
+_WHISPER_LOCK = threading.Lock()
+
+def _whisper_model_source(model_size: str) -> str:
+    """Ruta local del modelo si está incluido (y verificado contra su manifest); si no, el nombre
+    para descargarlo del hub, salvo en modo offline."""
+    import asr_models
+    path = asr_models.model_dir(model_size, ASR_MODEL_DIR)
+    if asr_models.read_manifest(path):
+        problems = [] if ASR_MODEL_VERIFY == "off" else asr_models.verify(path, full=ASR_MODEL_VERIFY == "full")
+        if problems:
+            raise RuntimeError(f"ASR model '{model_size}' in {path} failed verification: " + "; ".join(problems))
+        return path
+    if ASR_MODEL_OFFLINE:
+        raise RuntimeError(f"ASR model '{model_size}' not found in {ASR_MODEL_DIR} and ASR_MODEL_OFFLINE=1 "
+                           f"(run `python asr_models.py fetch {model_size}` at build time)")
+    return model_size
+
+def _get_whisper_model(model_size: str):
+    """Modelo Whisper cargado una vez por proceso (antes se instanciaba en cada transcripción)."""
+    with _WHISPER_LOCK:
+        model = _WHISPER_MODELS.get(model_size)
+        if model is None:
+            source = _whisper_model_source(model_size)
+            if ASR_MODEL_OFFLINE:
+                os.environ.setdefault("HF_HUB_OFFLINE", "1")
+            from faster_whisper import WhisperModel
+            model = WhisperModel(source, compute_type="int8", cpu_threads=ASR_CPU_THREADS,
+                                 local_files_only=source != model_size or ASR_MODEL_OFFLINE)
+            _WHISPER_MODELS[model_size] = model
+            if DEBUG_ASR:
+                print("[ASR] whisper model loaded:", model_size, "from", source)
+        return model
+
+def _remote_whisper_segments(audio_path: str) -> List[Dict[str, Any]]:
+    """Envía el WAV al servicio ASR (POST /asr/segments) con el contexto de scheduling del hilo,
+    para que el servicio aplique la misma prioridad / reparto por usuario."""
+    _check_cancelled()
+    headers = {
+        "Content-Type": "audio/wav",
+        "X-Work-Bulk": "1" if getattr(_WORK_CTX, "bulk", False) else "0",
+        "X-User-Id": getattr(_WORK_CTX, "user_id", None) or "anon",
+        "X-Plan": getattr(_WORK_CTX, "plan", None) or "",
+    }
+    if ASR_SERVICE_TOKEN:
+        headers["Authorization"] = f"Bearer {ASR_SERVICE_TOKEN}"
+    with open(audio_path, "rb") as f:
+        resp = _HTTP.post(f"{ASR_SERVICE_URL}/asr/segments", data=f, headers=headers, timeout=ASR_SERVICE_TIMEOUT_SEC)
+    if resp.status_code == 503:
+        data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+        raise _Overloaded("asr", int(resp.headers.get("Retry-After") or data.get("retry_after") or 5),
+                          data.get("detail") or "Servicio ASR saturado.")
+    if resp.status_code >= 400:
+        raise RuntimeError(f"asr_service HTTP {resp.status_code}: {resp.text[:300]}")
+    _check_cancelled()
+    return resp.json().get("segments") or []
+
+def _whisper_segments(audio_path: str) -> List[Dict[str, Any]]:
+    """Segmentos de Whisper [{start, end, text}] (segundos)."""
+    if ASR_SERVICE_URL:
+        return _remote_whisper_segments(audio_path)
     try:
-        from faster_whisper import WhisperModel
+        from faster_whisper import WhisperModel  # noqa: F401
     except Exception:
         # fallback si no está el modelo
-        return "Transcripción de ejemplo (instala/configura faster-whisper para texto real)."
-    model_size = os.getenv("ASR_MODEL", "small")
-    model = WhisperModel(model_size, compute_type="int8")
-    segments, info = model.transcribe(audio_path, vad_filter=True, beam_size=1, language="es")
-    parts = [seg.text.strip() for seg in segments]
-    return " ".join(parts).strip() or "(vacío)"
+        return [{"start": 0.0, "end": 0.0, "text": _ASR_PLACEHOLDER}]
+    with _BUDGETS["asr"].slot():
+        model = _get_whisper_model(ASR_MODEL)
+        # transcribe() es perezoso: la inferencia real ocurre al iterar los segmentos,
+        # así que un job cancelado deja de transcribir en el siguiente segmento
+        segments, info = model.transcribe(audio_path, vad_filter=True, beam_size=1, language="es")
+        out = []
+        for seg in segments:
+            _check_cancelled()
+            out.append({"start": float(seg.start), "end": float(seg.end), "text": seg.text.strip()})
+        return out
+
+def _segments_text(segments: List[Dict[str, Any]]) -> str:
+    return " ".join(s["text"] for s in segments if s.get("text")).strip() or "(vacío)"
+
+def _whisper_transcribe(audio_path: str) -> str:
+    return _segments_text(_whisper_segments(audio_path))
+
+# ---------- Single-flight: coalesce identical concurrent work ----------
+class _SingleFlight:
+    """Une llamadas concurrentes con la misma clave: la primera (líder) ejecuta `fn` y las demás
+    esperan su resultado (o su excepción) en vez de repetir el trabajo."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Dict[str, Any]] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "error": None, "followers": 0}
+                self._calls[key] = call
+            else:
+                call["followers"] += 1
+        if not leader:
+            if DEBUG_ASR:
+                print(f"[{self.name}] coalesced:", key)
+            while not call["event"].wait(0.5):
+                _check_cancelled()
+            if isinstance(call["error"], _Cancelled) and not _cancel_requested():
+                # Se canceló el job del líder, no el nuestro: reintenta (posiblemente como líder)
+                return self.do(key, fn)
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["event"].set()
+
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+# Parámetros de query que sólo rastrean el origen del enlace (el resto identifica contenido,
+# p. ej. youtube.com/watch?v=..., y se conserva en la clave)
+_TRACKING_PARAMS = {"igshid", "igsh", "si", "fbclid", "gclid", "feature", "ref", "ref_src", "is_from_webapp",
+                    "sender_device", "sender_web_id", "share_app_id", "share_link_id", "_r", "_t", "t",
+                    "is_copy_url", "lang", "pp"}
+
+def _normalize_post_url(url: str) -> str:
+    """URL canónica de un post/perfil: host en minúsculas, sin www / fragment / / final, y sin
+    parámetros de rastreo (utm_*, igshid, si...). Los parámetros que identifican el contenido se
+    conservan ordenados; youtu.be/<id> pasa a youtube.com/watch?v=<id>."""
+    try:
+        parts = urllib.parse.urlsplit((url or "").strip())
+        host = parts.netloc.lower()
+        if host.startswith("www.") or host.startswith("m."):
+            host = host.split(".", 1)[1]
+        path = parts.path.rstrip("/")
+        query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                 if k.lower() not in _TRACKING_PARAMS and not k.lower().startswith("utm_")]
+        if host == "youtu.be" and path.strip("/"):
+            host, query = "youtube.com", [("v", path.strip("/"))] + [(k, v) for k, v in query if k != "v"]
+            path = "/watch"
+        qs = urllib.parse.urlencode(sorted(query))
+        return f"{parts.scheme.lower() or 'https'}://{host}{path}" + (f"?{qs}" if qs else "")
+    except Exception:
+        return (url or "").strip()
+
+_TRANSCRIBE_FLIGHT = _SingleFlight("ASR")
 
 def transcribe_link(url: str, media_url: Optional[str] = None) -> str:
+    return transcribe_link_segments(url, media_url)[0]
+
+# Transcripciones ya hechas, compartidas entre workers (un post no cambia de audio). Namespace
+# versionado: "transcript" usaba claves sin query (youtube.com/watch?v=A == ?v=B) y no debe servirse.
+_TRANSCRIPT_CACHE = _SharedCache("transcript.v2", ttl_sec=int(os.getenv("TRANSCRIPT_CACHE_TTL_SEC", str(7 * 86400))),
+                                 max_entries=int(os.getenv("TRANSCRIPT_CACHE_MAX", "5000")))
+
+# ---------- Audio fingerprint (dedup de sonidos reutilizados / reposts) ----------
+# TikTok y Reels reutilizan el mismo audio (sonidos en tendencia, voz en off, cross-posts). Tras
+# decodificar a WAV se calcula una huella local (pares de picos espectrales, estilo Shazam, resumidos
+# con MinHash) en AUDIO_FP_WINDOWS ventanas repartidas por todo el clip: un intro compartido con
+# cuerpos distintos no es el mismo audio. Sólo se reutiliza la transcripción sin pasar por Whisper
+# si la duración coincide y TODAS las ventanas superan AUDIO_FP_DUP_SIM; un parecido (>= AUDIO_FP_NEAR_SIM
+# sobre el clip entero) se transcribe igual y sólo se marca en el resultado.
+AUDIO_FP_ENABLED = os.getenv("AUDIO_FP_ENABLED", "1").lower() in ("1", "true", "yes")
+AUDIO_FP_SECONDS = float(os.getenv("AUDIO_FP_SECONDS", "15"))     # largo de cada ventana
+AUDIO_FP_WINDOWS = max(1, int(os.getenv("AUDIO_FP_WINDOWS", "4")))
+AUDIO_FP_DUP_SIM = float(os.getenv("AUDIO_FP_DUP_SIM", "0.8"))
+AUDIO_FP_NEAR_SIM = float(os.getenv("AUDIO_FP_NEAR_SIM", "0.15"))
+AUDIO_FP_MAX_DUR_DIFF_SEC = float(os.getenv("AUDIO_FP_MAX_DUR_DIFF_SEC", "1.0"))
+AUDIO_FP_MIN_HASHES = 30        # menos landmarks = casi silencio: no se deduplica
+_AUDIO_FP_BANDS, _AUDIO_FP_ROWS = 32, 2   # LSH: 32 bandas de 2 valores MinHash
+_AUDIO_FP_BUCKET_MAX = 20       # posts recientes por cubeta
+_AUDIO_FP_PRIME = (1 << 31) - 1   # hashes < 2^19 < primo: (a*x + b) cabe en uint64
+_AUDIO_FP_PERMS: Optional[tuple] = None
+
+def _audio_fp_perms():
+    global _AUDIO_FP_PERMS
+    if _AUDIO_FP_PERMS is None:
+        import numpy as np
+        rng = np.random.default_rng(0x5EED)  # fijo: las huellas deben coincidir entre procesos y despliegues
+        n = _AUDIO_FP_BANDS * _AUDIO_FP_ROWS
+        _AUDIO_FP_PERMS = (rng.integers(1, _AUDIO_FP_PRIME, n, dtype=np.uint64)[:, None],
+                           rng.integers(0, _AUDIO_FP_PRIME, n, dtype=np.uint64)[:, None])
+    return _AUDIO_FP_PERMS
+
+def _audio_landmarks(pcm, rate: int):
+    """Hashes (f1, f2, dt) de pares de picos espectrales: el pico de cada banda logarítmica entre
+    200 Hz y 4 kHz que destaque sobre la media del frame, emparejado con los siguientes picos
+    hasta ~1 s después. Robusto a recodificación, volumen y recortes del inicio;
+    no a cambios de tono o velocidad."""
+    import numpy as np
+    win, hop, max_dt, fan = 1024, 256, 62, 5
+    if len(pcm) < win * 4:
+        return np.zeros(0, dtype=np.uint64)
+    frames = np.lib.stride_tricks.sliding_window_view(pcm, win)[::hop]
+    spec = np.log1p(np.abs(np.fft.rfft(frames * np.hanning(win), axis=1)))
+    freqs = np.fft.rfftfreq(win, 1.0 / rate)
+    edges = np.searchsorted(freqs, np.geomspace(200, min(4000, rate / 2 - 1), 9))
+    peaks_f, peaks_m = [], []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        band = spec[:, lo:hi]
+        idx = band.argmax(axis=1)
+        peaks_f.append(idx + lo)
+        peaks_m.append(band[np.arange(len(band)), idx])
+    f = np.stack(peaks_f, axis=1)            # (frames, bandas)
+    m = np.stack(peaks_m, axis=1)
+    # Sólo máximos locales en el tiempo (±6 frames, ~100 ms) dentro de su banda: un tono sostenido deja
+    # un pico, no uno por frame, y los pares describen el ritmo además de las notas
+    pad = np.pad(m, ((6, 6), (0, 0)), constant_values=-1.0)
+    local_max = np.lib.stride_tricks.sliding_window_view(pad, 13, axis=0).max(axis=2)
+    keep = (m >= local_max) & (m > spec.mean(axis=1, keepdims=True) + 1.0) & (m > np.median(m) * 0.5)
+    t_idx, b_idx = np.nonzero(keep)          # ordenados por frame
+    ts = t_idx.tolist()
+    bins = (f[t_idx, b_idx] // 2).tolist()   # cuantiza a ~31 Hz: tolera el jitter del códec
+    hashes = set()
+    for i, (t1, f1) in enumerate(zip(ts, bins)):
+        paired, j = 0, i + 1
+        while j < len(ts) and ts[j] == t1:
+            j += 1
+        while j < len(ts) and paired < fan and ts[j] - t1 <= max_dt:
+            # dt en pasos de 2 frames: un desfase de medio hop entre copias mueve los picos ±1 frame
+            hashes.add((f1 << 12) | (bins[j] << 5) | ((ts[j] - t1) >> 1))
+            paired += 1
+            j += 1
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+def _audio_minhash(hashes):
+    import numpy as np
+    a, b = _audio_fp_perms()
+    return ((a * hashes[None, :] + b) % np.uint64(_AUDIO_FP_PRIME)).min(axis=1)
+
+def _audio_sig_sim(x: List[int], y: List[int]) -> float:
+    return sum(1 for u, v in zip(x, y) if u == v) / float(max(len(x), 1))
+
+def _audio_window_sim(x: List[Optional[List[int]]], y: List[Optional[List[int]]]) -> float:
+    """Similitud de la ventana menos parecida (0 si las huellas no tienen las mismas ventanas).
+    Una ventana en silencio sólo coincide con otra en silencio."""
+    if not x or not y or len(x) != len(y):
+        return 0.0
+    return min((_audio_sig_sim(u, v) if u and v else float(u is None and v is None)) for u, v in zip(x, y))
+
+def _audio_fingerprint(wav_path: str) -> Optional[Dict[str, Any]]:
+    """Huella del WAV: {id, sig (MinHash del clip), windows (MinHash por ventana), dur, hashes}.
+    Un clip de hasta AUDIO_FP_WINDOWS × AUDIO_FP_SECONDS se cubre entero en tramos contiguos; uno
+    más largo, con ventanas de AUDIO_FP_SECONDS repartidas del inicio al final.
+    None si no se puede leer o es casi silencio (no hay nada fiable que comparar)."""
+    import wave
+    import numpy as np
+    k = AUDIO_FP_WINDOWS
+    try:
+        with wave.open(wav_path, "rb") as w:
+            rate, channels, width, total = w.getframerate(), w.getnchannels(), w.getsampwidth(), w.getnframes()
+            if width != 2 or not total:
+                return None
+            span = int(AUDIO_FP_SECONDS * rate)
+            if total <= span * k:
+                step = -(-total // k)
+                bounds = [(i * step, min(step, total - i * step)) for i in range(k) if i * step < total]
+            else:
+                bounds = [((total - span) * i // max(k - 1, 1), span) for i in range(k)]
+            chunks = []
+            for start, n in bounds:
+                w.setpos(start)
+                chunks.append(w.readframes(n))
+    except Exception as e:
+        if DEBUG_ASR:
+            print("[ASR] fingerprint read failed:", str(e)[:200])
+        return None
+    per_window = []
+    for raw in chunks:
+        pcm = np.frombuffer(raw, dtype="<i2").astype(np.float32)
+        if channels > 1:
+            pcm = pcm[: len(pcm) // channels * channels].reshape(-1, channels).mean(axis=1)
+        per_window.append(_audio_landmarks(pcm / 32768.0, rate))
+    hashes = np.unique(np.concatenate(per_window))
+    if len(hashes) < AUDIO_FP_MIN_HASHES:
+        return None
+    sig = _audio_minhash(hashes)
+    windows = [_audio_minhash(h) if len(h) else None for h in per_window]
+    digest = hashlib.sha1(sig.tobytes())
+    for ws in windows:
+        digest.update(ws.tobytes() if ws is not None else b"-")
+    return {"id": digest.hexdigest()[:20], "sig": [int(x) for x in sig],
+            "windows": [[int(x) for x in ws] if ws is not None else None for ws in windows],
+            "dur": round(total / float(rate), 2), "hashes": int(len(hashes))}
+
+class _AudioIndex:
+    """Índice huella -> transcripción sobre la cache compartida (entre workers y entre jobs).
+    `fp:<post>` guarda la firma; `b<i>:<valores>` (LSH) guarda los posts recientes cuya firma
+    comparte esa banda, para encontrar candidatos sin recorrer todo el índice."""
+
+    def __init__(self, cache: "_SharedCache"):
+        self.cache = cache
+
+    @staticmethod
+    def _buckets(sig: List[int]) -> List[str]:
+        r = _AUDIO_FP_ROWS
+        return [f"b{i}:" + ":".join(str(v) for v in sig[i * r:(i + 1) * r]) for i in range(_AUDIO_FP_BANDS)]
+
+    def lookup(self, fp: Dict[str, Any], exclude: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Post más parecido por encima de AUDIO_FP_NEAR_SIM: {key, url, similarity, window_similarity,
+        dur_diff}; `window_similarity` es la de la ventana menos parecida."""
+        buckets = self.cache.get_many(self._buckets(fp["sig"]))
+        cands = {k for keys in buckets.values() for k in keys if k != exclude}
+        if not cands:
+            return None
+        best = None
+        for ck, entry in self.cache.get_many([f"fp:{k}" for k in cands]).items():
+            sim = _audio_sig_sim(fp["sig"], entry["sig"])
+            if sim >= AUDIO_FP_NEAR_SIM and (best is None or sim > best["similarity"]):
+                best = {"key": ck[3:], "url": entry.get("url"), "similarity": round(sim, 3),
+                        "window_similarity": round(_audio_window_sim(fp["windows"], entry.get("windows")), 3),
+                        "dur_diff": round(abs(fp["dur"] - float(entry.get("dur") or 0)), 2)}
+        return best
+
+    def add(self, key: str, url: str, fp: Dict[str, Any]) -> None:
+        names = self._buckets(fp["sig"])
+        current = self.cache.get_many(names)
+        updates: Dict[str, Any] = {f"fp:{key}": {"url": url, "sig": fp["sig"], "windows": fp["windows"], "dur": fp["dur"]}}
+        for name in names:
+            keys = [k for k in current.get(name) or [] if k != key]
+            updates[name] = (keys + [key])[-_AUDIO_FP_BUCKET_MAX:]
+        self.cache.set_many(updates)
+
+# "audio_fp.v2": las huellas de "audio_fp" eran sólo de los primeros segundos, sin ventanas
+_AUDIO_FP_INDEX = _AudioIndex(_SharedCache(
+    "audio_fp.v2", ttl_sec=int(os.getenv("TRANSCRIPT_CACHE_TTL_SEC", str(7 * 86400))),
+    max_entries=(_AUDIO_FP_BANDS + 1) * int(os.getenv("TRANSCRIPT_CACHE_MAX", "5000"))))
+
+def _transcribe_wav(wav: str, key: str, url: str) -> tuple:
+    """Whisper sobre el WAV ya decodificado, salvo que su huella coincida con un audio ya transcrito.
+    Devuelve (segmentos, huella, match); match lleva `reused=True` si se saltó Whisper."""
+    fp = _audio_fingerprint(wav) if AUDIO_FP_ENABLED else None
+    match = _AUDIO_FP_INDEX.lookup(fp, exclude=key) if fp else None
+    if (match and match["similarity"] >= AUDIO_FP_DUP_SIM and match["window_similarity"] >= AUDIO_FP_DUP_SIM
+            and match["dur_diff"] <= AUDIO_FP_MAX_DUR_DIFF_SEC):
+        hit = _TRANSCRIPT_CACHE.get(match["key"])
+        if hit:
+            if DEBUG_ASR:
+                print("[ASR] audio duplicate:", url, "->", match["url"], "sim=", match["similarity"])
+            return hit["segments"], fp, dict(match, reused=True)
+    if match and DEBUG_ASR:
+        print("[ASR] audio near-duplicate:", url, "~", match["url"], "sim=", match["similarity"])
+    # El mismo archivo subido en varios posts de un batch concurrente: una sola pasada de Whisper
+    if fp:
+        segs = _TRANSCRIBE_FLIGHT.do(f"audio:{fp['id']}", lambda: _whisper_segments(wav))
+    else:
+        segs = _whisper_segments(wav)
+    return segs, fp, (dict(match, reused=False) if match else None)
+
+def transcribe_link_segments(url: str, media_url: Optional[str] = None) -> tuple:
+    """Como transcribe_link, pero devuelve (texto, segmentos) para usar los timestamps de Whisper.
+    Peticiones concurrentes del mismo post comparten una sola descarga + pasada de Whisper, y un
+    post ya transcrito (en cualquier worker) sale de la cache compartida."""
+    entry = transcribe_link_entry(url, media_url)
+    return entry["text"], entry["segments"]
+
+def transcribe_link_entry(url: str, media_url: Optional[str] = None) -> Dict[str, Any]:
+    """{text, segments, audio_match}: audio_match (o None) es el post con audio igual o parecido."""
+    key = _normalize_post_url(url)
+    hit = _TRANSCRIPT_CACHE.get(key)
+    if hit:
+        if DEBUG_ASR:
+            print("[ASR] transcript cache hit:", key)
+        return {"text": hit["text"], "segments": hit["segments"], "audio_match": _public_audio_match(hit.get("audio_match"))}
+    return _TRANSCRIBE_FLIGHT.do(key, lambda: _transcribe_and_cache(key, url, media_url))
+
+def _public_audio_match(match: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not match:
+        return None
+    return {"url": match.get("url"), "similarity": match.get("similarity"), "reused_transcript": bool(match.get("reused"))}
+
+def _transcribe_and_cache(key: str, url: str, media_url: Optional[str]) -> Dict[str, Any]:
+    text, segments, fp, match = _transcribe_link_segments(url, media_url, key)
+    if text != _ASR_PLACEHOLDER:
+        _TRANSCRIPT_CACHE[key] = {"text": text, "segments": segments, "audio_match": match}
+        if fp:
+            _AUDIO_FP_INDEX.add(key, url, fp)
+    return {"text": text, "segments": segments, "audio_match": _public_audio_match(match)}
+
+def _transcribe_link_segments(url: str, media_url: Optional[str] = None, key: Optional[str] = None) -> tuple:
+    """(texto, segmentos, huella, match) probando media directa -> resolver IG -> yt-dlp."""
+    key = key or _normalize_post_url(url)
     last_err = None
     with tempfile.TemporaryDirectory() as td:
         if DEBUG_ASR:
@@ -1242,7 +2601,10 @@ def transcribe_link(url: str, media_url: Optional[str] = None) -> str:
         if media_url:
             try:
                 wav = _download_media_direct(media_url, td)
-                return _whisper_transcribe(wav)
+                segs, fp, match = _transcribe_wav(wav, key, url)
+                return _segments_text(segs), segs, fp, match
+            except _Overloaded:
+                raise
             except Exception as e:
                 last_err = f"direct_download_failed: {str(e)[:300]}"
                 if DEBUG_ASR:
@@ -1253,7 +2615,10 @@ def transcribe_link(url: str, media_url: Optional[str] = None) -> str:
                 resolved = _resolve_instagram_media_via_apify(url)
                 if resolved:
                     wav = _download_media_direct(resolved, td)
-                    return _whisper_transcribe(wav)
+                    segs, fp, match = _transcribe_wav(wav, key, url)
+                    return _segments_text(segs), segs, fp, match
+            except _Overloaded:
+                raise
             except Exception as e:
                 last_err = f"ig_resolver_failed: {str(e)[:300]}"
                 if DEBUG_ASR:
@@ -1261,7 +2626,10 @@ def transcribe_link(url: str, media_url: Optional[str] = None) -> str:
         # 2) Fallback a yt-dlp con headers/reintento
         try:
             wav = _download_audio(url, td)
-            return _whisper_transcribe(wav)
+            segs, fp, match = _transcribe_wav(wav, key, url)
+            return _segments_text(segs), segs, fp, match
+        except _Overloaded:
+            raise
         except Exception as e:
             last_err = f"yt_dlp_failed: {str(e)[:300]}"
             if DEBUG_ASR:
@@ -1274,32 +2642,189 @@ def transcribe_link(url: str, media_url: Optional[str] = None) -> str:
                 pass
         raise RuntimeError((last_err or "no_transcription") + " | hint: if TikTok/IG, media_url might be HLS; ffmpeg HLS path enabled.")
 
+# ---------- Transcript compaction (local, model-free) ----------
+# Presupuesto de tokens de transcripción por proveedor (prompt predecible en tamaño y latencia)
+TRANSCRIPT_TOKENS_ANTHROPIC = int(os.getenv("TRANSCRIPT_TOKENS_ANTHROPIC", os.getenv("TRANSCRIPT_TOKENS", "600")))
+TRANSCRIPT_TOKENS_OPENAI    = int(os.getenv("TRANSCRIPT_TOKENS_OPENAI", os.getenv("TRANSCRIPT_TOKENS", "600")))
+TRANSCRIPT_HEAD_SEC = float(os.getenv("TRANSCRIPT_HEAD_SEC", "15"))   # siempre se conserva (gancho)
+TRANSCRIPT_TAIL_SEC = float(os.getenv("TRANSCRIPT_TAIL_SEC", "10"))   # siempre se conserva (CTA)
+
+# Muletillas: interjecciones en cualquier posición; conectores solo entre comas / al inicio
+_FILLER_RE = _re.compile(r"(?<![\w])(?:e+h+|e+m+|m+h*m+|a+h+|u+m+|u+h+|hmm+)(?![\w])[,.]?\s*", _re.I)
+_FILLER_PHRASE_RE = _re.compile(
+    r"(?:(?<=,)|(?<=^))\s*(?:o sea|bueno|pues|este|digamos|tipo|you know|like)\s*,\s*", _re.I | _re.M)
+_REPEAT_WORD_RE = _re.compile(r"\b(\w+)(?:\s+\1\b)+", _re.I)
+_SENTENCE_RE = _re.compile(r"(?<=[.!?…])\s+")
+
+_TOKENIZER: Any = None
+
+def _count_tokens(text: str) -> int:
+    """Cuenta tokens con tiktoken si está instalado; si no, aproxima ~4 caracteres por token."""
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        try:
+            import tiktoken
+            _TOKENIZER = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _TOKENIZER = False
+    if _TOKENIZER:
+        return len(_TOKENIZER.encode(text or ""))
+    return (len(text or "") + 3) // 4
+
+def _transcript_token_budget(provider: Optional[str] = None) -> int:
+    p = (provider or GUIDEON_PROVIDER or "anthropic").lower()
+    return TRANSCRIPT_TOKENS_OPENAI if p == "openai" else TRANSCRIPT_TOKENS_ANTHROPIC
+
+def _clean_transcript_unit(text: str) -> str:
+    t = _FILLER_RE.sub("", text or "")
+    t = _FILLER_PHRASE_RE.sub(" ", t)
+    t = _REPEAT_WORD_RE.sub(r"\1", t)
+    t = _re.sub(r"\s+", " ", t).strip(" ,")
+    return t
+
+def _trim_tokens_tail(text: str, max_tokens: int) -> str:
+    """Las últimas palabras de `text` que caben en `max_tokens` (al menos una), con "…" delante."""
+    words = text.split()
+    lo, hi = 1, len(words)  # búsqueda binaria de cuántas palabras finales caben
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if _count_tokens(" ".join(words[-mid:])) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return "… " + " ".join(words[-lo:])
+
+def _compact_transcript(transcript: str, segments: Optional[List[Dict[str, Any]]] = None,
+                        budget_tokens: Optional[int] = None) -> str:
+    """Ajusta la transcripción a un presupuesto de tokens sin usar modelos.
+    - Quita muletillas, palabras repetidas y segmentos duplicados (bucles de Whisper).
+    - Conserva siempre los primeros TRANSCRIPT_HEAD_SEC y el cierre (TRANSCRIPT_TAIL_SEC), donde
+      suelen estar el gancho y el CTA; sin timestamps usa la primera y la última frase.
+    - Rellena el medio con los segmentos de más contenido y marca los huecos con "…".
+    """
+    budget = budget_tokens or _transcript_token_budget()
+    if segments:
+        units = [{"start": float(s.get("start") or 0), "end": float(s.get("end") or 0), "text": s.get("text") or ""}
+                 for s in segments]
+    else:
+        units = [{"start": None, "end": None, "text": s} for s in _SENTENCE_RE.split((transcript or "").strip())]
+
+    cleaned: List[Dict[str, Any]] = []
+    seen = set()
+    for u in units:
+        text = _clean_transcript_unit(u["text"])
+        key = _re.sub(r"\W+", "", text.lower())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        cleaned.append(dict(u, text=text, tokens=_count_tokens(text)))
+    if not cleaned:
+        return (transcript or "").strip()
+    if sum(u["tokens"] for u in cleaned) <= budget:
+        return " ".join(u["text"] for u in cleaned)
+
+    n = len(cleaned)
+    last_end = cleaned[-1]["end"]
+    keep = set()
+    # Cierre (CTA): hasta 1/3 del presupuesto
+    tail_budget = budget // 3
+    used = 0
+    for i in range(n - 1, 0, -1):
+        u = cleaned[i]
+        if i == n - 1:
+            # El último segmento va siempre; si él solo no cabe en el cierre, se recorta por delante
+            # (el CTA suele estar al final de la frase)
+            if u["tokens"] > tail_budget:
+                text = _trim_tokens_tail(u["text"], tail_budget)
+                cleaned[i] = u = dict(u, text=text, tokens=_count_tokens(text))
+            keep.add(i)
+            used += u["tokens"]
+            continue
+        in_tail = last_end is not None and u["end"] is not None and u["end"] >= last_end - TRANSCRIPT_TAIL_SEC
+        if not in_tail or used + u["tokens"] > tail_budget:
+            break
+        keep.add(i)
+        used += u["tokens"]
+    # Inicio (gancho)
+    for i in range(n):
+        if i in keep:
+            break
+        u = cleaned[i]
+        in_head = (i == 0) or (u["start"] is not None and u["start"] < TRANSCRIPT_HEAD_SEC)
+        if not in_head or used + u["tokens"] > budget:
+            break
+        keep.add(i)
+        used += u["tokens"]
+    # Medio: más palabras distintas por token primero
+    middle = [i for i in range(n) if i not in keep]
+    middle.sort(key=lambda i: -len(set(_re.findall(r"\w{4,}", cleaned[i]["text"].lower()))) / max(cleaned[i]["tokens"], 1))
+    for i in middle:
+        if used + cleaned[i]["tokens"] <= budget:
+            keep.add(i)
+            used += cleaned[i]["tokens"]
+
+    if not keep:
+        # Ni el primer segmento cabe: corte duro por caracteres aproximados
+        return cleaned[0]["text"][: budget * 4] + "…"
+    out: List[str] = []
+    prev = -1
+    for i in sorted(keep):
+        if prev >= 0 and i != prev + 1:
+            out.append("…")
+        out.append(cleaned[i]["text"])
+        prev = i
+    return " ".join(out)
+
 # ---------- GUIDEON (Claude) helpers ----------
-def _anthropic_messages(system_text: str, user_text: str) -> Optional[str]:
-    """Call Anthropic Messages API. Returns text content or None."""
-    api_key = CLAUDE_API_KEY
-    if not api_key:
-        return None
-    url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "x-api-key": api_key,
+def _anthropic_headers() -> dict:
+    return {
+        "x-api-key": CLAUDE_API_KEY,
         "anthropic-version": "2023-06-01",
         "content-type": "application/json",
     }
-    payload = {
+
+def _output_tokens(max_tokens: Optional[int] = None) -> int:
+    return min(max_tokens or GUIDEON_MAX_TOKENS, GUIDEON_MAX_OUTPUT_TOKENS)
+
+def _variant_budget(per_variant: int, n_variants: int) -> tuple:
+    """(variantes, max_tokens): tantas variantes como quepan con su presupuesto completo dentro de
+    GUIDEON_MAX_OUTPUT_TOKENS (mínimo 1), para no pedir más salida de la que admite el modelo."""
+    n = max(1, min(n_variants, GUIDEON_MAX_OUTPUT_TOKENS // max(1, per_variant)))
+    return n, _output_tokens(per_variant * n)
+
+def _anthropic_payload(system_text: str, user_text: str, max_tokens: Optional[int] = None) -> dict:
+    return {
         "model": CLAUDE_MODEL,
-        "max_tokens": GUIDEON_MAX_TOKENS,
+        "max_tokens": _output_tokens(max_tokens),
         "temperature": GUIDEON_TEMP,
         "system": system_text,
         "messages": [
             {"role": "user", "content": user_text}
         ],
     }
+
+def _anthropic_text(data: dict) -> Optional[str]:
+    parts = (data or {}).get("content") or []
+    texts = []
+    for p in parts:
+        if isinstance(p, dict) and p.get("type") == "text":
+            texts.append(p.get("text") or "")
+    out = "\n".join(t for t in texts if t)
+    return out.strip() or None
+
+def _anthropic_messages(system_text: str, user_text: str, max_tokens: Optional[int] = None) -> Optional[str]:
+    """Call Anthropic Messages API. Returns text content or None."""
+    api_key = CLAUDE_API_KEY
+    if not api_key:
+        return None
+    url = f"{ANTHROPIC_BASE_URL}/v1/messages"
+    headers = _anthropic_headers()
+    payload = _anthropic_payload(system_text, user_text, max_tokens)
     if DEBUG_GUIDEON:
         print("[GUIDEON][anthropic] model=", payload.get("model"), " temp=", payload.get("temperature"), " max_t=", payload.get("max_tokens"))
         print("[GUIDEON][anthropic] system size=", len(system_text or ""), " user size=", len(user_text or ""))
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
+        resp = _HTTP.post(url, headers=headers, data=json.dumps(payload), timeout=60)
         if resp.status_code >= 400:
             print(f"[GUIDEON] HTTP {resp.status_code}: {resp.text[:300]} ...")
             return None
@@ -1312,188 +2837,269 @@ def _anthropic_messages(system_text: str, user_text: str) -> Optional[str]:
                     print("[GUIDEON][anthropic] part sample:", (_p.get("text") or "")[:300])
             except Exception:
                 pass
-        parts = data.get("content") or []
-        texts = []
-        for p in parts:
-            if isinstance(p, dict) and p.get("type") == "text":
-                texts.append(p.get("text") or "")
-        out = "\n".join(t for t in texts if t)
-        return out.strip() or None
+        return _anthropic_text(data)
     except Exception as e:
         print(f"[GUIDEON] request failed: {e}")
         return None
 
+# ---------- GUIDEON (OpenAI) endpoint capabilities ----------
+# Ruta que funcionó por (base_url, model): endpoint, modelo efectivo y parámetros aceptados.
+# Compartida entre workers (un solo descubrimiento por despliegue); se invalida cuando la ruta falla.
+_OPENAI_CAPS = _SharedCache("openai_caps", ttl_sec=int(os.getenv("OPENAI_CAPS_TTL_SEC", "86400")), max_entries=100)
+
+def _openai_caps_key(model: str) -> tuple:
+    return ((OPENAI_BASE_URL or "").rstrip("/"), (model or "").strip().lower())
+
+def _openai_candidate_routes(model: str) -> List[Dict[str, Any]]:
+    """Rutas a probar en orden. o4-* prefiere Responses API y cae a Chat Completions
+    con OPENAI_CC_FALLBACK_MODEL; el resto va directo a Chat Completions.
+    """
+    if model.lower().startswith("o4"):
+        return [
+            # Some o4-* models in Responses API do not accept 'temperature' or 'max_output_tokens'
+            {"endpoint": "responses", "model": model,
+             "params": {"temperature": False, "max_output_tokens": False}},
+            {"endpoint": "chat", "model": os.getenv("OPENAI_CC_FALLBACK_MODEL", "gpt-4o-mini"),
+             "params": {"temperature": True, "max_tokens": True}},
+        ]
+    return [
+        {"endpoint": "chat", "model": model,
+         "params": {"temperature": True, "max_tokens": True}},
+    ]
+
+def _parse_responses_output(d: dict) -> Optional[str]:
+    """Robust parse for Responses API (handles dict/list)."""
+    if not isinstance(d, dict):
+        return None
+    # 1) Direct fields commonly present
+    if isinstance(d.get("output_text"), str):
+        return d["output_text"].strip()
+    if isinstance(d.get("text"), str):  # some variants expose top-level text
+        return d["text"].strip()
+
+    out = d.get("output")
+
+    # 2) When 'output' is a dict
+    if isinstance(out, dict):
+        if isinstance(out.get("text"), str):
+            return out["text"].strip()
+        content = out.get("content") or []
+        parts: list[str] = []
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict):
+                    if isinstance(part.get("text"), str):
+                        parts.append(part["text"])
+                    elif isinstance(part.get("content"), list):
+                        for sub in part["content"]:
+                            if isinstance(sub, dict) and isinstance(sub.get("text"), str):
+                                parts.append(sub["text"])
+        if parts:
+            return "\n".join(parts).strip()
+
+    # 3) When 'output' is a list (observed in logs)
+    if isinstance(out, list):
+        parts: list[str] = []
+        for item in out:
+            if isinstance(item, dict):
+                if isinstance(item.get("text"), str):
+                    parts.append(item["text"])
+                c = item.get("content")
+                if isinstance(c, list):
+                    for sub in c:
+                        if isinstance(sub, dict) and isinstance(sub.get("text"), str):
+                            parts.append(sub["text"])
+        if parts:
+            return "\n".join(parts).strip()
+
+    return None
+
+def _parse_chat_output(d: dict) -> Optional[str]:
+    try:
+        choices = d.get("choices") or []
+        if choices:
+            msg = (choices[0] or {}).get("message") or {}
+            out_text = msg.get("content")
+            if out_text and isinstance(out_text, str):
+                return out_text.strip() or None
+    except Exception:
+        pass
+    return None
+
+def _openai_unsupported_param(resp, params: Dict[str, bool]) -> Optional[str]:
+    """Si el 400 indica que un parámetro enviado no es aceptado, devuelve su nombre."""
+    try:
+        err = (resp.json() or {}).get("error") or {}
+    except Exception:
+        err = {}
+    param = err.get("param") if isinstance(err, dict) else None
+    if param in params and params.get(param):
+        return param
+    text = (resp.text or "").lower()
+    if "unsupported" in text or "not supported" in text:
+        for name, enabled in params.items():
+            if enabled and name in text:
+                return name
+    return None
+
+def _openai_route_unsupported(resp) -> bool:
+    """True sólo si el error dice que el modelo / endpoint no sirve para esta ruta
+    (404, o 400 con model_not_found / endpoint no soportado)."""
+    if resp.status_code == 404:
+        return True
+    if resp.status_code != 400:
+        return False
+    try:
+        err = (resp.json() or {}).get("error") or {}
+    except Exception:
+        err = {}
+    if not isinstance(err, dict):
+        err = {}
+    if err.get("code") in ("model_not_found", "unsupported_model", "unsupported_endpoint"):
+        return True
+    msg = str(err.get("message") or resp.text or "").lower()
+    return ("not a chat model" in msg or "v1/responses" in msg or "v1/chat/completions" in msg
+            or ("endpoint" in msg and ("not supported" in msg or "unsupported" in msg)))
+
+def _openai_route_payload(route: Dict[str, Any], system_text: str, user_text: str,
+                          max_tokens: Optional[int] = None) -> tuple:
+    """Devuelve (path, payload) para una ruta; compartido por llamadas síncronas y batch."""
+    params = route["params"]
+    messages = [
+        {"role": "system", "content": system_text},
+        {"role": "user",   "content": user_text},
+    ]
+    if route["endpoint"] == "responses":
+        payload: Dict[str, Any] = {"model": route["model"], "input": messages}
+        if params.get("temperature"):
+            payload["temperature"] = GUIDEON_TEMP
+        if params.get("max_output_tokens"):
+            payload["max_output_tokens"] = _output_tokens(max_tokens)
+        return "/responses", payload
+    payload = {"model": route["model"], "messages": messages}
+    if params.get("temperature"):
+        payload["temperature"] = GUIDEON_TEMP
+    if params.get("max_tokens"):
+        payload["max_tokens"] = _output_tokens(max_tokens)
+    return "/chat/completions", payload
+
+def _openai_call_route(route: Dict[str, Any], system_text: str, user_text: str, headers: dict,
+                       max_tokens: Optional[int] = None) -> tuple:
+    """Ejecuta una ruta concreta. Devuelve (texto, estado) con estado en:
+    'ok' | 'param:<nombre>' (parámetro rechazado) | 'unsupported' (la ruta no sirve) | 'error' (fallo transitorio).
+    """
+    endpoint = route["endpoint"]
+    model = route["model"]
+    params = route["params"]
+    tag = f"[GUIDEON][openai][{'responses' if endpoint == 'responses' else 'chat'}]"
+    path, payload = _openai_route_payload(route, system_text, user_text, max_tokens)
+    url = f"{OPENAI_BASE_URL}{path}"
+    if DEBUG_GUIDEON:
+        print(tag, "model=", model, " params=", {k: payload.get(k) for k in params})
+        print(tag, "system size=", len(system_text or ""), " user size=", len(user_text or ""))
+    try:
+        resp = _HTTP.post(url, headers=headers, data=json.dumps(payload), timeout=120)
+    except Exception as e:
+        print(f"{tag} request failed: {e}")
+        return None, "error"
+    if resp.status_code >= 400:
+        print(f"{tag} HTTP {resp.status_code}: {resp.text[:300]} ...")
+        if resp.status_code == 400:
+            bad = _openai_unsupported_param(resp, params)
+            if bad:
+                return None, f"param:{bad}"
+        # Model mismatch / endpoint not available for this model. 429 / 5xx (aunque mencionen
+        # el modelo, p. ej. "Rate limit reached for model ...") son transitorios: no se cambia de ruta.
+        if _openai_route_unsupported(resp):
+            return None, "unsupported"
+        return None, "error"
+    try:
+        data = resp.json() or {}
+    except Exception:
+        data = {}
+    if DEBUG_GUIDEON:
+        print(tag, "keys:", list(data.keys()))
+    out_text = _parse_responses_output(data) if endpoint == "responses" else _parse_chat_output(data)
+    if not out_text:
+        if DEBUG_GUIDEON:
+            try:
+                print(tag, "WARN: empty output. raw=", (json.dumps(data)[:500] if data else "<none>"))
+            except Exception:
+                pass
+        # Un 200 vacío no dice nada de la ruta (p. ej. corte por longitud): fallo transitorio
+        return None, "error"
+    return out_text, "ok"
+
 # ---------- GUIDEON (OpenAI) helper ----------
-def _openai_messages(system_text: str, user_text: str) -> Optional[str]:
+def _openai_messages(system_text: str, user_text: str, max_tokens: Optional[int] = None) -> Optional[str]:
     """Call OpenAI (Chat Completions or Responses API). Returns text content or None.
     - If OPENAI_MODEL looks like an o4-* model, prefer the Responses API.
     - Otherwise, use Chat Completions.
+    La ruta que funciona (endpoint, parámetros aceptados, forma de respuesta) se cachea
+    por (base_url, model) y se vuelve a descubrir cuando falla.
     """
     api_key = OPENAI_API_KEY
     if not api_key:
         return None
 
     model = (OPENAI_MODEL or "").strip()
-    use_responses = model.lower().startswith("o4")  # e.g., o4-mini, o4, o4-high
-
+    key = _openai_caps_key(model)
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
 
-    try:
-        if use_responses:
-            # ---- Responses API path ----
-            url = f"{OPENAI_BASE_URL}/responses"
-            payload = {
-                "model": model,
-                "input": [
-                    {"role": "system", "content": system_text},
-                    {"role": "user",   "content": user_text},
-                ],
-            }
-            # Some o4-* models in Responses API do not accept 'temperature' or 'max_output_tokens'
-            if not model.lower().startswith("o4"):
-                payload["temperature"] = GUIDEON_TEMP
-                payload["max_output_tokens"] = GUIDEON_MAX_TOKENS
-            if DEBUG_GUIDEON:
-                print("[GUIDEON][openai][responses] model=", model,
-                      " temp=", payload.get("temperature"),
-                      " max_o_t=", payload.get("max_output_tokens"))
-                print("[GUIDEON][openai][responses] system size=", len(system_text or ""),
-                      " user size=", len(user_text or ""))
-            resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=120)
-            if resp.status_code >= 400:
-                print(f"[GUIDEON][openai][responses] HTTP {resp.status_code}: {resp.text[:300]} ...")
-                # Soft fallback to chat completions if model mismatch
-                if resp.status_code == 404 or "model" in (resp.text or "").lower():
-                    use_responses = False
-                else:
-                    return None
-            else:
-                data = resp.json() or {}
-                if DEBUG_GUIDEON:
-                    print("[GUIDEON][openai][responses] keys:", list(data.keys()))
-                # ---- Robust parse for Responses API (handles dict/list) ----
-                def _parse_responses_output(d: dict) -> Optional[str]:
-                    if not isinstance(d, dict):
-                        return None
-                    # 1) Direct fields commonly present
-                    if isinstance(d.get("output_text"), str):
-                        return d["output_text"].strip()
-                    if isinstance(d.get("text"), str):  # some variants expose top-level text
-                        return d["text"].strip()
-
-                    out = d.get("output")
-
-                    # 2) When 'output' is a dict
-                    if isinstance(out, dict):
-                        if isinstance(out.get("text"), str):
-                            return out["text"].strip()
-                        content = out.get("content") or []
-                        parts: list[str] = []
-                        if isinstance(content, list):
-                            for part in content:
-                                if isinstance(part, dict):
-                                    if isinstance(part.get("text"), str):
-                                        parts.append(part["text"])
-                                    elif isinstance(part.get("content"), list):
-                                        for sub in part["content"]:
-                                            if isinstance(sub, dict) and isinstance(sub.get("text"), str):
-                                                parts.append(sub["text"])
-                        if parts:
-                            return "\n".join(parts).strip()
-
-                    # 3) When 'output' is a list (observed in logs)
-                    if isinstance(out, list):
-                        parts: list[str] = []
-                        for item in out:
-                            if isinstance(item, dict):
-                                if isinstance(item.get("text"), str):
-                                    parts.append(item["text"])
-                                c = item.get("content")
-                                if isinstance(c, list):
-                                    for sub in c:
-                                        if isinstance(sub, dict) and isinstance(sub.get("text"), str):
-                                            parts.append(sub["text"])
-                        if parts:
-                            return "\n".join(parts).strip()
-
-                    return None
-
-                out_text = _parse_responses_output(data)
-                if DEBUG_GUIDEON and not out_text:
-                    try:
-                        print("[GUIDEON][openai][responses] WARN: empty output. raw=", (json.dumps(data)[:500] if data else "<none>"))
-                    except Exception:
-                        pass
-                if out_text:
-                    return out_text
-                # If could not parse, fallback to chat-completions
-                use_responses = False
-
-        # ---- Chat Completions path (default + fallback) ----
-        url = f"{OPENAI_BASE_URL}/chat/completions"
-        # If the user configured o4-* but /responses failed, try gpt-4o-mini as a compat alias
-        cc_model = model
-        if model.lower().startswith("o4"):
-            cc_model = os.getenv("OPENAI_CC_FALLBACK_MODEL", "gpt-4o-mini")
-        payload = {
-            "model": cc_model,
-            "temperature": GUIDEON_TEMP,
-            "max_tokens": GUIDEON_MAX_TOKENS,
-            "messages": [
-                {"role": "system", "content": system_text},
-                {"role": "user",   "content": user_text},
-            ],
-        }
+    # 1) Ruta conocida: directo, sin reintentos
+    cached = _OPENAI_CAPS.get(key)
+    if cached:
+        out_text, status = _openai_call_route(cached, system_text, user_text, headers, max_tokens)
+        if status == "ok":
+            return out_text
+        _OPENAI_CAPS.pop(key, None)
         if DEBUG_GUIDEON:
-            print("[GUIDEON][openai][chat] model=", cc_model, " temp=", payload.get("temperature"), " max_t=", payload.get("max_tokens"))
-            print("[GUIDEON][openai][chat] system size=", len(system_text or ""), " user size=", len(user_text or ""))
-        resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=120)
-        if resp.status_code >= 400:
-            print(f"[GUIDEON][openai][chat] HTTP {resp.status_code}: {resp.text[:300]} ...")
+            print("[GUIDEON][openai] cached route failed (", status, "); re-probing:", key)
+        if status == "error":
             return None
-        data = resp.json() or {}
-        if DEBUG_GUIDEON:
-            print("[GUIDEON][openai][chat] keys:", list(data.keys()))
-        out_text = None
-        try:
-            choices = data.get("choices") or []
-            if choices:
-                msg = (choices[0] or {}).get("message") or {}
-                out_text = msg.get("content")
-        except Exception:
-            out_text = None
-        if DEBUG_GUIDEON and not out_text:
-            try:
-                print("[GUIDEON][openai][chat] WARN: empty content. raw=", (json.dumps(data)[:500] if data else "<none>"))
-            except Exception:
-                pass
-        if out_text and isinstance(out_text, str):
-            return out_text.strip() or None
-        return None
 
-    except Exception as e:
-        print(f"[GUIDEON][openai] request failed: {e}")
-        return None
+    # 2) Descubrimiento: prueba rutas y parámetros en orden y recuerda la que funciona
+    for candidate in _openai_candidate_routes(model):
+        route = dict(candidate, params=dict(candidate["params"]))
+        status = "unsupported"
+        for _ in range(len(route["params"]) + 1):
+            out_text, status = _openai_call_route(route, system_text, user_text, headers, max_tokens)
+            if status == "ok":
+                _OPENAI_CAPS[key] = route
+                if DEBUG_GUIDEON:
+                    print("[GUIDEON][openai] route cached:", key, "->", route)
+                return out_text
+            if status.startswith("param:"):
+                route["params"][status.split(":", 1)[1]] = False
+                continue
+            break
+        if status == "error":
+            return None
+    return None
 
 # ---------- GUIDEON unified router ----------
-def _llm_messages(system_text: str, user_text: str) -> Optional[str]:
+def _llm_messages(system_text: str, user_text: str, max_tokens: Optional[int] = None) -> Optional[str]:
+    with _BUDGETS["llm"].slot():
+        return _llm_messages_unbudgeted(system_text, user_text, max_tokens)
+
+def _llm_messages_unbudgeted(system_text: str, user_text: str, max_tokens: Optional[int] = None) -> Optional[str]:
     provider = (GUIDEON_PROVIDER or "anthropic").lower()
     if provider == "openai":
         # Prefer OpenAI when configured; fallback to Anthropic if missing key
-        out = _openai_messages(system_text, user_text)
+        out = _openai_messages(system_text, user_text, max_tokens)
         if out is not None:
             return out
         # fallback
-        return _anthropic_messages(system_text, user_text)
+        return _anthropic_messages(system_text, user_text, max_tokens)
     # default anthropic
-    out = _anthropic_messages(system_text, user_text)
+    out = _anthropic_messages(system_text, user_text, max_tokens)
     if out is not None:
         return out
     # fallback to OpenAI if anthropic failed and we have key
-    return _openai_messages(system_text, user_text)
+    return _openai_messages(system_text, user_text, max_tokens)
 
 def _safe_json_extract(text: str) -> Optional[dict]:
     """Intenta extraer un JSON {script, hooks, cta} desde un texto. Tolerante a ruido."""
@@ -1517,16 +3123,39 @@ def _safe_json_extract(text: str) -> Optional[dict]:
         return None
     return None
 
+def _safe_json_extract_variants(text: str) -> List[dict]:
+    """Extrae una lista de variantes {script, hooks, cta}: acepta {"variants": [...]}, un array
+    JSON suelto o un único objeto (que cuenta como una variante)."""
+    if not text:
+        return []
+    obj: Any = None
+    try:
+        obj = json.loads(text)
+    except Exception:
+        if text.lstrip().startswith("["):
+            m = _re.search(r"\[[\s\S]*\]", text)
+            if m:
+                try:
+                    obj = json.loads(m.group(0))
+                except Exception:
+                    obj = None
+        if obj is None:
+            obj = _safe_json_extract(text)
+    if isinstance(obj, dict):
+        obj = obj.get("variants") if isinstance(obj.get("variants"), list) else [obj]
+    if not isinstance(obj, list):
+        return []
+    return [v for v in obj if isinstance(v, dict)]
+
 # ---------- Helper: rewrite_with_guideon for per-card rewrites ----------
-def adapt_with_guideon(transcript: str, niche_prompt: str, rules_prompt: str,
-                       adaptation_level: str = "simple", rules_source: str = "guideon",
-                       custom_rules: str = "", lang: str = None) -> dict:
-    """Devuelve dict con keys: script, hooks (list), cta (str). Fallback: script=transcript."""
+def _adapt_prompts(transcript: str, niche_prompt: str, rules_prompt: str,
+                   adaptation_level: str = "simple", rules_source: str = "guideon",
+                   custom_rules: str = "", lang: str = None,
+                   segments: Optional[List[Dict[str, Any]]] = None) -> tuple:
+    """Construye (system_text, user_text) para adaptar una transcripción."""
     lang = (lang or GUIDEON_LANG_DEFAULT or "es").strip()
-    t = (transcript or "").strip()
-    # Limita longitud para controlar costos
-    if len(t) > 2000:
-        t = t[:2000] + "..."
+    # Compacta al presupuesto de tokens del proveedor para controlar costos y latencia
+    t = _compact_transcript(transcript, segments)
 
     # System
     if adaptation_level == "simple":
@@ -1573,7 +3202,10 @@ def adapt_with_guideon(transcript: str, niche_prompt: str, rules_prompt: str,
             "{\n  \"script\": \"texto final listo para grabar con // corte\",\n  \"hooks\": [\"hook1\",\"hook2\",\"hook3\",\"hook4\",\"hook5\"],\n  \"cta\": \"llamado a la acción\"\n}\n"
         )
 
-    resp_text = _llm_messages(system_text, user_text)
+    return system_text, user_text
+
+def _adapt_result(resp_text: Optional[str], transcript: str, adaptation_level: str = "simple") -> dict:
+    """Convierte la salida del LLM en {script, hooks, cta}. Fallback: script=transcript."""
     if not resp_text:
         return {"script": transcript, "hooks": [], "cta": ""}
 
@@ -1590,19 +3222,422 @@ def adapt_with_guideon(transcript: str, niche_prompt: str, rules_prompt: str,
 
     return {"script": script, "hooks": hooks, "cta": cta}
 
+def adapt_with_guideon(transcript: str, niche_prompt: str, rules_prompt: str,
+                       adaptation_level: str = "simple", rules_source: str = "guideon",
+                       custom_rules: str = "", lang: str = None,
+                       segments: Optional[List[Dict[str, Any]]] = None) -> dict:
+    """Devuelve dict con keys: script, hooks (list), cta (str). Fallback: script=transcript.
+    `segments` (timestamps de Whisper) mejora la compactación de la transcripción."""
+    system_text, user_text = _adapt_prompts(transcript, niche_prompt, rules_prompt,
+                                            adaptation_level, rules_source, custom_rules, lang, segments)
+    return _adapt_result(_llm_messages(system_text, user_text), transcript, adaptation_level)
+
+def _format_guide_script(script_text: str, hooks: list, cta: str) -> str:
+    """Antepone [HOOKS]/[CTA] al guion, como se muestra en las cards."""
+    if hooks or cta:
+        header = []
+        if hooks:
+            header.append("[HOOKS]\n- " + "\n- ".join([str(h) for h in hooks if h]))
+        if cta:
+            header.append("\n[CTA]\n" + str(cta))
+        script_text = ("\n\n".join(header) + "\n\n[GUION]\n" + script_text).strip()
+    return script_text
+
+# ---------- GUIDEON batch mode (Anthropic Message Batches / OpenAI Batch) ----------
+def _batch_provider() -> Optional[str]:
+    """Proveedor para batch: el configurado si tiene key, si no el otro (igual que _llm_messages)."""
+    provider = (GUIDEON_PROVIDER or "anthropic").lower()
+    order = ["openai", "anthropic"] if provider == "openai" else ["anthropic", "openai"]
+    for p in order:
+        if (p == "openai" and OPENAI_API_KEY) or (p == "anthropic" and CLAUDE_API_KEY):
+            return p
+    return None
+
+def _llm_batch_submit(prompts: List[tuple]) -> Optional[Dict[str, Any]]:
+    """Envía [(custom_id, system_text, user_text), ...] al endpoint batch del proveedor.
+    Devuelve un handle {provider, id} o None si no se pudo crear el batch.
+    """
+    provider = _batch_provider()
+    if not provider or not prompts:
+        return None
+    try:
+        if provider == "anthropic":
+            body = {"requests": [
+                {"custom_id": cid, "params": _anthropic_payload(system_text, user_text)}
+                for cid, system_text, user_text in prompts
+            ]}
+            resp = _HTTP.post(f"{ANTHROPIC_BASE_URL}/v1/messages/batches",
+                                 headers=_anthropic_headers(), data=json.dumps(body), timeout=60)
+            resp.raise_for_status()
+            batch_id = (resp.json() or {}).get("id")
+        else:
+            model = (OPENAI_MODEL or "").strip()
+            route = _OPENAI_CAPS.get(_openai_caps_key(model)) or _openai_candidate_routes(model)[0]
+            lines = []
+            path = "/chat/completions"
+            for cid, system_text, user_text in prompts:
+                path, payload = _openai_route_payload(route, system_text, user_text)
+                lines.append(json.dumps({"custom_id": cid, "method": "POST", "url": f"/v1{path}", "body": payload}))
+            auth = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+            up = _HTTP.post(f"{OPENAI_BASE_URL}/files", headers=auth,
+                               files={"file": ("guideon_batch.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")},
+                               data={"purpose": "batch"}, timeout=60)
+            up.raise_for_status()
+            file_id = (up.json() or {}).get("id")
+            resp = _HTTP.post(f"{OPENAI_BASE_URL}/batches", headers=auth, timeout=60, json={
+                "input_file_id": file_id,
+                "endpoint": f"/v1{path}",
+                "completion_window": "24h",
+            })
+            resp.raise_for_status()
+            batch_id = (resp.json() or {}).get("id")
+    except Exception as e:
+        print(f"[GUIDEON][batch][{provider}] submit failed: {e}")
+        return None
+    if not batch_id:
+        return None
+    if DEBUG_GUIDEON:
+        print(f"[GUIDEON][batch][{provider}] submitted id={batch_id} requests={len(prompts)}")
+    return {"provider": provider, "id": batch_id}
+
+def _llm_batch_poll(handle: Dict[str, Any]) -> tuple:
+    """Consulta el batch. Devuelve (estado, datos) con estado 'pending' | 'ended' | 'failed'."""
+    provider = handle["provider"]
+    if provider == "anthropic":
+        resp = _HTTP.get(f"{ANTHROPIC_BASE_URL}/v1/messages/batches/{handle['id']}",
+                            headers=_anthropic_headers(), timeout=30)
+        resp.raise_for_status()
+        data = resp.json() or {}
+        status = data.get("processing_status")
+        return ("ended" if status == "ended" else "pending"), data
+    resp = _HTTP.get(f"{OPENAI_BASE_URL}/batches/{handle['id']}",
+                        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"}, timeout=30)
+    resp.raise_for_status()
+    data = resp.json() or {}
+    status = data.get("status")
+    if status == "completed":
+        return "ended", data
+    if status in ("failed", "expired", "cancelled"):
+        return "failed", data
+    return "pending", data
+
+def _llm_batch_results(handle: Dict[str, Any], data: dict) -> Dict[str, Optional[str]]:
+    """Descarga los resultados de un batch terminado -> {custom_id: texto o None}."""
+    out: Dict[str, Optional[str]] = {}
+    if handle["provider"] == "anthropic":
+        url = data.get("results_url") or f"{ANTHROPIC_BASE_URL}/v1/messages/batches/{handle['id']}/results"
+        resp = _HTTP.get(url, headers=_anthropic_headers(), timeout=120)
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            try:
+                row = json.loads(line)
+            except Exception:
+                continue
+            result = row.get("result") or {}
+            text = _anthropic_text(result.get("message") or {}) if result.get("type") == "succeeded" else None
+            out[str(row.get("custom_id"))] = text
+        return out
+    auth = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+    for key in ("output_file_id", "error_file_id"):
+        file_id = data.get(key)
+        if not file_id:
+            continue
+        resp = _HTTP.get(f"{OPENAI_BASE_URL}/files/{file_id}/content", headers=auth, timeout=120)
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            try:
+                row = json.loads(line)
+            except Exception:
+                continue
+            r = row.get("response") or {}
+            body = r.get("body") or {}
+            text = None
+            if int(r.get("status_code") or 0) < 400 and body:
+                text = _parse_chat_output(body) if body.get("choices") else _parse_responses_output(body)
+            out.setdefault(str(row.get("custom_id")), text)
+    return out
+
+# Jobs creativos en modo batch: job_id -> {status, items, handle, ...}
+# Estado de los jobs batch en la cache compartida: /guideon/batch/{id} responde desde cualquier worker
+# y sobrevive a un reinicio. Mientras el batch sigue en curso el estado guarda `entries` (para rellenar
+# los guiones al terminar) y el worker que lo sigue marca `polled_at` en cada consulta; si deja de
+# hacerlo (proceso caído o reiniciado), el siguiente GET de estado retoma el seguimiento.
+_BATCH_JOBS = _SharedCache("guideon_batch", ttl_sec=GUIDEON_BATCH_TIMEOUT_SEC + GUIDEON_BATCH_TTL_SEC, max_entries=5000)
+
+def _batch_job_stale_sec() -> float:
+    return max(120.0, 4.0 * GUIDEON_BATCH_POLL_SEC)
+
+def _batch_job_get(job_id: str) -> Optional[Dict[str, Any]]:
+    """Estado del job batch, o None si no existe o terminó hace más de GUIDEON_BATCH_TTL_SEC."""
+    job = _BATCH_JOBS.get(job_id)
+    if job and job.get("finished_at") and job["finished_at"] < time.time() - GUIDEON_BATCH_TTL_SEC:
+        _BATCH_JOBS.pop(job_id)
+        return None
+    return job
+
+def _batch_job_finish(job_id: str, job: Dict[str, Any], status: str, detail: Optional[str] = None) -> None:
+    # Las transcripciones / segmentos de `entries` sólo hacen falta hasta volcar los resultados
+    job.pop("entries", None)
+    job.update(status=status, finished_at=time.time())
+    if detail:
+        job["detail"] = detail
+    _BATCH_JOBS[job_id] = job
+
+def _batch_job_claim(job_id: str) -> bool:
+    """Toma el seguimiento de un batch pendiente cuyo worker dejó de consultarlo (atómico entre procesos)."""
+    now = time.time()
+    claimed = []
+
+    def claim(job):
+        if not job or job["status"] != "pending" or now - job.get("polled_at", job["created_at"]) <= _batch_job_stale_sec():
+            return None  # sin cambios
+        claimed.append(job_id)
+        return dict(job, polled_at=now)
+
+    _BATCH_JOBS.update(job_id, claim)
+    return bool(claimed)
+
+def adapt_with_guideon_batch(entries: List[Dict[str, Any]], niche_prompt: str, rules_prompt: str,
+                             adaptation_level: str = "simple", rules_source: str = "guideon",
+                             custom_rules: str = "", lang: str = None) -> Optional[Dict[str, Any]]:
+    """Variante offline de adapt_with_guideon: envía todas las adaptaciones de un job en un solo batch.
+    `entries` = [{"custom_id": str, "transcript": str, "segments": list?}, ...]. Devuelve el handle del batch o None.
+    """
+    prompts = []
+    for e in entries:
+        system_text, user_text = _adapt_prompts(e["transcript"], niche_prompt, rules_prompt,
+                                                adaptation_level, rules_source, custom_rules, lang,
+                                                e.get("segments"))
+        prompts.append((e["custom_id"], system_text, user_text))
+    return _llm_batch_submit(prompts)
+
+def _batch_job_worker(job_id: str) -> None:
+    """Sigue el batch hasta que termina y rellena los items del job con los guiones adaptados."""
+    job = _BATCH_JOBS.get(job_id)
+    if not job:
+        return
+    deadline = job["created_at"] + GUIDEON_BATCH_TIMEOUT_SEC
+    while time.time() < deadline:
+        try:
+            status, data = _llm_batch_poll(job["handle"])
+        except Exception as e:
+            if DEBUG_GUIDEON:
+                print(f"[GUIDEON][batch] poll failed job={job_id}: {e}")
+            status, data = "pending", {}
+        if status == "pending":
+            job["polled_at"] = time.time()
+            _BATCH_JOBS[job_id] = job
+            time.sleep(max(1, GUIDEON_BATCH_POLL_SEC))
+            continue
+        if status == "failed":
+            _batch_job_finish(job_id, job, "failed", str(data.get("errors") or data.get("status"))[:300])
+            return
+        try:
+            results = _llm_batch_results(job["handle"], data)
+        except Exception as e:
+            _batch_job_finish(job_id, job, "failed", f"results_failed: {str(e)[:300]}")
+            return
+        level = job["adaptation_level"]
+        for e in job["entries"]:
+            guide = _adapt_result(results.get(e["custom_id"]), e["transcript"], level)
+            item = job["items"][e["index"]]
+            item["script"] = _format_guide_script(guide.get("script") or e["transcript"],
+                                                  guide.get("hooks") or [], guide.get("cta") or "")
+            item["batch_status"] = "done" if results.get(e["custom_id"]) else "failed"
+        _batch_job_finish(job_id, job, "done")
+        return
+    _batch_job_finish(job_id, job, "failed", "batch_timeout")
+
+def _start_batch_job(items: List[dict], entries: List[Dict[str, Any]], creative: Dict[str, Any]) -> Optional[str]:
+    """Envía las adaptaciones pendientes de un job como batch y arranca el seguimiento en segundo plano."""
+    handle = adapt_with_guideon_batch(entries, **creative)
+    if not handle:
+        return None
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    _BATCH_JOBS[job_id] = {
+        "status": "pending",
+        "handle": handle,
+        "items": items,
+        "entries": entries,
+        "adaptation_level": creative.get("adaptation_level") or "simple",
+        "created_at": now,
+        "polled_at": now,
+    }
+    threading.Thread(target=_batch_job_worker, args=(job_id,), daemon=True).start()
+    return job_id
+
+# ---------- Section-scoped rewrites (hook / // corte blocks / CTA) ----------
+_CORTE_RE = _re.compile(r"(\s*//\s*corte\s*)", _re.I)
+
+# Palabras clave (es/en) que apuntan a una sola sección del guion. Palabras completas ("cta" no
+# debe casar con "directa"); nada genérico como "inicio" o "cierre", que también aparece en
+# peticiones sobre el guion entero ("desde el inicio hasta el final").
+_SECTION_KEYWORDS = {
+    "hook": _re.compile(r"\b(?:ganchos?|hooks?|primera frase)\b"),
+    "cta": _re.compile(r"\b(?:ctas?|llamad[oa] a la acci[oó]n|call to action)\b"),
+}
+
+def _split_script_sections(text: str) -> Dict[str, Any]:
+    """Divide un guion de card en cabecera ([HOOKS]/[CTA]) y bloques del cuerpo separados por // corte.
+    Devuelve {header, prefix, blocks, seps}; unir prefix + blocks/seps intercalados reproduce el cuerpo.
+    """
+    header, body = "", text or ""
+    if "[GUION]" in body:
+        head, body = body.split("[GUION]", 1)
+        header = head + "[GUION]"
+    prefix = body[: len(body) - len(body.lstrip())]
+    parts = _CORTE_RE.split(body.lstrip())
+    return {"header": header, "prefix": prefix, "blocks": parts[0::2], "seps": parts[1::2]}
+
+def _join_script_sections(sections: Dict[str, Any]) -> str:
+    out = [sections["header"], sections["prefix"]]
+    blocks, seps = sections["blocks"], sections["seps"]
+    for i, block in enumerate(blocks):
+        out.append(block)
+        if i < len(seps):
+            out.append(seps[i])
+    return "".join(out)
+
+def _rewrite_target_section(user_prompt: str, section: Optional[str] = None) -> Optional[str]:
+    """'hook' | 'cta' si la edición toca solo esa sección; None para reescritura completa."""
+    s = (section or "auto").strip().lower()
+    if s in ("hook", "cta"):
+        return s
+    if s != "auto":
+        return None
+    p = (user_prompt or "").lower()
+    hits = [name for name, rx in _SECTION_KEYWORDS.items() if rx.search(p)]
+    return hits[0] if len(hits) == 1 else None
+
+def _rewrite_section_with_guideon(script: str, user_prompt: str, target: str, niche_prompt: str = "",
+                                  lang: Optional[str] = None, n_variants: int = 1) -> Optional[dict]:
+    """Reescribe solo el gancho o el CTA y lo reinserta localmente en el guion.
+    Envía la sección + el bloque vecino como contexto y pide solo el texto nuevo de la sección.
+    Devuelve None si el guion no tiene secciones separables (se usa la reescritura completa).
+    """
+    sections = _split_script_sections(script)
+    blocks = sections["blocks"]
+    if len(blocks) < 2:
+        return None
+    n_variants, max_tokens = _variant_budget(GUIDEON_SECTION_MAX_TOKENS, n_variants)
+    idx = 0 if target == "hook" else len(blocks) - 1
+    old = blocks[idx].strip()
+    if not old:
+        return None
+    neighbour = blocks[1] if target == "hook" else blocks[-2]
+    neighbour = neighbour.strip()[:GUIDEON_SECTION_CONTEXT_CHARS]
+    label = "GANCHO (primeros segundos)" if target == "hook" else "CTA (cierre)"
+
+    guideon_rules = _load_prompt("guionista")
+    if not guideon_rules:
+        guideon_rules = (
+            "Eres un guionista senior para Reels/TikTok. Estructura: Hook (<3s) → Desarrollo (2-3 ideas) → Prueba social → CTA. "
+            "Originalidad obligatoria. Usa // corte."
+        )
+    if n_variants > 1:
+        output_format = (
+            f"{{\"variants\": [{{\"section\": \"nuevo texto\"}}, ... ({n_variants} en total, DISTINTAS entre sí)]}}\n"
+        )
+    else:
+        output_format = "{\"section\": \"nuevo texto\"}\n"
+    system_text = (
+        guideon_rules
+        + "\n\n[REGLAS ESTRICTAS]\n"
+          f"1) Reescribe SOLO la sección {label} aplicando INSTRUCCIÓN_USUARIO; el resto del guion no cambia.\n"
+          "2) Devuelve SIEMPRE un JSON EXACTO con la clave `section`. NADA fuera del JSON.\n"
+          "3) No incluyas // corte ni otras secciones en `section`.\n"
+          "4) Sustituye todos los placeholders (p.ej. [nicho]) por el nicho indicado, sin corchetes.\n"
+          "5) PROHIBIDO devolver la sección original sin cambios.\n"
+        + f"\nIdioma objetivo: {lang}\n"
+    )
+    user_text = (
+        f"NICHO (opcional): {niche_prompt}\n"
+        "INSTRUCCIÓN_USUARIO: \n" + (user_prompt or "(sin cambios)") + "\n\n"
+        f"SECCIÓN_A_CAMBIAR ({label}):\n" + old + "\n\n"
+        + ("CONTEXTO (bloque siguiente, NO lo reescribas):\n" if target == "hook" else "CONTEXTO (bloque anterior, NO lo reescribas):\n")
+        + neighbour + "\n\n"
+        "FORMATO DE RESPUESTA (OBLIGATORIO, SOLO JSON):\n"
+        + output_format
+    )
+
+    resp = _llm_messages(system_text, user_text, max_tokens=max_tokens)
+    if not resp:
+        return None
+    objs = _safe_json_extract_variants(resp)
+    texts = [str(o.get("section") or o.get("script") or "").strip() for o in objs] if objs else [resp.strip()]
+
+    # Cabecera ([HOOKS]/[CTA]): se relee para devolverla actualizada con la sección nueva
+    hooks, cta = [], ""
+    if sections["header"]:
+        mh = _re.search(r"\[HOOKS\]\s*\n(.*?)(?:\n\s*\[CTA\]|\n\s*\[GUION\]|$)", sections["header"], _re.S)
+        if mh:
+            hooks = [h.strip()[2:].strip() if h.strip().startswith("- ") else h.strip()
+                     for h in mh.group(1).splitlines() if h.strip()]
+        mc = _re.search(r"\[CTA\]\s*\n(.*?)(?:\n\s*\[GUION\]|$)", sections["header"], _re.S)
+        if mc:
+            cta = mc.group(1).strip()
+
+    variants: List[dict] = []
+    seen = set()
+    for new in texts:
+        if not new or new == old or new in seen:
+            continue
+        seen.add(new)
+        # Conserva el espaciado alrededor del bloque original
+        raw = blocks[idx]
+        lead = raw[: len(raw) - len(raw.lstrip())]
+        trail = raw[len(raw.rstrip()):]
+        spliced = dict(sections, blocks=list(blocks))
+        spliced["blocks"][idx] = lead + new + trail
+        spliced["header"] = ""
+        body = _join_script_sections(spliced).strip()
+        if target == "hook" and hooks:
+            # El gancho en uso pasa a ser el nuevo: sustituye al viejo en [HOOKS] o va primero
+            new_hooks = [new if h == old else h for h in hooks]
+            if new not in new_hooks:
+                new_hooks.insert(0, new)
+        else:
+            new_hooks = hooks
+        variants.append({"script": body, "hooks": new_hooks, "cta": (new if (target == "cta" and cta) else cta)})
+    if not variants:
+        body = _join_script_sections(dict(sections, header="")).strip()
+        return {"script": body + "\n\n[Aviso] No se aplicaron cambios. Replantea la instrucción de edición.", "hooks": hooks, "cta": cta}
+    out = dict(variants[0], section=target)
+    if n_variants > 1:
+        out["variants"] = variants[:n_variants]
+    return out
+
 # ---------- Helper: rewrite_with_guideon for per-card rewrites ----------
 def rewrite_with_guideon(script: str, user_prompt: str, niche_prompt: str = "",
                          adaptation_level: str = "completa",
                          rules_source: str = "guideon",
                          custom_rules: str = "",
-                         lang: Optional[str] = None) -> dict:
+                         lang: Optional[str] = None,
+                         n_variants: int = 1,
+                         section: Optional[str] = "auto") -> dict:
     """Toma un guion existente y aplica cambios pedidos por el usuario usando Guideon/Claude.
     Devuelve dict {script, hooks, cta}. Si no hay JSON válido en salida, devuelve texto plano en `script`.
+    Con n_variants > 1 pide K alternativas distintas en UNA sola generación (array JSON) y las
+    devuelve en `variants`; script/hooks/cta reflejan la primera.
+    Si la instrucción apunta solo al gancho o al CTA (o `section` lo indica), reescribe únicamente
+    esa sección y la reinserta localmente.
     """
     lang = (lang or GUIDEON_LANG_DEFAULT or "es").strip()
+    n_variants = max(1, min(int(n_variants or 1), GUIDEON_MAX_VARIANTS))
+
+    target = _rewrite_target_section(user_prompt, section)
+    if target:
+        scoped = _rewrite_section_with_guideon(script, user_prompt, target, niche_prompt, lang, n_variants)
+        if scoped is not None:
+            return scoped
+        if DEBUG_GUIDEON:
+            print(f"[GUIDEON] section rewrite ({target}) not applicable; falling back to full rewrite")
     base_text = (script or "").strip()
     if len(base_text) > 4000:
         base_text = base_text[:4000] + "..."
+    # Cada variante necesita su propio presupuesto de salida, dentro del tope del modelo
+    n_variants, max_tokens = _variant_budget(GUIDEON_MAX_TOKENS, n_variants)
 
     # Siempre usar prompts/guionista como system_text, con fallback si no existe
     guideon_rules = _load_prompt("guionista")
@@ -1612,13 +3647,27 @@ def rewrite_with_guideon(script: str, user_prompt: str, niche_prompt: str = "",
             "Originalidad obligatoria. Usa // corte."
         )
 
+    if n_variants > 1:
+        output_rule = (
+            f"2) Devuelve SIEMPRE un JSON EXACTO {{\"variants\": [...]}} con EXACTAMENTE {n_variants} variantes DISTINTAS entre sí; "
+            "cada variante con las claves: script, hooks, cta. NADA fuera del JSON.\n"
+        )
+        output_format = (
+            "{\n  \"variants\": [\n"
+            "    {\"script\": \"texto final listo para grabar con // corte\", \"hooks\": [\"hook1\",\"hook2\"], \"cta\": \"llamado a la acción\"}\n"
+            f"    ... ({n_variants} en total)\n  ]\n}}\n"
+        )
+    else:
+        output_rule = "2) Devuelve SIEMPRE un JSON EXACTO con las claves: script, hooks, cta. NADA fuera del JSON.\n"
+        output_format = "{\n  \"script\": \"texto final listo para grabar con // corte\",\n  \"hooks\": [\"hook1\",\"hook2\"],\n  \"cta\": \"llamado a la acción\"\n}\n"
+
     # Refuerzos estrictos para que NO devuelva el mismo guion, y para obligar JSON
     system_text = (
         guideon_rules
         + "\n\n[REGLAS ESTRICTAS]\n"
           "1) Debes aplicar EXCLUSIVAMENTE los cambios pedidos en INSTRUCCIÓN_USUARIO.\n"
-          "2) Devuelve SIEMPRE un JSON EXACTO con las claves: script, hooks, cta. NADA fuera del JSON.\n"
-          "3) En `script`, devuelve el GUION COMPLETO listo para grabar con // corte.\n"
+        + output_rule
+        + "3) En `script`, devuelve el GUION COMPLETO listo para grabar con // corte.\n"
           "4) Si la instrucción es ‘cambia el gancho’, sustituye el gancho pero CONSERVA el resto del guion.\n"
           "5) Sustituye todos los placeholders (p.ej. [nicho]) por el nicho indicado, sin corchetes.\n"
           "6) PROHIBIDO devolver el texto original sin cambios.\n"
@@ -1632,28 +3681,46 @@ def rewrite_with_guideon(script: str, user_prompt: str, niche_prompt: str = "",
         "INSTRUCCIÓN_USUARIO: \n" + (user_prompt or "(sin cambios)") + "\n\n"
         "TEXTO_BASE (no inventes, modifícalo según instrucción):\n" + base_text + "\n\n"
         "FORMATO DE RESPUESTA (OBLIGATORIO, SOLO JSON):\n"
-        "{\n  \"script\": \"texto final listo para grabar con // corte\",\n  \"hooks\": [\"hook1\",\"hook2\"],\n  \"cta\": \"llamado a la acción\"\n}\n"
+        + output_format
     )
 
-    resp = _llm_messages(system_text, user_text)
+    resp = _llm_messages(system_text, user_text, max_tokens=max_tokens)
     if not resp:
         if DEBUG_GUIDEON:
             print("[GUIDEON] LLM returned no content; preserving base text with warning")
         return {"script": base_text + "\n\n[Aviso] No se pudo generar una versión adaptada (revisa modelo/API key o sube el nivel a 'completa').", "hooks": [], "cta": ""}
-    obj = _safe_json_extract(resp)
-    if obj and isinstance(obj, dict):
-        new_script = (obj.get("script") or script or "").strip()
-        hooks = obj.get("hooks") or []
-        cta = obj.get("cta") or ""
-        # Si no hubo cambios sustanciales y el usuario pidió algo, fuerza mensaje claro
-        if (new_script.replace("\n"," ").strip() == base_text.replace("\n"," ").strip()) and (user_prompt or niche_prompt):
+
+    def _norm(s: str) -> str:
+        return s.replace("\n", " ").strip()
+
+    objs = _safe_json_extract_variants(resp)
+    if objs:
+        variants: List[dict] = []
+        seen = set()
+        last_hooks, last_cta = [], ""
+        for obj in objs:
+            new_script = (obj.get("script") or script or "").strip()
+            hooks = obj.get("hooks") or []
+            cta = obj.get("cta") or ""
+            last_hooks, last_cta = hooks, cta
+            # Descarta variantes sin cambios sustanciales (si el usuario pidió algo) y duplicadas
+            if _norm(new_script) == _norm(base_text) and (user_prompt or niche_prompt):
+                continue
+            if _norm(new_script) in seen:
+                continue
+            seen.add(_norm(new_script))
+            variants.append({"script": new_script, "hooks": hooks, "cta": cta})
+        if not variants:
             if DEBUG_GUIDEON:
                 print("[GUIDEON] unchanged script detected; returning warning stub")
-            return {"script": base_text + "\n\n[Aviso] No se aplicaron cambios. Replantea la instrucción de edición.", "hooks": hooks, "cta": cta}
-        return {"script": new_script, "hooks": hooks, "cta": cta}
+            return {"script": base_text + "\n\n[Aviso] No se aplicaron cambios. Replantea la instrucción de edición.", "hooks": last_hooks, "cta": last_cta}
+        out = dict(variants[0])
+        if n_variants > 1:
+            out["variants"] = variants[:n_variants]
+        return out
     # Si no fue JSON, devolver texto pero marcar si está intacto
     clean_resp = (resp or "").strip()
-    if clean_resp.replace("\n"," ").strip() == base_text.replace("\n"," ").strip():
+    if _norm(clean_resp) == _norm(base_text):
         clean_resp += "\n\n[Aviso] La respuesta no aplicó cambios. Intenta especificar el modo (gancho/estructura/CTA) y el nicho."
     return {"script": clean_resp, "hooks": [], "cta": ""}
 
@@ -1661,7 +3728,8 @@ def rewrite_with_guideon(script: str, user_prompt: str, niche_prompt: str = "",
 @app.post("/transcribe")
 def transcribe(req: TranscribeReq):
     try:
-        text = transcribe_link(str(req.url))
+        with _work_context(bulk=False, user_id=req.user_id or "anon", plan=req.plan or ""):
+            text = transcribe_link(str(req.url))
         return {
             "items": [{
                 "url": str(req.url),
@@ -1669,6 +3737,8 @@ def transcribe(req: TranscribeReq):
                 "script": text
             }]
         }
+    except _Overloaded:
+        raise
     except RuntimeError as e:
         return JSONResponse({"error": "transcription_failed", "detail": str(e)}, status_code=500)
     except subprocess.CalledProcessError as e:
@@ -1679,6 +3749,242 @@ def transcribe(req: TranscribeReq):
     except Exception as e:
         return JSONResponse({"error": "transcription_failed", "detail": str(e)}, status_code=500)
 
+# ---------- Multi-window ranking (one scrape, several windows) ----------
+RANK_WINDOWS_MAX = int(os.getenv("RANK_WINDOWS_MAX", "5"))
+
+@app.post("/rank/windows")
+def rank_windows_endpoint(req: RankWindowsReq):
+    """Compara ventanas (p. ej. 7d / 21d / 60d) de los mismos perfiles con una sola recolección:
+    se scrapea la ventana más amplia y cada ventana se rankea sobre ese mismo conjunto.
+    Sólo métricas (sin transcripción); cuenta como un uso de analyze_profiles."""
+    labels = list(dict.fromkeys((w or "").strip().lower() for w in req.windows if (w or "").strip()))[:RANK_WINDOWS_MAX]
+    if not labels or not req.profiles:
+        return JSONResponse({"error": "bad_request", "detail": "Indica al menos un perfil y una ventana (p. ej. 7d)."}, status_code=400)
+    windows = {label: parse_window(label) for label in labels}
+    start = min(s for s, _ in windows.values())
+    end = max(e for _, e in windows.values())
+    resv = _usage_reserve(req.user_id, "analyze_profiles")
+    try:
+        with _work_context(bulk=False, user_id=req.user_id or "anon", plan=req.plan or ""):
+            posts = _collect_posts(req.profiles, start, end, lambda ev: None)
+        ranked = rank_windows(posts, windows, req.num_scripts, req.sort_by, req.order)
+    except _Overloaded:
+        _usage_release(resv)
+        raise
+    except Exception as e:
+        _usage_release(resv)
+        return JSONResponse({"error": "rank_failed", "detail": str(e)}, status_code=500)
+    _usage_commit(resv)
+    handles = {(p.platform, p.profile) for p in posts if p.profile}
+    return {
+        "collected": len(posts),
+        "profile_baselines": {f"{pl}:{h}": _PROFILE_STATS.baseline(pl, h) for pl, h in sorted(handles)},
+        "windows": {
+            label: {
+                "start": windows[label][0].isoformat(),
+                "posts": r["posts"],
+                "baseline": r["baseline"],
+                "items": [{"url": p.url, "posted_at": p.posted_at, "media_type": p.media_type, "metrics": p.metrics()}
+                          for p in r["top"]],
+            }
+            for label, r in ranked.items()
+        },
+    }
+
+@app.get("/profile/stats")
+def profile_stats(url: str, platform: Optional[str] = None):
+    """Agregados de engagement acumulados para un perfil (los que usa el ranking como baseline)."""
+    plat = (platform or ("tiktok" if "tiktok.com" in url else "youtube" if "youtube.com" in url else "instagram")).lower()
+    handle = _profile_handle(url)
+    state = _PROFILE_STATS.get(plat, handle)
+    if not state:
+        return JSONResponse({"error": "profile_not_found", "detail": "Sin estadísticas para ese perfil todavía."}, status_code=404)
+    return dict({k: v for k, v in state.items() if k != "posts"}, platform=plat, handle=handle,
+                baseline=_PROFILE_STATS.baseline(plat, handle), baseline_stat=PROFILE_BASELINE_STAT)
+
+# ---------- Batch transcribe (many links, streamed per URL) ----------
+TRANSCRIBE_BATCH_MAX = int(os.getenv("TRANSCRIBE_BATCH_MAX", "50"))
+TRANSCRIBE_BATCH_CONCURRENCY = int(os.getenv("TRANSCRIBE_BATCH_CONCURRENCY", "4"))  # links en curso por petición
+TRANSCRIBE_BATCH_WORKERS = int(os.getenv("TRANSCRIBE_BATCH_WORKERS", "8"))          # hilos para todos los batches
+TRANSCRIBE_BATCH_QUEUE_MAX = int(os.getenv("TRANSCRIBE_BATCH_QUEUE_MAX", "200"))    # links admitidos sin terminar
+
+# Un solo executor acotado para todos los batches (antes uno por petición: N batches = N× hilos)
+_TRANSCRIBE_BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, TRANSCRIBE_BATCH_WORKERS),
+                                                thread_name_prefix="transcribe-batch")
+_TRANSCRIBE_BATCH_LOCK = threading.Lock()
+_TRANSCRIBE_BATCH_ADMITTED = [0]  # links de batches admitidos que aún no terminaron
+
+def _transcribe_batch_admit(n: int) -> None:
+    """Admite el batch entero o lo rechaza con 503 + Retry-After: si la cola de links admitidos
+    no tiene sitio, o si algún budget del camino (descarga / ffmpeg / ASR) ya tiene su cola llena."""
+    stages = [_BUDGETS[name] for name in ("download", "ffmpeg", "asr")]
+    with _TRANSCRIBE_BATCH_LOCK:
+        saturated = [b for b in stages if b.active >= b.limit and b.waiting >= b.max_waiting]
+        backlog = _TRANSCRIBE_BATCH_ADMITTED[0]
+        if saturated or backlog + n > TRANSCRIBE_BATCH_QUEUE_MAX:
+            asr = _BUDGETS["asr"]
+            retry = max([b.retry_after() for b in stages]
+                        + [math.ceil((asr.avg_sec or 5.0) * (backlog + 1) / asr.limit / max(1, TRANSCRIBE_BATCH_WORKERS))])
+            for b in saturated:
+                b.rejected += 1
+            raise _Overloaded(saturated[0].name if saturated else "transcribe_batch", retry,
+                              f"Demasiadas transcripciones en curso ({backlog} links en cola).")
+        _TRANSCRIBE_BATCH_ADMITTED[0] += n
+
+def _transcribe_batch_release(n: int) -> None:
+    with _TRANSCRIBE_BATCH_LOCK:
+        _TRANSCRIBE_BATCH_ADMITTED[0] = max(0, _TRANSCRIBE_BATCH_ADMITTED[0] - n)
+
+def _transcribe_batch_one(url: str, media_url: Optional[str], with_segments: bool) -> Dict[str, Any]:
+    """Transcribe un link con la misma cadena que /transcribe (media directa -> resolver IG -> yt-dlp)
+    y devuelve el resultado o el error de ese link (nunca lanza, salvo cancelación)."""
+    try:
+        entry = transcribe_link_entry(url, media_url or None)
+        out: Dict[str, Any] = {"url": url, "script": entry["text"]}
+        if with_segments:
+            out["segments"] = entry["segments"]
+        if entry["audio_match"]:
+            out["audio_match"] = entry["audio_match"]
+        return out
+    except _Overloaded as e:
+        return {"url": url, "error": "overloaded", "detail": str(e), "retry_after": e.retry_after}
+    except subprocess.CalledProcessError as e:
+        return {"url": url, "error": "download_or_convert_failed",
+                "detail": (e.stderr or b"").decode("utf-8", "ignore")[:800]}
+    except Exception as e:
+        return {"url": url, "error": "transcription_failed", "detail": str(e)[:800]}
+
+@app.post("/transcribe/batch")
+async def transcribe_batch(req: TranscribeBatchReq, request: Request):
+    """Transcribe varios links a la vez y emite NDJSON: una línea `item` por URL única en cuanto
+    termina (con `indexes` = posiciones de la petición que la repetían) y una línea final `done`.
+    Se admite entero o se rechaza (503 + Retry-After) según la capacidad; una vez admitido corre
+    como trabajo bulk dentro de los budgets de descarga/ffmpeg/ASR, en el executor compartido y con
+    hasta TRANSCRIBE_BATCH_CONCURRENCY links a la vez. Si el cliente se desconecta, se cancela lo pendiente."""
+    if not req.items:
+        return JSONResponse({"error": "no_items", "detail": "Envía al menos un link."}, status_code=400)
+    if len(req.items) > TRANSCRIBE_BATCH_MAX:
+        return JSONResponse({"error": "too_many_items",
+                             "detail": f"Máximo {TRANSCRIBE_BATCH_MAX} links por petición."}, status_code=400)
+
+    # Dedupe por URL canónica; las repeticiones aportan su media_url/opciones si la primera no las trae
+    unique: Dict[str, Dict[str, Any]] = {}
+    for idx, it in enumerate(req.items):
+        key = _normalize_post_url(str(it.url))
+        entry = unique.setdefault(key, {"url": str(it.url), "media_url": None, "segments": False, "indexes": []})
+        entry["indexes"].append(idx)
+        entry["media_url"] = entry["media_url"] or it.media_url
+        entry["segments"] = entry["segments"] or bool(it.segments)
+
+    _transcribe_batch_admit(len(unique))
+    cancel = threading.Event()
+    queue = list(unique.values())
+    submitted: List[Any] = []  # futures del executor, para descontar los que nunca corrieron
+
+    def run(entry: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            with _work_context(bulk=True, user_id=req.user_id or "anon", plan=req.plan or "", cancel=cancel):
+                return dict(_transcribe_batch_one(entry["url"], entry["media_url"], entry["segments"]),
+                            indexes=entry["indexes"])
+        finally:
+            _transcribe_batch_release(1)
+
+    def release_unstarted() -> None:
+        # Lo que no llegó a correr (cola propia o futures aún sin hilo) deja de contar como admitido;
+        # lo que ya corre se descuenta al terminar
+        cancel.set()
+        for b in _BUDGETS.values():
+            b.wake()
+        never_ran = len(queue) + sum(1 for f in submitted if f.cancel())
+        queue.clear()
+        submitted.clear()  # idempotente: corre al cerrar el stream y otra vez como background
+        _transcribe_batch_release(never_ran)
+
+    async def stream():
+        pending = set()
+        ok = failed = 0
+        try:
+            while queue or pending:
+                # Ventana de TRANSCRIBE_BATCH_CONCURRENCY por petición: los batches se intercalan en el executor
+                while queue and len(pending) < max(1, TRANSCRIBE_BATCH_CONCURRENCY):
+                    submitted.append(_TRANSCRIBE_BATCH_EXECUTOR.submit(run, queue.pop(0)))
+                    pending.add(asyncio.wrap_future(submitted[-1]))
+                done, pending = await asyncio.wait(pending, timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    try:
+                        res = fut.result()
+                    except _Cancelled:
+                        continue
+                    if res.get("error"):
+                        failed += 1
+                    else:
+                        ok += 1
+                    yield json.dumps(dict(res, type="item"), ensure_ascii=False) + "\n"
+                if pending and await request.is_disconnected():
+                    return
+            yield json.dumps({"type": "done", "total": len(unique), "ok": ok, "failed": failed,
+                              "duplicates": len(req.items) - len(unique)}, ensure_ascii=False) + "\n"
+        finally:
+            release_unstarted()
+
+    # background: también libera la admisión si el stream nunca llegó a arrancar
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(release_unstarted),
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------- ASR service (Whisper compartido entre workers) ----------
+async def asr_segments(request: Request):
+    """Transcribe un WAV (cuerpo binario) con el Whisper de este proceso. Lo usan los workers de la
+    API cuando tienen ASR_SERVICE_URL; respeta la prioridad/usuario que mandan en las cabeceras.
+    Sólo existe con ASR_SERVICE_MODE=1 y ASR_SERVICE_TOKEN (ver _register_asr_service)."""
+    if not hmac.compare_digest(request.headers.get("authorization") or "", f"Bearer {ASR_SERVICE_TOKEN}"):
+        return JSONResponse({"error": "unauthorized", "detail": "Token del servicio ASR inválido."}, status_code=401)
+    if ASR_SERVICE_URL:
+        return JSONResponse({"error": "asr_service_loop", "detail": "Esta instancia delega el ASR (ASR_SERVICE_URL)."},
+                            status_code=400)
+    too_large = JSONResponse({"error": "audio_too_large",
+                              "detail": f"Máximo {ASR_SERVICE_MAX_BYTES // (1024 * 1024)} MB de WAV."}, status_code=413)
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        declared = 0
+    if declared > ASR_SERVICE_MAX_BYTES:
+        return too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > ASR_SERVICE_MAX_BYTES:  # sin Content-Length (chunked) o mintiendo
+            return too_large
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    if not body:
+        return JSONResponse({"error": "no_audio", "detail": "Envía el WAV en el cuerpo."}, status_code=400)
+    bulk = request.headers.get("x-work-bulk") == "1"
+    user_id = request.headers.get("x-user-id") or "anon"
+    plan = request.headers.get("x-plan") or ""
+
+    def run() -> List[Dict[str, Any]]:
+        with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
+            tmp.write(body)
+            tmp.flush()
+            with _work_context(bulk=bulk, user_id=user_id, plan=plan):
+                return _whisper_segments(tmp.name)
+
+    segments = await asyncio.get_running_loop().run_in_executor(None, run)
+    return {"segments": segments}
+
+def _register_asr_service(target: FastAPI) -> bool:
+    """Registra POST /asr/segments sólo en la instancia de servicio ASR y con token (falla cerrado:
+    sin token, el endpoint no existe y nadie puede poner a Whisper a trabajar con audio arbitrario)."""
+    if not ASR_SERVICE_MODE:
+        return False
+    if not ASR_SERVICE_TOKEN:
+        print("[ASR] ASR_SERVICE_MODE=1 sin ASR_SERVICE_TOKEN: /asr/segments desactivado")
+        return False
+    target.post("/asr/segments")(asr_segments)
+    return True
+
+_register_asr_service(app)
+
 # ---------- Per-card rewrite endpoint ----------
 @app.post("/guideon/rewrite")
 def guideon_rewrite(req: RewriteReq):
@@ -1688,59 +3994,94 @@ def guideon_rewrite(req: RewriteReq):
             return JSONResponse({"error": "no_openai_key", "detail": "Configura OPENAI_API_KEY en el entorno."}, status_code=400)
         if GUIDEON_PROVIDER == "anthropic" and not CLAUDE_API_KEY:
             return JSONResponse({"error": "no_claude_key", "detail": "Configura CLAUDE_API_KEY en el entorno."}, status_code=400)
-        out = rewrite_with_guideon(
-            script=req.script,
-            user_prompt=req.user_prompt,
-            niche_prompt=req.niche_prompt or "",
-            adaptation_level=(req.adaptation_level or "completa"),
-            rules_source=(req.rules_source or "guideon"),
-            custom_rules=req.custom_rules or "",
-            lang=req.lang or GUIDEON_LANG_DEFAULT,
-        )
+        with _work_context(bulk=False, user_id=req.user_id or "anon", plan=req.plan or ""):
+            out = rewrite_with_guideon(
+                script=req.script,
+                user_prompt=req.user_prompt,
+                niche_prompt=req.niche_prompt or "",
+                adaptation_level=(req.adaptation_level or "completa"),
+                rules_source=(req.rules_source or "guideon"),
+                custom_rules=req.custom_rules or "",
+                lang=req.lang or GUIDEON_LANG_DEFAULT,
+                n_variants=req.n_variants or 1,
+                section=req.section or "auto",
+            )
         return out
+    except _Overloaded:
+        raise
     except Exception as e:
         return JSONResponse({"error": "guideon_failed", "detail": str(e)}, status_code=500)
 
-# ---------- Job start: scrape + rank + transcribe ----------
-@app.post("/job/start")
-def job_start(req: JobReq):
-    try:
-        # 1) Window
-        start, end = parse_window(req.window)
-
-        # 2) Collect posts across profiles (YouTube real, IG/TikTok prefer Apify)
-        all_posts: List[Post] = []
-        for pr in (req.profiles or [])[:3]:
-            url = str(pr.url)
-            platform = (pr.platform or "").lower()
-
-            posts = []
-            used_provider = None
-            if "instagram.com" in url or platform == "instagram":
+# ---------- Job pipeline: scrape + rank + transcribe (+ adapt) ----------
+def _collect_posts(profiles: List[Profile], start: datetime, end: datetime,
+                   emit: Callable[[Dict[str, Any]], None]) -> List[Post]:
+    """Posts de hasta 3 perfiles dentro de [start, end] (IG/TikTok vía Apify, yt-dlp de respaldo)."""
+    all_posts: List[Post] = []
+    for pr in (profiles or [])[:3]:
+        _check_cancelled()
+        url = str(pr.url)
+        platform = (pr.platform or "").lower()
+
+        posts = []
+        used_provider = None
+        if "instagram.com" in url or platform == "instagram":
+            with _BUDGETS["scrape"].slot():
                 posts = fetch_instagram_posts_apify(url, start, end, limit=int(os.getenv("APIFY_DATASET_LIMIT", "50")))
                 used_provider = "apify_ig"
                 if not posts and not APIFY_ONLY:
                     posts = mock_fetch_instagram_posts(url, start, end)
                     used_provider = "yt_dlp_ig"
-            elif "tiktok.com" in url or platform == "tiktok":
+        elif "tiktok.com" in url or platform == "tiktok":
+            with _BUDGETS["scrape"].slot():
                 posts = fetch_tiktok_posts_apify(url, start, end, limit=int(os.getenv("APIFY_DATASET_LIMIT", "50")))
                 used_provider = "apify_tt"
                 if not posts and not APIFY_ONLY:
                     posts = mock_fetch_tiktok_posts(url, start, end)
                     used_provider = "yt_dlp_tt"
-            else:
-                posts = []
-                used_provider = "none"
+        else:
+            posts = []
+            used_provider = "none"
 
-            if DEBUG_APIFY:
-                print(f"[APIFY] Provider for {url}: {used_provider}, posts_found={len(posts)}")
+        if DEBUG_APIFY:
+            print(f"[APIFY] Provider for {url}: {used_provider}, posts_found={len(posts)}")
+
+        posts = filter_by_window(posts, start, end)
+        handle = sys.intern(_profile_handle(url))
+        for p in posts:
+            p.profile = handle
+        if posts:
+            _PROFILE_STATS.ingest(posts[0].platform, handle, posts)
+        all_posts.extend(posts)
+        emit({"type": "stage", "stage": "collect", "profile": url, "posts": len(posts)})
+    return all_posts
+
+def _run_job(req: JobReq, emit: Callable[[Dict[str, Any]], None]) -> tuple:
+    """Ejecuta el pipeline completo de un job y devuelve (payload, status_code).
+    `emit` recibe eventos de progreso reales:
+      {"type": "stage", "stage": "collect"|"rank"|"transcribe"|"adapt", ...}
+      {"type": "item", "index": i, "item": {...}, "done": k, "total": n}
+    """
+    items: List[Dict[str, Any]] = []
+    total = 0
+
+    def add_item(item: Dict[str, Any]) -> None:
+        items.append(item)
+        emit({"type": "item", "index": len(items) - 1, "item": item, "done": len(items), "total": max(total, len(items))})
 
-            posts = filter_by_window(posts, start, end)
-            all_posts.extend(posts)
+    def update_item(index: int) -> None:
+        emit({"type": "item", "index": index, "item": items[index], "done": len(items), "total": max(total, len(items))})
+
+    try:
+        # 1) Window
+        emit({"type": "stage", "stage": "collect"})
+        start, end = parse_window(req.window)
+
+        # 2) Collect posts across profiles (YouTube real, IG/TikTok prefer Apify)
+        all_posts = _collect_posts(req.profiles, start, end, emit)
 
         # 3) If nothing found, return diagnostic when DEBUG_APIFY is on
         if not all_posts and DEBUG_APIFY:
-            return JSONResponse({
+            return ({
                 "error": "no_posts_found",
                 "hint": "Apify no devolvió items para los perfiles y ventana indicados. Revisa actor/token/perfil (privado) o incrementa APIFY_RUN_TIMEOUT_SEC.",
                 "details": {
@@ -1750,102 +4091,864 @@ def job_start(req: JobReq):
                     "window": req.window,
                     "profiles": [{"platform": p.platform, "url": str(p.url)} for p in req.profiles],
                 }
-            }, status_code=200)
+            }, 200)
         # 3) Fallback demo if nothing
         if not all_posts:
-            demo = []
+            total = req.num_scripts
             for i in range(req.num_scripts):
-                demo.append({
+                add_item({
                     "url": f"https://example.com/post/{i+1}",
                     "metrics": {"views": 100000+i*1000, "likes": 5000+i*50, "comments": 200+i*5, "score": 80.0+i},
                     "script": f"[DEMO] Guion {i+1}: Hook <3s... Desarrollo... CTA..."
                 })
-            return JSONResponse({"items": demo})
+            return ({"items": items, "demo": True}, 200)
 
         # 4) Rank and pick Top-N
+        emit({"type": "stage", "stage": "rank", "posts": len(all_posts)})
         top_posts = select_top_posts(all_posts, req.num_scripts, getattr(req, "sort_by", "score"), getattr(req, "order", "desc"))
         
         if not top_posts:
             top_posts = all_posts[: max(1, min(req.num_scripts, 5))]
 
         # Separa por tipo: primero tarjetas para NO-video, luego transcribe videos
-        video_posts = [p for p in top_posts if p.get("is_video") or p.get("media_url") or (p.get("duration_sec") or 0) > 0]
-        nonvideo_posts = [p for p in top_posts if p not in video_posts]
-
-        items = []
+        video_posts = [p for p in top_posts if p.is_video or p.media_url or p.duration_sec > 0]
+        nonvideo_posts = [p for p in top_posts if not (p.is_video or p.media_url or p.duration_sec > 0)]
+        total = len(top_posts)
 
         # a) NO-video → mostrar etiqueta en lugar de transcripción
         for p in nonvideo_posts:
-            mtype = (p.get("media_type") or ("image" if not p.get("is_video") else "video")).lower()
+            mtype = (p.media_type or ("image" if not p.is_video else "video")).lower()
             etiqueta = "Imagen" if mtype == "image" else ("Carrusel" if mtype == "carousel" else mtype.capitalize())
-            items.append({
-                "url": p["url"],
-                "metrics": {
-                    "views": p.get("views"),
-                    "likes": p.get("likes"),
-                    "comments": p.get("comments"),
-                    "score": p.get("score")
-                },
+            add_item({
+                "url": p.url,
+                "metrics": p.metrics(),
                 "script": f"[POST NO ES VIDEO: {etiqueta}]"
             })
 
+        # Parámetros creativos (compartidos por todas las adaptaciones del job)
+        creative_mode = (req.mode or "").lower() == "creative"
+        cobj = req.creative or {}
+        creative_params = {
+            "niche_prompt": (cobj.get("niche_prompt") or "").strip(),
+            "rules_prompt": (cobj.get("rules_prompt") or "").strip(),
+            "adaptation_level": (cobj.get("adaptation_level") or "simple").strip().lower(),
+            "rules_source": (cobj.get("rules_source") or "guideon").strip().lower(),
+            "custom_rules": (cobj.get("custom_rules") or "").strip(),
+            "lang": (cobj.get("lang") or GUIDEON_LANG_DEFAULT or "es").strip(),
+        }
+        # Modo batch: las adaptaciones se envían juntas al endpoint batch del proveedor
+        batch_mode = creative_mode and bool(cobj.get("batch"))
+        batch_entries: List[Dict[str, Any]] = []
+
         # b) Videos → transcribir normalmente
+        failed_items = 0  # videos sin transcripción: el resultado es parcial (no se reutiliza)
         for p in video_posts:
+            _check_cancelled()
+            emit({"type": "stage", "stage": "transcribe", "index": len(items), "url": p.url})
+            segments = None
+            audio_match = None
             try:
-                transcript_text = transcribe_link(p["url"], p.get("media_url") or None)
+                entry = transcribe_link_entry(p.url, p.media_url or None)
+                transcript_text, segments, audio_match = entry["text"], entry["segments"], entry["audio_match"]
             except Exception as e:
                 transcript_text = f"(Error transcribiendo este video) {str(e)[:200]}"
+                failed_items += 1
 
             script_text = transcript_text
             hooks = []
             cta = ""
 
-            if (req.mode or "").lower() == "creative":
-                cobj = req.creative or {}
-                niche = (cobj.get("niche_prompt") or "").strip()
-                rules = (cobj.get("rules_prompt") or "").strip()
-                adaptation_level = (cobj.get("adaptation_level") or "simple").strip().lower()
-                rules_source = (cobj.get("rules_source") or "guideon").strip().lower()
-                custom_rules = (cobj.get("custom_rules") or "").strip()
-                lang = (cobj.get("lang") or GUIDEON_LANG_DEFAULT or "es").strip()
-
-                guide = adapt_with_guideon(
-                    transcript=transcript_text,
-                    niche_prompt=niche,
-                    rules_prompt=rules,
-                    adaptation_level=adaptation_level,
-                    rules_source=rules_source,
-                    custom_rules=custom_rules,
-                    lang=lang,
-                )
+            if batch_mode:
+                batch_entries.append({"custom_id": f"item-{len(items)}", "index": len(items),
+                                      "transcript": transcript_text, "segments": segments})
+            elif creative_mode:
+                emit({"type": "stage", "stage": "adapt", "index": len(items), "url": p.url})
+                guide = adapt_with_guideon(transcript=transcript_text, segments=segments, **creative_params)
                 script_text = guide.get("script") or transcript_text
                 hooks = guide.get("hooks") or []
                 cta = guide.get("cta") or ""
+                script_text = _format_guide_script(script_text, hooks, cta)
 
-                if hooks or cta:
-                    header = []
-                    if hooks:
-                        header.append("[HOOKS]\n- " + "\n- ".join([str(h) for h in hooks if h]))
-                    if cta:
-                        header.append("\n[CTA]\n" + str(cta))
-                    script_text = ("\n\n".join(header) + "\n\n[GUION]\n" + script_text).strip()
-
-            items.append({
-                "url": p["url"],
-                "metrics": {
-                    "views": p.get("views"),
-                    "likes": p.get("likes"),
-                    "comments": p.get("comments"),
-                    "score": p.get("score")
-                },
+            item = {
+                "url": p.url,
+                "metrics": p.metrics(),
                 "script": script_text
-            })
+            }
+            if audio_match:
+                item["audio_match"] = audio_match
+            add_item(item)
+
+        # c) Batch: devolvemos transcripciones ya y los guiones se rellenan al terminar el batch
+        if batch_entries:
+            job_id = _start_batch_job(items, batch_entries, creative_params)
+            if job_id:
+                for e in batch_entries:
+                    items[e["index"]]["batch_status"] = "pending"
+                    update_item(e["index"])
+                return (dict({"items": items, "batch": {"job_id": job_id, "status": "pending"}},
+                             **({"failed_items": failed_items} if failed_items else {})), 200)
+            # No se pudo crear el batch: adapta en línea como siempre
+            for e in batch_entries:
+                _check_cancelled()
+                emit({"type": "stage", "stage": "adapt", "index": e["index"]})
+                guide = adapt_with_guideon(transcript=e["transcript"], segments=e.get("segments"), **creative_params)
+                items[e["index"]]["script"] = _format_guide_script(guide.get("script") or e["transcript"],
+                                                                   guide.get("hooks") or [], guide.get("cta") or "")
+                update_item(e["index"])
+
+        if failed_items:
+            return ({"items": items, "failed_items": failed_items}, 200)
+        return ({"items": items}, 200)
+    except Exception as e:
+        return ({"error": "job_start_failed", "detail": str(e)}, 500)
+
+# ---------- Job result store (SQLite, o PostgreSQL si PG_ENABLED) ----------
+# Los resultados terminados se guardan por job_id y huella de la petición, con TTL:
+# GET /job/{id}/result sobrevive a un refresh/reinicio y una petición idéntica reciente se
+# sirve desde aquí (con su antigüedad) en vez de repetir scraping + ASR + LLM.
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "automator_jobs.sqlite3"))
+JOB_RESULT_TTL_SEC = int(os.getenv("JOB_RESULT_TTL_SEC", str(7 * 86400)))
+JOB_REPLAY_MAX_AGE_SEC = int(os.getenv("JOB_REPLAY_MAX_AGE_SEC", "21600"))  # 0 = no reutilizar
+DEBUG_JOBSTORE = os.getenv("DEBUG_JOBSTORE", "0").lower() in ("1", "true", "yes")
+
+@contextmanager
+def _job_store_conn():
+    if PG_ENABLED:
+        with _pg_conn() as conn:
+            yield conn
+        return
+    conn = _sqlite_connect(JOB_STORE_PATH)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def _job_store_exec(sql: str, params: tuple = (), fetch: bool = False):
+    """Ejecuta una sentencia en el store (placeholders estilo sqlite `?`, se adaptan para PG)."""
+    if PG_ENABLED:
+        sql = sql.replace("?", "%s")
+    with _job_store_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall() if fetch else None
+        conn.commit()
+        return rows
+
+def _ensure_job_store() -> bool:
+    ddl = [
+        "CREATE TABLE IF NOT EXISTS job_results (\n"
+        "  job_id TEXT PRIMARY KEY,\n"
+        "  fingerprint TEXT NOT NULL,\n"
+        "  status TEXT NOT NULL,\n"
+        "  status_code INTEGER NOT NULL,\n"
+        "  result TEXT NOT NULL,\n"
+        "  created_at DOUBLE PRECISION NOT NULL,\n"
+        "  finished_at DOUBLE PRECISION NOT NULL,\n"
+        "  expires_at DOUBLE PRECISION NOT NULL\n"
+        ")",
+        "CREATE INDEX IF NOT EXISTS idx_job_results_fp ON job_results (fingerprint, finished_at)",
+    ]
+    # Sin try/except: si falla, _LazyInit lo registra y reintenta en el siguiente uso
+    for stmt in ddl:
+        _job_store_exec(stmt)
+    return True
+
+_JOB_STORE = _LazyInit("job_store", _ensure_job_store)
+
+def _job_result_replayable(result: Dict[str, Any]) -> bool:
+    """Un resultado se puede reutilizar si es completo: sin error, sin batch pendiente, sin las
+    cards demo de cuando el scraping no trajo nada y sin videos que fallaron al transcribir."""
+    return not (result.get("error") or result.get("batch") or result.get("demo") or result.get("failed_items"))
+
+def _job_store_put(job_id: str, job: Dict[str, Any], status: str) -> None:
+    if not _JOB_STORE.get():
+        return
+    if status == "done" and not _job_result_replayable(job["result"] or {}):
+        return  # placeholder / parcial: no se guarda para no servirlo a peticiones idénticas
+    now = time.time()
+    try:
+        _job_store_exec("DELETE FROM job_results WHERE expires_at < ?", (now,))
+        _job_store_exec(
+            "INSERT INTO job_results (job_id, fingerprint, status, status_code, result, created_at, finished_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, job["fingerprint"], status, int(job["status_code"] or 500),
+             json.dumps(job["result"] or {}, ensure_ascii=False, default=str),
+             job["created_at"], now, now + JOB_RESULT_TTL_SEC),
+        )
+    except Exception as e:
+        print("[JOBSTORE] put failed:", e)
+
+def _job_store_row(row) -> Dict[str, Any]:
+    job_id, fp, status, status_code, result, created_at, finished_at = row
+    return {"job_id": job_id, "fingerprint": fp, "status": status, "status_code": status_code,
+            "result": json.loads(result), "created_at": created_at, "finished_at": finished_at}
+
+def _job_store_get(job_id: str) -> Optional[Dict[str, Any]]:
+    if not _JOB_STORE.get():
+        return None
+    try:
+        rows = _job_store_exec(
+            "SELECT job_id, fingerprint, status, status_code, result, created_at, finished_at "
+            "FROM job_results WHERE job_id = ? AND expires_at >= ?", (job_id, time.time()), fetch=True)
+    except Exception as e:
+        print("[JOBSTORE] get failed:", e)
+        return None
+    return _job_store_row(rows[0]) if rows else None
+
+def _job_store_find(fingerprint: str, max_age_sec: int) -> Optional[Dict[str, Any]]:
+    """Último resultado OK (sin error, batch pendiente, cards demo ni videos fallidos) de una
+    petición idéntica, si es reciente."""
+    if not _JOB_STORE.get() or max_age_sec <= 0:
+        return None
+    try:
+        rows = _job_store_exec(
+            "SELECT job_id, fingerprint, status, status_code, result, created_at, finished_at "
+            "FROM job_results WHERE fingerprint = ? AND status = 'done' AND finished_at >= ? "
+            "ORDER BY finished_at DESC LIMIT 5", (fingerprint, time.time() - max_age_sec), fetch=True)
+    except Exception as e:
+        print("[JOBSTORE] find failed:", e)
+        return None
+    for row in rows or []:
+        rec = _job_store_row(row)
+        if _job_result_replayable(rec["result"]):
+            return rec
+    return None
+
+def _cached_info(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """Indicador de antigüedad de un resultado servido desde el store."""
+    return {"source_job_id": rec["job_id"], "stored_at": rec["finished_at"],
+            "age_sec": int(time.time() - rec["finished_at"])}
+
+# ---------- Jobs: registry, single-flight coalescing, workers ----------
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_SEC = int(os.getenv("JOB_TTL_SEC", "3600"))
+# Jobs admitidos más allá de los workers activos; por encima se responde 503 + Retry-After
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "8"))
+# Si ningún cliente sigue el job durante este tiempo (pestaña cerrada), se cancela
+JOB_ABANDON_GRACE_SEC = float(os.getenv("JOB_ABANDON_GRACE_SEC", "20"))
+_JOB_FINAL = ("done", "failed", "cancelled")
+_JOBS: Dict[str, Dict[str, Any]] = {}
+_JOBS_LOCK = threading.Condition()
+_JOB_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+# Jobs en curso por huella de la petición: peticiones idénticas se unen al job líder
+_JOBS_INFLIGHT: Dict[str, str] = {}
+
+def _job_fingerprint(req: JobReq) -> str:
+    """Huella normalizada de un job (perfiles, ventana, orden, modo y parámetros creativos).
+    No incluye user_id: dos usuarios pidiendo lo mismo comparten el trabajo."""
+    profiles = sorted(
+        ((p.platform or "").strip().lower(), _normalize_post_url(str(p.url)))
+        for p in (req.profiles or [])[:3]
+    )
+    key = {
+        "profiles": profiles,
+        "window": (req.window or "").strip().lower(),
+        "num_scripts": req.num_scripts,
+        "sort_by": (req.sort_by or "score").lower(),
+        "order": (req.order or "desc").lower(),
+        "mode": (req.mode or "").strip().lower(),
+        "creative": (req.creative or {}) if (req.mode or "").strip().lower() == "creative" else {},
+    }
+    raw = json.dumps(key, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _job_apply_event(job: Dict[str, Any], event: Dict[str, Any]) -> None:
+    if event["type"] == "stage":
+        job["stage"] = event["stage"]
+    elif event["type"] == "done":
+        job["status"] = event["status"]
+    elif event["type"] == "item":
+        job["items"][event["index"]] = event["item"]
+        job["done"], job["total"] = event["done"], event["total"]
+    job["updated_at"] = event["ts"]
+
+def _job_emit(job_id: str, event: Dict[str, Any]) -> None:
+    """Registra un evento del job (append-only; los streams SSE/NDJSON los leen por índice)."""
+    job = _JOBS.get(job_id)
+    if not job:
+        return
+    with _JOBS_LOCK:
+        event = dict(event, seq=len(job["events"]), ts=time.time())
+        job["events"].append(event)
+        _job_apply_event(job, event)
+        _JOBS_LOCK.notify_all()
+    if JOB_EVENTS_SHARED:
+        _job_mirror_put(job_id, event)
+
+# ---------- Jobs across workers: eventos espejados en el SQLite compartido ----------
+# Con varios workers, /job/submit y /job/{id}/events pueden caer en procesos distintos: el dueño
+# del job espeja cada evento y los demás reconstruyen el estado desde ahí (solo lectura, + cancelar).
+JOB_EVENTS_SHARED = SERVE_WORKERS > 1 or os.getenv("JOB_EVENTS_SHARED", "0").lower() in ("1", "true", "yes")
+
+def _job_mirror_put(job_id: str, event: Dict[str, Any]) -> None:
+    try:
+        conn = _shared_cache_conn()
+        try:
+            conn.execute("INSERT OR REPLACE INTO job_events (job_id, seq, ev, ts) VALUES (?, ?, ?, ?)",
+                         (job_id, event["seq"], json.dumps(event, ensure_ascii=False, default=str), event["ts"]))
+            if event["type"] == "done":
+                conn.execute("DELETE FROM job_events WHERE ts < ?", (time.time() - JOB_TTL_SEC,))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        if DEBUG_CACHE:
+            print("[CACHE][job_events] put failed:", e)
+
+def _job_mirror_load(job_id: str) -> Optional[Dict[str, Any]]:
+    """Estado de un job de otro worker reconstruido desde sus eventos espejados (seq -1 = creado,
+    seq -2 = cancelación pedida desde otro worker)."""
+    if not JOB_EVENTS_SHARED:
+        return None
+    try:
+        conn = _shared_cache_conn()
+        try:
+            rows = conn.execute("SELECT ev FROM job_events WHERE job_id = ? ORDER BY seq", (job_id,)).fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        if DEBUG_CACHE:
+            print("[CACHE][job_events] load failed:", e)
+        return None
+    if not rows:
+        return None
+    all_events = [json.loads(r[0]) for r in rows]
+    events = [ev for ev in all_events if ev["seq"] >= 0]
+    job = {
+        "status": "queued", "stage": None, "done": 0, "total": 0, "items": {}, "events": events,
+        "result": None, "status_code": None, "followers": 0, "cached": None, "remote": True,
+        "created_at": all_events[0]["ts"], "updated_at": all_events[0]["ts"],
+    }
+    for ev in events:
+        if job["status"] == "queued":
+            job["status"] = "running"
+        _job_apply_event(job, ev)
+        if ev["type"] == "done":
+            job["cached"] = ev.get("cached")
+    if job["status"] in _JOB_FINAL:
+        rec = _job_store_get(job_id)
+        if rec:
+            job["result"], job["status_code"] = rec["result"], rec["status_code"]
+    return job
+
+def _job_mirror_cancel_requested(job_id: str) -> bool:
+    try:
+        conn = _shared_cache_conn()
+        try:
+            return conn.execute("SELECT 1 FROM job_events WHERE job_id = ? AND seq = -2", (job_id,)).fetchone() is not None
+        finally:
+            conn.close()
+    except Exception:
+        return False
+
+def _job_lookup(job_id: str) -> Optional[Dict[str, Any]]:
+    return _JOBS.get(job_id) or _job_mirror_load(job_id)
 
-        return JSONResponse({"items": items})
+def _job_worker(job_id: str, req: JobReq) -> None:
+    job = _JOBS[job_id]
+    with _JOBS_LOCK:
+        if job["status"] in _JOB_FINAL:  # cancelado antes de arrancar
+            return
+        job["status"] = "running"
+    # Job ya admitido: sus etapas esperan turno (como bulk, repartido por usuario) en vez de ser rechazadas
+    try:
+        with _work_context(bulk=True, user_id=req.user_id or "anon", plan=req.plan or "", cancel=job["cancel"]):
+            payload, status_code = _run_job(req, lambda ev: _job_worker_emit(job_id, ev))
+    except _Cancelled:
+        payload, status_code = _job_cancelled_payload(job), 499
     except Exception as e:
-        return JSONResponse({"error": "job_start_failed", "detail": str(e)}, status_code=500)
+        payload, status_code = {"error": "job_start_failed", "detail": str(e)}, 500
+    _job_finish(job_id, payload, status_code)
+
+def _job_worker_emit(job_id: str, event: Dict[str, Any]) -> None:
+    _job_emit(job_id, event)
+    # Con varios workers, un DELETE pudo llegar a otro proceso: se revisa en cada evento de progreso
+    if JOB_EVENTS_SHARED and _job_mirror_cancel_requested(job_id):
+        _cancel_job(job_id, "cancelled_by_client")
+        _check_cancelled()
+
+def _job_cancelled_payload(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {"error": "cancelled", "detail": job.get("cancel_reason") or "cancelled",
+            "items": [job["items"][i] for i in sorted(job["items"])]}
+
+def _job_finish(job_id: str, payload: Dict[str, Any], status_code: int) -> None:
+    job = _JOBS[job_id]
+    with _JOBS_LOCK:
+        if _JOBS_INFLIGHT.get(job["fingerprint"]) == job_id:
+            _JOBS_INFLIGHT.pop(job["fingerprint"], None)
+        job["result"] = payload
+        job["status_code"] = status_code
+    if payload.get("error") == "cancelled":
+        status = "cancelled"
+    else:
+        status = "failed" if (status_code >= 400 or (payload.get("error") and not payload.get("items"))) else "done"
+    # Las cards demo (scraping vacío) o un job sin ningún video transcrito no gastan uso del plan
+    charge = (status == "done" and not payload.get("demo")
+              and (payload.get("failed_items") or 0) < len(payload.get("items") or []))
+    for resv in job.get("usage") or []:
+        (_usage_commit if charge else _usage_release)(resv)
+    _job_store_put(job_id, job, status)
+    _job_emit(job_id, {"type": "done", "status": status, "error": payload.get("error"),
+                       "batch": payload.get("batch")})
+
+def _cancel_job(job_id: str, reason: str) -> bool:
+    """Cancela un job en cola o en curso. Las etapas lo notan en su siguiente punto de control:
+    se matan yt-dlp/ffmpeg, se aborta el run de Apify, Whisper para entre segmentos y las
+    llamadas LLM que esperan turno se descartan; la capacidad vuelve a los demás usuarios."""
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if not job or job["status"] in _JOB_FINAL or job["cancel"].is_set():
+            return False
+        job["cancel"].set()
+        job["cancel_reason"] = reason
+        # Una petición idéntica posterior debe arrancar de cero, no unirse a un job cancelado
+        if _JOBS_INFLIGHT.get(job["fingerprint"]) == job_id:
+            _JOBS_INFLIGHT.pop(job["fingerprint"], None)
+        queued = [p for p in _JOBS_PENDING if p[0] == job_id]
+        for p in queued:
+            _JOBS_PENDING.remove(p)
+    if DEBUG_APIFY:
+        print(f"[JOB] cancel {job_id}: {reason}")
+    if queued:
+        _job_finish(job_id, _job_cancelled_payload(job), 499)
+    for b in _BUDGETS.values():
+        b.wake()
+    return True
+
+def _job_attach(job_id: str) -> None:
+    with _JOBS_LOCK:
+        _JOBS[job_id]["watchers"] += 1
+
+def _job_detach(job_id: str) -> None:
+    """Un cliente dejó de seguir el job; si no queda ninguno tras el periodo de gracia, se cancela."""
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if not job:
+            return
+        job["watchers"] -= 1
+        abandoned = job["watchers"] <= 0 and job["status"] not in _JOB_FINAL
+    if abandoned:
+        t = threading.Timer(JOB_ABANDON_GRACE_SEC, _job_abandon_check, args=(job_id,))
+        t.daemon = True
+        t.start()
+
+def _job_abandon_check(job_id: str) -> None:
+    job = _JOBS.get(job_id)
+    if job and job["watchers"] <= 0:
+        _cancel_job(job_id, "client_disconnected")
+
+def _prune_jobs() -> None:
+    cutoff = time.time() - JOB_TTL_SEC
+    for jid in [j for j, job in list(_JOBS.items()) if job["status"] in _JOB_FINAL and job["updated_at"] < cutoff]:
+        _JOBS.pop(jid, None)
+
+# Jobs encolados (/job/start y /job/submit), como mucho JOB_WORKERS a la vez. Cada tarea del executor toma el job más "justo" al arrancar
+# (usuario con menos jobs despachados / peso del plan, luego el más antiguo) en vez de FIFO estricto,
+# para que un usuario con muchos jobs no monopolice los workers.
+_JOBS_PENDING: List[tuple] = []
+_JOBS_SHARE: Dict[str, float] = {}  # user -> jobs despachados / peso (tiempo virtual)
+_JOBS_VCLOCK = [0.0]
+
+def _job_enqueue(job_id: str, req: JobReq) -> None:
+    with _JOBS_LOCK:
+        _JOBS_PENDING.append((job_id, req))
+    _JOB_EXECUTOR.submit(_job_dispatch)
+
+def _job_dispatch() -> None:
+    with _JOBS_LOCK:
+        if not _JOBS_PENDING:
+            return
+        share = lambda user: max(_JOBS_SHARE.get(user, 0.0), _JOBS_VCLOCK[0])
+        job_id, req = min(_JOBS_PENDING, key=lambda p: (share(p[1].user_id or "anon"), _JOBS[p[0]]["created_at"]))
+        _JOBS_PENDING.remove((job_id, req))
+        if _JOBS[job_id]["status"] in _JOB_FINAL:
+            return
+        user = req.user_id or "anon"
+        _JOBS_VCLOCK[0] = share(user)
+        _JOBS_SHARE[user] = _JOBS_VCLOCK[0] + 1.0 / _plan_weight(req.plan)
+        if len(_JOBS_SHARE) > 1000:
+            for u in [u for u, v in _JOBS_SHARE.items() if v <= _JOBS_VCLOCK[0]]:
+                _JOBS_SHARE.pop(u, None)
+    _job_worker(job_id, req)
+
+def _job_counts() -> Dict[str, int]:
+    counts = {"queued": 0, "running": 0, "done": 0, "failed": 0, "cancelled": 0}
+    for job in list(_JOBS.values()):
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return counts
+
+def _job_retry_after(counts: Dict[str, int]) -> int:
+    """Estimación gruesa: duración media de los jobs recientes × turnos por delante."""
+    recent = [j["updated_at"] - j["created_at"] for j in list(_JOBS.values()) if j["status"] in _JOB_FINAL][-20:]
+    avg = (sum(recent) / len(recent)) if recent else 30.0
+    return math.ceil(avg * (counts["queued"] + 1) / max(1, JOB_WORKERS))
+
+def _replay_job(rec: Dict[str, Any]) -> str:
+    """Crea un job ya terminado a partir de un resultado guardado, con los mismos eventos
+    item/done que uno real para que SSE/NDJSON/polling funcionen igual."""
+    jid = uuid.uuid4().hex
+    now = time.time()
+    result = dict(rec["result"], cached=_cached_info(rec))
+    items = result.get("items") or []
+    job = {
+        "status": "running", "stage": None, "done": 0, "total": 0,
+        "items": {}, "events": [], "result": result, "status_code": rec["status_code"],
+        "fingerprint": rec["fingerprint"], "followers": 0, "watchers": 0,
+        "cancel": threading.Event(), "cancel_reason": None, "cached": result["cached"],
+        "created_at": now, "updated_at": now,
+    }
+    with _JOBS_LOCK:
+        _JOBS[jid] = job
+    for i, item in enumerate(items):
+        _job_emit(jid, {"type": "item", "index": i, "item": item, "done": i + 1, "total": len(items)})
+    _job_emit(jid, {"type": "done", "status": "done", "error": None, "batch": None, "cached": result["cached"]})
+    if DEBUG_JOBSTORE:
+        print(f"[JOBSTORE] replay {rec['job_id']} -> {jid} age={result['cached']['age_sec']}s")
+    return jid
+
+def _create_or_join_job(req: JobReq) -> tuple:
+    """Devuelve (job_id, creado). Si ya hay un job idéntico en curso, devuelve ese (creado=False).
+    Antes de nada reserva una unidad del plan del usuario (_LimitReached -> 409 sin gastar capacidad)."""
+    resv = _usage_reserve(req.user_id, _usage_feature_for_mode(req.mode))
+    try:
+        return _create_or_join_job_reserved(req, resv)
+    except BaseException:
+        _usage_release(resv)
+        raise
+
+def _join_inflight_job(fp: str, resv: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Une la petición al job idéntico en curso, si lo hay (se llama con el lock tomado)."""
+    jid = _JOBS_INFLIGHT.get(fp)
+    job = _JOBS.get(jid) if jid else None
+    if not job or job["status"] not in ("queued", "running"):
+        return None
+    job["followers"] += 1
+    if resv:
+        job["usage"].append(resv)
+    if DEBUG_APIFY:
+        print(f"[JOB] coalesced request into job {jid} (followers={job['followers']})")
+    return jid
+
+def _create_or_join_job_reserved(req: JobReq, resv: Optional[Dict[str, Any]]) -> tuple:
+    _prune_jobs()
+    fp = _job_fingerprint(req)
+    with _JOBS_LOCK:
+        jid = _join_inflight_job(fp, resv)
+    if jid:
+        return jid, False
+    # Petición idéntica reciente ya resuelta: se sirve desde el store con su antigüedad. La consulta
+    # (SQLite / PostgreSQL) va fuera del lock para no frenar los eventos de los demás jobs.
+    cached = None if req.refresh else _job_store_find(fp, JOB_REPLAY_MAX_AGE_SEC)
+    if cached:
+        _usage_commit(resv)
+        return _replay_job(cached), False
+    with _JOBS_LOCK:
+        # Otra petición idéntica pudo crear el job mientras consultábamos el store
+        jid = _join_inflight_job(fp, resv)
+        if jid:
+            return jid, False
+        active = _job_counts()
+        if active["queued"] + active["running"] >= JOB_WORKERS + JOB_QUEUE_MAX:
+            raise _Overloaded("job", _job_retry_after(active),
+                              f"Demasiados jobs en curso ({active['running']} activos, {active['queued']} en cola).")
+        jid = uuid.uuid4().hex
+        now = time.time()
+        _JOBS[jid] = {
+            "status": "queued", "stage": None, "done": 0, "total": 0,
+            "items": {}, "events": [], "result": None, "status_code": None,
+            "fingerprint": fp, "followers": 0, "watchers": 0,
+            "cancel": threading.Event(), "cancel_reason": None,
+            "usage": [resv] if resv else [],
+            "created_at": now, "updated_at": now,
+        }
+        _JOBS_INFLIGHT[fp] = jid
+        if JOB_EVENTS_SHARED:
+            _job_mirror_put(jid, {"type": "created", "seq": -1, "ts": now})
+        return jid, True
+
+def _job_view(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job_id,
+        "status": job["status"],     # queued | running | done | failed | cancelled
+        "stage": job["stage"],
+        "done": job["done"],
+        "total": job["total"],
+        "items": [job["items"][i] for i in sorted(job["items"])],
+        "result": job["result"],
+        "followers": job["followers"],
+        "cached": job.get("cached"),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+# ---------- Job start (síncrono, compatibilidad) ----------
+async def _job_ndjson_stream(job_id: str, request: Request):
+    """Emite NDJSON a partir de los eventos del job: una línea por evento (stage/item) y una final
+    `done` con el resto del payload (error, hint, batch...). Las cards no-video salen de inmediato
+    y cada video en cuanto termina. Si el cliente se va, deja de seguir el job (y éste se cancela
+    cuando no queda nadie esperándolo)."""
+    job = _JOBS[job_id]
+    seq = 0
+    _job_attach(job_id)
+    try:
+        while True:
+            events = job["events"]
+            while seq < len(events):
+                ev = events[seq]
+                seq += 1
+                if ev["type"] in ("stage", "item"):
+                    yield json.dumps({k: v for k, v in ev.items() if k not in ("seq", "ts")}, ensure_ascii=False) + "\n"
+            if job["status"] in _JOB_FINAL and seq >= len(job["events"]):
+                break
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(0.25)
+        payload = job["result"] or {}
+        done = {k: v for k, v in payload.items() if k != "items"}
+        yield json.dumps(dict(done, type="done", status_code=job["status_code"]), ensure_ascii=False) + "\n"
+    finally:
+        _job_detach(job_id)
 
+@app.post("/job/start")
+async def job_start(req: JobReq, request: Request, stream: bool = False):
+    # La admisión (reserva de uso en PG, espera de conexión del pool, store de jobs) es bloqueante:
+    # va al threadpool para no frenar el event loop; _LimitReached/_Overloaded se propagan igual.
+    job_id, created = await asyncio.get_running_loop().run_in_executor(None, _create_or_join_job, req)
+    if created:
+        _job_enqueue(job_id, req)
+    # Modo streaming: ?stream=1 o Accept: application/x-ndjson
+    if stream or "application/x-ndjson" in (request.headers.get("accept") or ""):
+        return StreamingResponse(_job_ndjson_stream(job_id, request), media_type="application/x-ndjson",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Espera el resultado (propio o del job líder si se coalesció) sin ocupar un hilo del threadpool
+    job = _JOBS[job_id]
+    _job_attach(job_id)
+    try:
+        while job["status"] not in _JOB_FINAL:
+            if await request.is_disconnected():
+                return JSONResponse({"error": "client_disconnected"}, status_code=499)
+            await asyncio.sleep(0.25)
+    finally:
+        _job_detach(job_id)
+    return JSONResponse(job["result"], status_code=job["status_code"] or 500)
+
+# ---------- Async jobs: submit + status + SSE progress ----------
+@app.post("/job/submit")
+def job_submit(req: JobReq):
+    """Encola el job y devuelve su id de inmediato; el progreso se sigue en /job/{id} o /job/{id}/events.
+    Una petición idéntica a un job en curso recibe el id de ese job (coalesced=True); si ya se
+    resolvió hace poco, recibe un job terminado desde el store (cached = {age_sec, ...})."""
+    job_id, created = _create_or_join_job(req)
+    if created:
+        _job_enqueue(job_id, req)
+    job = _JOBS[job_id]
+    return {"job_id": job_id, "status": job["status"], "coalesced": not created and not job.get("cached"),
+            "cached": job.get("cached")}
+
+@app.get("/job/{job_id}/result")
+def job_result(job_id: str):
+    """Resultado final del job: desde memoria si sigue ahí, si no desde el store persistente."""
+    job = _JOBS.get(job_id)
+    if job and job["status"] in _JOB_FINAL:
+        return JSONResponse(dict(job["result"] or {}, job_id=job_id, status=job["status"]),
+                            status_code=job["status_code"] or 500)
+    job = job or _job_mirror_load(job_id)
+    if job and job["status"] not in _JOB_FINAL:
+        return JSONResponse({"job_id": job_id, "status": job["status"], "detail": "El job aún no terminó."},
+                            status_code=202)
+    rec = _job_store_get(job_id)
+    if not rec:
+        return JSONResponse({"error": "job_not_found", "detail": "No existe ese job (o expiró)."}, status_code=404)
+    return JSONResponse(dict(rec["result"], job_id=job_id, status=rec["status"], stored_at=rec["finished_at"],
+                             age_sec=int(time.time() - rec["finished_at"])),
+                        status_code=rec["status_code"])
+
+@app.get("/job/{job_id}")
+def job_status(job_id: str):
+    job = _job_lookup(job_id)
+    if not job:
+        return JSONResponse({"error": "job_not_found", "detail": "No existe ese job (o expiró)."}, status_code=404)
+    return _job_view(job_id, job)
+
+@app.delete("/job/{job_id}")
+def job_cancel(job_id: str):
+    """Cancela el job. Si otros clientes se unieron a él (coalesced), sólo se retira este
+    interesado y el job sigue para ellos."""
+    if job_id not in _JOBS:
+        job = _job_mirror_load(job_id)
+        if not job:
+            return JSONResponse({"error": "job_not_found", "detail": "No existe ese job (o expiró)."}, status_code=404)
+        # Job de otro worker: se deja la marca y su dueño lo cancela en el siguiente evento
+        if job["status"] not in _JOB_FINAL:
+            _job_mirror_put(job_id, {"type": "cancel", "seq": -2, "ts": time.time()})
+        return {"job_id": job_id, "status": job["status"], "cancelled": job["status"] not in _JOB_FINAL}
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if not job:
+            return JSONResponse({"error": "job_not_found", "detail": "No existe ese job (o expiró)."}, status_code=404)
+        if job["followers"] > 0 and job["status"] not in _JOB_FINAL:
+            job["followers"] -= 1
+            return {"job_id": job_id, "status": job["status"], "cancelled": False, "detached": True}
+    cancelled = _cancel_job(job_id, "cancelled_by_client")
+    return {"job_id": job_id, "status": job["status"], "cancelled": cancelled}
+
+@app.get("/job/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events con las transiciones de etapa y cada item terminado.
+    Respeta Last-Event-ID para reanudar tras una reconexión del EventSource.
+    """
+    job = _job_lookup(job_id)
+    remote = bool(job and job.get("remote"))
+    if not job:
+        return JSONResponse({"error": "job_not_found", "detail": "No existe ese job (o expiró)."}, status_code=404)
+    try:
+        start_seq = int(request.headers.get("last-event-id", "-1")) + 1
+    except ValueError:
+        start_seq = 0
+
+    async def stream():
+        nonlocal job
+        seq = max(0, start_seq)
+        last_write = time.time()
+        if not remote:
+            _job_attach(job_id)
+        try:
+            while True:
+                if remote:
+                    job = await asyncio.get_running_loop().run_in_executor(None, _job_mirror_load, job_id) or job
+                events = job["events"]
+                while seq < len(events):
+                    ev = events[seq]
+                    yield f"id: {ev['seq']}\nevent: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+                    seq += 1
+                    last_write = time.time()
+                if job["status"] in _JOB_FINAL and seq >= len(job["events"]):
+                    return
+                if await request.is_disconnected():
+                    return
+                if time.time() - last_write > 15:
+                    yield ": ping\n\n"
+                    last_write = time.time()
+                await asyncio.sleep(1.0 if remote else 0.5)
+        finally:
+            if not remote:
+                _job_detach(job_id)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------- Batch job status (creative jobs in batch mode) ----------
+@app.get("/guideon/batch/{job_id}")
+def guideon_batch_status(job_id: str):
+    job = _batch_job_get(job_id)
+    if not job:
+        return JSONResponse({"error": "batch_not_found", "detail": "No existe ese job batch."}, status_code=404)
+    if job["status"] == "pending" and _batch_job_claim(job_id):
+        # El worker que lo seguía ya no está (reinicio / proceso caído): se retoma aquí
+        threading.Thread(target=_batch_job_worker, args=(job_id,), daemon=True).start()
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "provider": job["handle"]["provider"],
+        "detail": job.get("detail"),
+        "items": job["items"],
+    }
+
+# ---------- Capacity / queue lengths ----------
+@app.get("/capacity")
+async def capacity():
+    """Budgets por clase de recurso (límite, activos, en espera, rechazos), estado de la cola de jobs
+    y métricas del pool de PostgreSQL."""
+    counts = _job_counts()
+    return {
+        "budgets": {name: b.view() for name, b in _BUDGETS.items()},
+        "jobs": {
+            "workers": JOB_WORKERS,
+            "max_queued": JOB_QUEUE_MAX,
+            "queued": counts["queued"],
+            "running": counts["running"],
+        },
+        "transcribe_batch": {
+            "workers": TRANSCRIBE_BATCH_WORKERS,
+            "max_queued": TRANSCRIBE_BATCH_QUEUE_MAX,
+            "admitted": _TRANSCRIBE_BATCH_ADMITTED[0],
+        },
+        "pg_pool": _PG_POOL.view() if _PG_POOL else None,
+    }
+
+# async: no ocupa un hilo del threadpool, responde aunque los endpoints síncronos estén saturados
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
+
+# ---------- Warm-up & readiness ----------
+# /health sólo dice que el proceso vive. /ready responde 503 hasta que el warm-up termina
+# (modelo Whisper cargado + una inferencia sintética, prompts, conexiones HTTP abiertas), así el
+# balanceador no manda la primera transcripción a un pod frío.
+ASR_WARMUP = os.getenv("ASR_WARMUP", "1").lower() in ("1", "true", "yes")
+WARMUP_CLIP = os.path.join(os.path.dirname(__file__), "assets", "warmup.wav")  # 1 s, 16 kHz mono
+
+def _warm_prompts() -> str:
+    names = [os.path.splitext(f)[0] for f in sorted(os.listdir(_PROMPTS_DIR))] if os.path.isdir(_PROMPTS_DIR) else []
+    loaded = [n for n in names if _load_prompt(n)]
+    return f"{len(loaded)} prompts"
+
+def _warm_http() -> str:
+    """Abre la conexión keep-alive con cada host que vamos a usar (basta un HEAD; el código da igual)."""
+    hosts = []
+    if os.getenv("APIFY_TOKEN", "").strip():
+        hosts.append("https://api.apify.com")
+    hosts.append(OPENAI_BASE_URL.rstrip("/") if GUIDEON_PROVIDER == "openai" else ANTHROPIC_BASE_URL)
+    if ASR_SERVICE_URL:
+        hosts.append(ASR_SERVICE_URL)
+    opened = []
+    for host in hosts:
+        try:
+            _HTTP.head(host, timeout=5)
+            opened.append(urllib.parse.urlparse(host).netloc)
+        except Exception as e:
+            if DEBUG_ASR or DEBUG_APIFY:
+                print("[WARMUP] http", host, "failed:", e)
+    if hosts and not opened:
+        raise RuntimeError("no HTTP host reachable: " + ", ".join(hosts))
+    return ", ".join(opened)
+
+def _warm_asr() -> str:
+    """Carga el modelo Whisper y corre una inferencia corta sobre el clip incluido (la primera
+    inferencia de CTranslate2 es bastante más lenta que las siguientes)."""
+    if ASR_SERVICE_URL:
+        return "remote"
+    if not ASR_WARMUP:
+        return "skipped"
+    try:
+        from faster_whisper import WhisperModel  # noqa: F401
+    except Exception:
+        return "faster-whisper not installed (placeholder transcripts)"
+    with _BUDGETS["asr"].slot():
+        model = _get_whisper_model(ASR_MODEL)
+        origin = "baked" if _whisper_model_source(ASR_MODEL) != ASR_MODEL else "hub"
+        if not os.path.exists(WARMUP_CLIP):
+            return f"{ASR_MODEL} loaded ({origin})"
+        t0 = time.time()
+        segments, _ = model.transcribe(WARMUP_CLIP, beam_size=1, language="es", vad_filter=False)
+        list(segments)
+    return f"{ASR_MODEL} loaded ({origin}), warm-up inference {int((time.time() - t0) * 1000)} ms"
+
+_LazyInit("prompts", _warm_prompts)
+_LazyInit("http_pools", _warm_http)
+_LazyInit("asr_model", _warm_asr)
+
+@app.get("/ready")
+async def ready():
+    """Estado de cada componente del arranque. 503 mientras alguno siga calentando; con todo
+    terminado responde 200 (`degraded` si alguno falló: se reintenta en el siguiente uso pasado
+    `retry_in`, y /ready también dispara el reintento)."""
+    for init in list(_BOOTSTRAP.values()):
+        if init.error is not None and init.state()["retry_in"] == 0:
+            asyncio.get_running_loop().run_in_executor(None, init.get)
+    components = {name: init.state() for name, init in _BOOTSTRAP.items()}
+    warming = [name for name, s in components.items() if not s["done"]]
+    failed = [name for name, s in components.items() if s["done"] and not s["ok"]]
+    status = "warming" if warming else ("degraded" if failed else "ready")
+    return JSONResponse({"status": status, "components": components}, status_code=503 if warming else 200)
 #nota
\ No newline at end of file
@@ -20,7 +20,19 @@ function usageMonthKey(){
 function usageStorageKey(userId, feature){
   return `usage:${userId}:${feature}:${usageMonthKey()}`;
 }
+// Contadores del servidor (/usage/summary): el backend reserva el uso al lanzar el job.
+// null = backend sin PostgreSQL -> contador local en localStorage como antes.
+let serverUsage = null;
+async function refreshUsage(){
+  try{
+    const qs = new URLSearchParams({ user_id: USER_ID, plan: USER_PLAN });
+    const res = await fetch(`${API_BASE}/usage/summary?${qs}`);
+    serverUsage = res.ok ? ((await res.json()).features || {}) : null;
+  }catch{ serverUsage = null; }
+  renderUsageBadge();
+}
 function getUsageCount(userId, feature){
+  if (serverUsage) return serverUsage[feature]?.used || 0;
   try{ return Math.max(0, parseInt(localStorage.getItem(usageStorageKey(userId, feature))||'0',10)); }catch{ return 0; }
 }
 function setUsageCount(userId, feature, val){
@@ -209,15 +221,10 @@ document.getElementById('clearBtn').addEventListener('click', ()=>{
 });
 
 // ------ Progress helpers ------
-let progressTimer = null;
 let currentSteps = [];
 let currentStepIdx = 0;
 
 function resetProgress() {
-  if (progressTimer) {
-    clearInterval(progressTimer);
-    progressTimer = null;
-  }
   currentSteps = [];
   currentStepIdx = 0;
   if (progressFill) progressFill.style.width = '0%';
@@ -240,27 +247,138 @@ function setSteps(steps) {
   currentStepIdx = 0;
 }
 
-function advanceStep() {
+// Etapas reales del backend -> índice del paso en la UI
+const STAGE_STEP = { collect: 0, rank: 1, transcribe: 2, adapt: 3 };
+
+function setStageStep(stage, label) {
   if (!currentSteps.length) return;
-  const items = Array.from(progressStepsEl.querySelectorAll('li'));
   const lastWorkingIdx = Math.max(0, currentSteps.length - 2);
-  if (currentStepIdx >= lastWorkingIdx) {
-    if (progressFill) progressFill.style.width = '92%';
-    return;
-  }
+  const idx = Math.min(STAGE_STEP[stage] ?? currentStepIdx, lastWorkingIdx);
+  const items = Array.from(progressStepsEl.querySelectorAll('li'));
   if (items[currentStepIdx]) items[currentStepIdx].classList.remove('active');
-  currentStepIdx = Math.min(currentStepIdx + 1, lastWorkingIdx);
+  currentStepIdx = Math.max(currentStepIdx, idx);
   if (items[currentStepIdx]) items[currentStepIdx].classList.add('active');
   const pct = Math.round(((currentStepIdx + 1) / (currentSteps.length)) * 90);
   if (progressFill) progressFill.style.width = `${Math.min(pct, 92)}%`;
-  if (progressLabel) progressLabel.textContent = currentSteps[currentStepIdx] || 'Procesando…';
+  if (progressLabel) progressLabel.textContent = label || currentSteps[currentStepIdx] || 'Procesando…';
 }
 
-function completeProgress() {
-  if (progressTimer) {
-    clearInterval(progressTimer);
-    progressTimer = null;
+// Sigue un job asíncrono por SSE: etapas reales + cada card en cuanto está lista
+function followJob(jobId, onItem) {
+  return new Promise((resolve, reject) => {
+    const es = new EventSource(`${API_BASE}/job/${jobId}/events`);
+    let total = 0;
+    es.addEventListener('stage', (e) => {
+      const ev = JSON.parse(e.data);
+      const n = (typeof ev.index === 'number' && total) ? ` (${ev.index + 1}/${total})` : '';
+      setStageStep(ev.stage, (currentSteps[STAGE_STEP[ev.stage]] || 'Procesando…') + n);
+    });
+    es.addEventListener('item', (e) => {
+      const ev = JSON.parse(e.data);
+      total = ev.total || total;
+      onItem(ev.index, ev.item);
+      if (progressFill && total) {
+        const base = Math.round(((currentStepIdx + 1) / (currentSteps.length)) * 90);
+        progressFill.style.width = `${Math.min(92, Math.max(base, Math.round((ev.done / total) * 92)))}%`;
+      }
+    });
+    es.addEventListener('done', async () => {
+      es.close();
+      try {
+        const res = await fetch(`${API_BASE}/job/${jobId}`);
+        resolve(await res.json());
+      } catch (err) { reject(err); }
+    });
+    es.onerror = () => {
+      // EventSource reintenta solo (con Last-Event-ID); si se cerró definitivamente, falla
+      if (es.readyState === EventSource.CLOSED) reject(new Error('Conexión de progreso perdida'));
+    };
+  });
+}
+
+// Alternativa sin cola de jobs: /job/start en streaming NDJSON (mismos eventos stage/item/done)
+async function streamJob(payload, onItem) {
+  const res = await fetch(`${API_BASE}/job/start?stream=1`, {
+    method:'POST',
+    headers:{'Content-Type':'application/json', 'Accept':'application/x-ndjson'},
+    body: JSON.stringify(payload)
+  });
+  if(!res.ok || !res.body){
+    const err = await res.json().catch(()=>({}));
+    throw Object.assign(new Error(err.detail || err.error || ('HTTP '+res.status)), { code: err.error });
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  const items = [];
+  let buf = '';
+  let done = null;
+  const handle = (line) => {
+    if (!line.trim()) return;
+    const ev = JSON.parse(line);
+    if (ev.type === 'stage'){
+      setStageStep(ev.stage);
+    } else if (ev.type === 'item'){
+      items[ev.index] = ev.item;
+      onItem(ev.index, ev.item);
+    } else if (ev.type === 'done'){
+      done = ev;
+    }
+  };
+  for(;;){
+    const { value, done: eof } = await reader.read();
+    if (eof) break;
+    buf += decoder.decode(value, { stream: true });
+    const lines = buf.split('\n');
+    buf = lines.pop();
+    lines.forEach(handle);
+  }
+  handle(buf);
+  const { type, status_code, ...rest } = done || {};
+  return { result: { ...rest, items: items.filter(Boolean) } };
+}
+
+// Antigüedad legible de un resultado servido desde el store del backend
+function formatAge(sec){
+  const s = Math.max(0, Math.round(sec || 0));
+  if (s < 60) return `${s} s`;
+  if (s < 3600) return `${Math.round(s / 60)} min`;
+  return `${Math.round(s / 3600)} h`;
+}
+
+// Job en curso: si se cierra la pestaña se cancela en el backend (libera descargas/ASR/LLM)
+let activeJobId = null;
+window.addEventListener('pagehide', () => {
+  if (activeJobId) {
+    fetch(`${API_BASE}/job/${activeJobId}`, { method: 'DELETE', keepalive: true }).catch(()=>{});
+  }
+});
+
+// Job asíncrono con SSE si está disponible; si no (o el backend no tiene /job/submit), streaming NDJSON
+async function runJob(payload, onItem) {
+  if (typeof EventSource !== 'undefined'){
+    const res = await fetch(`${API_BASE}/job/submit`, {
+      method:'POST',
+      headers:{'Content-Type':'application/json'},
+      body: JSON.stringify(payload)
+    });
+    if (res.ok){
+      const { job_id } = await res.json();
+      activeJobId = job_id;
+      try {
+        return await followJob(job_id, onItem);
+      } finally {
+        activeJobId = null;
+      }
+    }
+    if (res.status !== 404 && res.status !== 405){
+      const err = await res.json().catch(()=>({}));
+      throw Object.assign(new Error(err.detail || err.error || ('HTTP '+res.status)), { code: err.error });
+    }
   }
+  return streamJob(payload, onItem);
+}
+
+function completeProgress() {
   const items = Array.from(progressStepsEl.querySelectorAll('li'));
   if (items.length) {
     items.forEach(li => li.classList.remove('active'));
@@ -287,7 +405,7 @@ if (singleBtn){
       const res = await fetch(`${API_BASE}/transcribe`, {
         method:'POST',
         headers:{'Content-Type':'application/json'},
-        body: JSON.stringify({ url })
+        body: JSON.stringify({ url, user_id: USER_ID, plan: USER_PLAN })
       });
       if(!res.ok){
         const err = await res.json().catch(()=>({}));
@@ -343,7 +461,6 @@ form.addEventListener('submit', async (e)=>{
     ? ['Recolectando publicaciones…','Rankeando…','Transcribiendo…','Adaptando…','Listo']
     : ['Recolectando publicaciones…','Rankeando…','Transcribiendo…','Listo'];
   setSteps(steps);
-  progressTimer = setInterval(advanceStep, 1200);
 
   const adaptationLevel = getCheckedValue(adaptationLevelEl, 'adaptation') || 'simple';
   const rulesSource = getCheckedValue(rulesSourceEl, 'rulesSrc') || 'guideon';
@@ -351,6 +468,7 @@ form.addEventListener('submit', async (e)=>{
 
   const payload = {
     user_id: USER_ID,
+    plan: USER_PLAN,
     mode,
     profiles: links.slice(0,3).map(url => {
       const platform = url.includes('tiktok') ? 'tiktok' : 'instagram';
@@ -371,42 +489,66 @@ form.addEventListener('submit', async (e)=>{
   };
 
   try {
-    const res = await fetch(`${API_BASE}/job/start`, {
-      method:'POST',
-      headers:{'Content-Type':'application/json'},
-      body: JSON.stringify(payload)
+    // Cards por índice: un item puede llegar de nuevo (p.ej. adaptado tras la transcripción)
+    const cardByIndex = {};
+    const job = await runJob(payload, (index, item) => {
+      const prev = cardByIndex[index];
+      const el = addCard(item);
+      if (prev){ prev.replaceWith(el); }
+      cardByIndex[index] = el;
     });
-    if(!res.ok){
-      const err = await res.json().catch(()=>({}));
-      throw new Error(err.detail || err.error || ('HTTP '+res.status));
-    }
-    const data = await res.json();
+    const data = job.result || {};
     if(data.error && !data.items){
       throw new Error(data.hint || data.detail || data.error);
     }
-    (data.items || []).forEach(addCard);
-    // Registrar uso al éxito (collector/creative)
+    // Uso: el servidor ya lo descontó al aceptar el job; sin PostgreSQL se cuenta aquí al éxito
     if ((USER_PLAN === 'starter' || USER_PLAN === 'pro')){
       const m = (window.currentMode || 'collector');
       const feature = FEATURE_KEYS[m] || FEATURE_KEYS.collector;
-      incUsageCount(USER_ID, feature);
+      if (serverUsage) await refreshUsage(); else incUsageCount(USER_ID, feature);
       const left = remainingUses(USER_PLAN, USER_ID, feature);
       const limit = planLimit(USER_PLAN);
       console.log(`[USAGE] ${m}: usado ${ (limit - left) }/${limit} este mes`);
       renderUsageBadge();
     }
     completeProgress();
-    statusEl.textContent = 'Completado';
+    statusEl.textContent = data.cached ? `Completado (resultado guardado hace ${formatAge(data.cached.age_sec)})` : 'Completado';
   } catch (err) {
     console.error(err);
     resetProgress();
+    if (err?.code === 'limit_reached'){
+      if (progressLabel) progressLabel.textContent = 'Límite alcanzado';
+      statusEl.textContent = 'Límite alcanzado';
+      alert(`Has alcanzado tus usos mensuales de este modo (${USER_PLAN === 'starter' ? 'Starter' : 'Pro'}).`);
+      refreshUsage();
+      return;
+    }
     if (progressLabel) progressLabel.textContent = 'Error';
     statusEl.textContent = 'Error';
     alert('Error procesando: '+ (err?.message || 'desconocido'));
+    if (serverUsage) refreshUsage();  // la reserva se devolvió al fallar
   }
 });
 
 // ---------- Cards con historial de versiones + “mini chat” ----------
+// Alternativas por cada "Aplicar" (se generan en una sola llamada y se guardan como versiones).
+// El servidor pide menos si no caben en el tope de salida del modelo (GUIDEON_MAX_OUTPUT_TOKENS).
+const REWRITE_VARIANTS = 2;
+
+function formatRewrite(data){
+  if ((Array.isArray(data.hooks) && data.hooks.length) || data.cta){
+    const header = [];
+    if (Array.isArray(data.hooks) && data.hooks.length){
+      header.push('[HOOKS]\n- ' + data.hooks.map(h=>String(h)).join('\n- '));
+    }
+    if (data.cta){
+      header.push('\n[CTA]\n' + String(data.cta));
+    }
+    return (header.join('\n') + (header.length? '\n\n[GUION]\n' : '') + (data.script || '')).trim();
+  }
+  return data.script || '';
+}
+
 function addCard(item){
   const fragment = document.getElementById('cardTemplate').content.cloneNode(true);
   const cardEl = fragment.querySelector('.card');
@@ -494,7 +636,10 @@ function addCard(item){
           adaptation_level: level,
           rules_source: level === 'completa' ? rulesSrc : 'guideon',
           custom_rules: (level === 'completa' && rulesSrc === 'custom') ? custom : '',
-          lang: 'es'
+          lang: 'es',
+          n_variants: REWRITE_VARIANTS,
+          user_id: USER_ID,
+          plan: USER_PLAN
         })
       });
       if(!res.ok){
@@ -502,27 +647,18 @@ function addCard(item){
         throw new Error(err.detail || ('HTTP '+res.status));
       }
       const data = await res.json();
-      const newScript = (() => {
-        if ((Array.isArray(data.hooks) && data.hooks.length) || data.cta){
-          const header = [];
-          if (Array.isArray(data.hooks) && data.hooks.length){
-            header.push('[HOOKS]\n- ' + data.hooks.map(h=>String(h)).join('\n- '));
-          }
-          if (data.cta){
-            header.push('\n[CTA]\n' + String(data.cta));
-          }
-          return (header.join('\n') + (header.length? '\n\n[GUION]\n' : '') + (data.script || '')).trim();
-        }
-        return data.script || '';
-      })();
-
-      // Guardar como nueva versión y mostrarla
+      const variants = (Array.isArray(data.variants) && data.variants.length) ? data.variants : [data];
+
+      // Guardar cada alternativa como nueva versión y mostrar la primera
       const label = (prompt.length > 28 ? prompt.slice(0,28) + '…' : prompt) || 'Edición';
-      revisions.push({ text: newScript, meta: { label, ts: Date.now() } });
-      revIdx = revisions.length - 1;
+      const firstNew = revisions.length;
+      variants.forEach(v => revisions.push({ text: formatRewrite(v), meta: { label, ts: Date.now() } }));
+      revIdx = firstNew;
       renderRevision();
 
-      appendLog('assistant', `✅ Nueva versión guardada (${revIdx + 1}/${revisions.length}).`);
+      appendLog('assistant', variants.length > 1
+        ? `✅ ${variants.length} versiones nuevas guardadas (${firstNew + 1}-${revisions.length}/${revisions.length}).`
+        : `✅ Nueva versión guardada (${revIdx + 1}/${revisions.length}).`);
       refineInput.value = '';
     }catch(err){
       console.error(err);
@@ -531,6 +667,8 @@ function addCard(item){
       refineBtn.disabled = false;
     }
   });
+
+  return cardEl;
 }
 
 updateCreativeUI();
@@ -538,5 +676,6 @@ updateCreativeUI();
 // Mostrar consentimiento al cargar la página si no se aceptó aún
 showConsentModalIfNeeded();
 
-// Mostrar badge de usos al cargar
-renderUsageBadge();
\ No newline at end of file
+// Mostrar badge de usos al cargar (local al instante, luego con los contadores del servidor)
+renderUsageBadge();
+refreshUsage();
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""Entorno aislado para los tests: caches y store de jobs en un directorio temporal, sin
+PostgreSQL ni claves de proveedores (nada sale a la red)."""
+import os
+import sys
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="automator-tests-")
+os.environ["SHARED_CACHE_PATH"] = os.path.join(_TMP, "cache.sqlite3")
+os.environ["JOB_STORE_PATH"] = os.path.join(_TMP, "jobs.sqlite3")
+os.environ["DATABASE_URL"] = ""
+os.environ["ASR_WARMUP"] = "0"
+# Vacías (no borradas): load_dotenv no pisa variables ya definidas, así un .env local con claves
+# reales no llega a los tests
+for var in ("OPENAI_API_KEY", "CLAUDE_API_KEY", "ANTHROPIC_API_KEY", "APIFY_TOKEN", "ASR_SERVICE_URL", "ASR_SERVICE_TOKEN"):
+    os.environ[var] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Un solo TestClient para toda la sesión: al cerrar, el lifespan apaga los executors de jobs."""
+    from fastapi.testclient import TestClient
+
+    import main
+    with TestClient(main.app) as c:
+        yield c
+
+
+class _FakeCursor:
+    """Cursor estilo psycopg2 sobre SQLite: traduce los placeholders y las funciones de PG que usa main."""
+
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cur.close()
+
+    def execute(self, sql, params=()):
+        sql = sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP").replace("GREATEST(", "MAX(")
+        self._cur.execute(sql, params)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+
+class _FakePgConn:
+    def __init__(self):
+        import sqlite3
+        self._db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE usage_counters (user_id TEXT NOT NULL, feature TEXT NOT NULL, "
+                         "month TEXT NOT NULL, plan TEXT, used INTEGER NOT NULL DEFAULT 0, "
+                         "updated_at TEXT, UNIQUE (user_id, feature, month))")
+        self._db.execute("CREATE TABLE user_plans (user_id TEXT PRIMARY KEY, plan TEXT NOT NULL, updated_at TEXT)")
+        self.lock = __import__("threading").Lock()
+
+    def cursor(self):
+        return _FakeCursor(self._db)
+
+    def commit(self):
+        pass  # autocommit, como las conexiones del pool
+
+    def rollback(self):
+        pass
+
+    def set_plan(self, user_id, plan):
+        self._db.execute("INSERT OR REPLACE INTO user_plans (user_id, plan) VALUES (?, ?)", (user_id, plan))
+
+    def used(self, user_id, feature):
+        row = self._db.execute("SELECT used FROM usage_counters WHERE user_id=? AND feature=?",
+                               (user_id, feature)).fetchone()
+        return row[0] if row else None
+
+
+@pytest.fixture
+def fake_pg(monkeypatch):
+    """PostgreSQL simulado para las rutas de uso: una base SQLite en memoria detrás de `_pg_conn`."""
+    from contextlib import contextmanager
+
+    import main
+    fake = _FakePgConn()
+
+    @contextmanager
+    def conn():
+        with fake.lock:
+            yield fake
+
+    monkeypatch.setattr(main, "PG_ENABLED", True)
+    monkeypatch.setattr(main, "_pg_conn", conn)
+    monkeypatch.setattr(main._USAGE_TABLE, "get", lambda: True)
+    # Con PG activo el store de jobs también va a PostgreSQL: se crea en la base falsa y al
+    # terminar vuelve el estado del store SQLite
+    for attr in ("done", "result", "error", "attempts", "_retry_at"):
+        monkeypatch.setattr(main._JOB_STORE, attr, getattr(main._JOB_STORE, attr))
+    main._JOB_STORE.done = False
+    with main._USAGE_CACHE_LOCK:
+        main._USAGE_CACHE.clear()
+        main._USAGE_PLANS.clear()
+    return fake
@@ -0,0 +1,82 @@
+"""Manifest de los pesos Whisper incluidos y carga offline."""
+import sys
+import types
+
+import pytest
+
+import asr_models
+import main
+
+
+def _fake_download(monkeypatch, files):
+    def download_model(size, output_dir, **kw):
+        for name, data in files.items():
+            with open(f"{output_dir}/{name}", "wb") as f:
+                f.write(data)
+
+    monkeypatch.setitem(sys.modules, "faster_whisper",
+                        types.SimpleNamespace(download_model=download_model, WhisperModel=object))
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    _fake_download(monkeypatch, {"model.bin": b"\x00" * 64, "config.json": b"{}", "vocabulary.txt": b"a\nb\n"})
+    asr_models.fetch("tiny", str(tmp_path), revision="abc123")
+    return tmp_path / "tiny"
+
+
+def test_fetch_writes_manifest(model):
+    m = asr_models.read_manifest(str(model))
+    assert m["model"] == "tiny" and m["revision"] == "abc123"
+    assert sorted(m["files"]) == ["config.json", "model.bin", "vocabulary.txt"]
+    assert m["files"]["model.bin"]["bytes"] == 64
+    assert m["files"]["model.bin"]["sha256"] == asr_models._sha256(str(model / "model.bin"))
+    assert asr_models.verify(str(model), full=True) == []
+
+
+def test_verify_reports_missing_and_wrong_size(model):
+    (model / "config.json").unlink()
+    (model / "vocabulary.txt").write_bytes(b"a\n")
+    problems = asr_models.verify(str(model))
+    assert "config.json: falta" in problems
+    assert "vocabulary.txt: tamaño 2 != 4" in problems
+    assert len(problems) == 2
+
+
+def test_verify_sha256_only_with_full(model):
+    (model / "model.bin").write_bytes(b"\x01" * 64)  # mismo tamaño, otro contenido
+    assert asr_models.verify(str(model)) == []
+    assert asr_models.verify(str(model), full=True) == ["model.bin: sha256 no coincide"]
+
+
+def test_verify_without_manifest(tmp_path):
+    assert asr_models.verify(str(tmp_path)) == [f"{tmp_path}: sin manifest.json"]
+
+
+def test_corrupt_model_fails_to_load(model, monkeypatch):
+    (model / "model.bin").write_bytes(b"\x00" * 10)
+    monkeypatch.setattr(main, "ASR_MODEL_DIR", str(model.parent))
+    monkeypatch.setattr(main, "ASR_MODEL_VERIFY", "size")
+    with pytest.raises(RuntimeError, match="failed verification: model.bin: tamaño 10 != 64"):
+        main._whisper_model_source("tiny")
+
+
+def test_offline_without_model_is_reported_in_ready(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "faster_whisper", types.SimpleNamespace(WhisperModel=object))
+    monkeypatch.setattr(main, "ASR_SERVICE_URL", "")
+    monkeypatch.setattr(main, "ASR_WARMUP", True)
+    monkeypatch.setattr(main, "ASR_MODEL", "tiny")
+    monkeypatch.setattr(main, "ASR_MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "ASR_MODEL_OFFLINE", True)
+    monkeypatch.setattr(main, "_WHISPER_MODELS", {})
+    init = main._BOOTSTRAP["asr_model"]
+    for attr in ("done", "result", "error", "attempts", "_retry_at", "ms"):
+        monkeypatch.setattr(init, attr, getattr(init, attr))
+    init.done = False
+    assert init.get() is None
+
+    r = client.get("/ready")
+    state = r.json()["components"]["asr_model"]
+    assert state["done"] and not state["ok"]
+    assert "ASR model 'tiny' not found" in state["error"] and "ASR_MODEL_OFFLINE=1" in state["error"]
+    assert "asr_models.py fetch tiny" in state["error"]
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_not_exposed_by_default(client):
+    assert client.post("/asr/segments", content=b"RIFF").status_code in (404, 405)
+
+
+def test_not_registered_without_token(monkeypatch):
+    monkeypatch.setattr(main, "ASR_SERVICE_MODE", True)
+    monkeypatch.setattr(main, "ASR_SERVICE_TOKEN", "")
+    assert main._register_asr_service(FastAPI()) is False
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(main, "ASR_SERVICE_MODE", True)
+    monkeypatch.setattr(main, "ASR_SERVICE_TOKEN", "secreto")
+    monkeypatch.setattr(main, "ASR_SERVICE_MAX_BYTES", 1024)
+    monkeypatch.setattr(main, "_whisper_segments", lambda path: [{"start": 0.0, "end": 1.0, "text": "hola"}])
+    app = FastAPI()
+    assert main._register_asr_service(app)
+    return TestClient(app)
+
+
+def test_requires_token(service):
+    assert service.post("/asr/segments", content=b"RIFF").status_code == 401
+    resp = service.post("/asr/segments", content=b"RIFF", headers={"Authorization": "Bearer otro"})
+    assert resp.status_code == 401
+
+
+def test_transcribes_with_token(service):
+    resp = service.post("/asr/segments", content=b"RIFF" * 10, headers={"Authorization": "Bearer secreto"})
+    assert resp.status_code == 200
+    assert resp.json()["segments"][0]["text"] == "hola"
+
+
+def test_rejects_large_bodies(service):
+    auth = {"Authorization": "Bearer secreto"}
+    assert service.post("/asr/segments", content=b"x" * 2048, headers=auth).status_code == 413
+
+    def chunked():
+        for _ in range(4):
+            yield b"x" * 512
+
+    assert service.post("/asr/segments", content=chunked(), headers=auth).status_code == 413
@@ -0,0 +1,85 @@
+import wave
+
+import numpy as np
+import pytest
+
+import main
+
+RATE = 16000
+
+
+def _melody(seed, seconds):
+    """Notas pulsadas aleatorias (dos tonos por nota, 250 ms, ataque y caída): audio sintético con
+    ataques marcados, como la voz o la música reales."""
+    rng = np.random.default_rng(seed)
+    note = RATE // 4
+    t = np.arange(note) / RATE
+    env = np.exp(-8 * t) * np.minimum(1.0, t * 400)
+    parts = []
+    for _ in range(int(seconds * 4)):
+        f1, f2 = rng.uniform(300, 3500, 2)
+        parts.append(env * (0.5 * np.sin(2 * np.pi * f1 * t) + 0.3 * np.sin(2 * np.pi * f2 * t)))
+    return np.concatenate(parts)
+
+
+def _write(path, pcm, noise_seed=None, gain=1.0):
+    if noise_seed is not None:
+        pcm = pcm + np.random.default_rng(noise_seed).normal(0, 0.01, len(pcm))
+    data = np.clip(pcm * gain * 0.8, -1, 1)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes((data * 32767).astype("<i2").tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def whisper(monkeypatch):
+    calls = []
+
+    def run(wav):
+        calls.append(wav)
+        return [{"start": 0.0, "end": 1.0, "text": f"transcripción {len(calls)}"}]
+
+    monkeypatch.setattr(main, "_whisper_segments", run)
+    return calls
+
+
+def _index(key, wav, segments):
+    fp = main._audio_fingerprint(wav)
+    main._TRANSCRIPT_CACHE[key] = {"text": "x", "segments": segments, "audio_match": None}
+    main._AUDIO_FP_INDEX.add(key, f"https://{key}", fp)
+    return fp
+
+
+def test_reencoded_copy_reuses_transcript(tmp_path, whisper):
+    audio = _melody(1, 30)
+    _index("orig-a", _write(tmp_path / "a.wav", audio), [{"text": "original"}])
+    segs, fp, match = main._transcribe_wav(_write(tmp_path / "b.wav", audio, noise_seed=7), "copy-a", "https://copy-a")
+    assert match["reused"] and match["window_similarity"] >= main.AUDIO_FP_DUP_SIM
+    assert segs == [{"text": "original"}] and not whisper
+
+
+def test_long_clip_copy_reuses_transcript(tmp_path, whisper):
+    audio = _melody(2, 120)
+    _index("orig-long", _write(tmp_path / "a.wav", audio), [{"text": "largo"}])
+    segs, _, match = main._transcribe_wav(_write(tmp_path / "b.wav", audio, noise_seed=3), "copy-long", "https://copy-long")
+    assert match["reused"] and not whisper
+
+
+def test_shared_intro_with_different_body_is_not_deduped(tmp_path, whisper):
+    intro = _melody(3, 15)
+    first = np.concatenate([intro, _melody(4, 30)])
+    second = np.concatenate([intro, _melody(5, 30)])
+    _index("intro-a", _write(tmp_path / "a.wav", first), [{"text": "video A"}])
+    segs, _, match = main._transcribe_wav(_write(tmp_path / "b.wav", second), "intro-b", "https://intro-b")
+    assert len(whisper) == 1 and segs != [{"text": "video A"}]
+    assert match is None or not match["reused"]
+
+
+def test_unrelated_audio_does_not_match(tmp_path, whisper):
+    _index("other-a", _write(tmp_path / "a.wav", _melody(6, 20)), [{"text": "A"}])
+    _, _, match = main._transcribe_wav(_write(tmp_path / "b.wav", _melody(7, 20)), "other-b", "https://other-b")
+    assert match is None or not match["reused"]
+    assert len(whisper) == 1
@@ -0,0 +1,126 @@
+import json
+import time
+
+import pytest
+
+import main
+
+
+class FakeResp:
+    def __init__(self, body=None, text=None):
+        self._body = body or {}
+        self.text = text if text is not None else json.dumps(self._body)
+        self.status_code = 200
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeAnthropicBatches:
+    """Servidor falso de Message Batches: acepta el batch, lo da por terminado en el segundo
+    poll y devuelve un resultado por custom_id (el último falla)."""
+
+    def __init__(self):
+        self.submitted = []
+        self.polls = 0
+
+    def post(self, url, headers=None, data=None, timeout=None, **kw):
+        assert url.endswith("/v1/messages/batches")
+        self.submitted = json.loads(data)["requests"]
+        return FakeResp({"id": "msgbatch_1"})
+
+    def get(self, url, headers=None, timeout=None, **kw):
+        if url.endswith("/results"):
+            rows = []
+            for i, r in enumerate(self.submitted):
+                if i == len(self.submitted) - 1:
+                    rows.append({"custom_id": r["custom_id"], "result": {"type": "errored"}})
+                else:
+                    msg = {"content": [{"type": "text", "text": f"guion {r['custom_id']}"}]}
+                    rows.append({"custom_id": r["custom_id"], "result": {"type": "succeeded", "message": msg}})
+            return FakeResp(text="\n".join(json.dumps(r) for r in rows))
+        self.polls += 1
+        return FakeResp({"processing_status": "ended" if self.polls >= 2 else "in_progress"})
+
+
+def _wait(job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = main._BATCH_JOBS.get(job_id)
+        if job["status"] != "pending":
+            return job
+        time.sleep(0.05)
+    raise AssertionError("batch job did not finish")
+
+
+@pytest.fixture
+def fake_batches(monkeypatch):
+    fake = FakeAnthropicBatches()
+    monkeypatch.setattr(main, "CLAUDE_API_KEY", "sk-ant-test")
+    monkeypatch.setattr(main, "GUIDEON_PROVIDER", "anthropic")
+    monkeypatch.setattr(main, "GUIDEON_BATCH_POLL_SEC", 0)
+    monkeypatch.setattr(main._HTTP, "post", fake.post)
+    monkeypatch.setattr(main._HTTP, "get", fake.get)
+    monkeypatch.setattr(main.time, "sleep", lambda s: None)
+    return fake
+
+
+def _start(n=3):
+    items = [{"url": f"https://x/{i}", "script": f"t{i}"} for i in range(n)]
+    entries = [{"custom_id": f"item-{i}", "index": i, "transcript": f"t{i}", "segments": None} for i in range(n)]
+    creative = {"niche_prompt": "fitness", "rules_prompt": "", "adaptation_level": "simple",
+                "rules_source": "guideon", "custom_rules": "", "lang": "es"}
+    return main._start_batch_job(items, entries, creative)
+
+
+def test_batch_job_against_stubbed_provider(fake_batches, client):
+    job_id = _start()
+    assert job_id and len(fake_batches.submitted) == 3
+
+    job = _wait(job_id)
+    assert job["status"] == "done"
+    items = job["items"]
+    assert [it["batch_status"] for it in items] == ["done", "done", "failed"]
+    assert items[0]["script"] == "guion item-0"
+    assert items[2]["script"] == "t2"  # fallback a la transcripción
+    assert "entries" not in job  # no retiene transcripciones tras terminar
+
+    # El estado vive en la cache compartida: cualquier worker lo sirve
+    status = client.get(f"/guideon/batch/{job_id}").json()
+    assert status["status"] == "done" and status["provider"] == "anthropic" and status["items"] == items
+
+
+def test_finished_batch_jobs_expire(client):
+    now = time.time()
+    base = {"handle": {"provider": "anthropic"}, "items": [], "created_at": now}
+    main._BATCH_JOBS["old"] = dict(base, status="done", finished_at=now - main.GUIDEON_BATCH_TTL_SEC - 1)
+    main._BATCH_JOBS["fresh"] = dict(base, status="done", finished_at=now)
+    assert client.get("/guideon/batch/old").status_code == 404
+    assert main._BATCH_JOBS.get("old") is None
+    assert client.get("/guideon/batch/fresh").json()["status"] == "done"
+
+
+def test_orphaned_batch_job_is_resumed_by_status_poll(fake_batches, client, monkeypatch):
+    # Un batch pendiente cuyo worker murió (p. ej. reinicio): nadie actualiza polled_at
+    with monkeypatch.context() as m:
+        m.setattr(main.threading, "Thread", _NoThread)
+        job_id = _start(2)
+    job = main._BATCH_JOBS.get(job_id)
+    job["polled_at"] = time.time() - main._batch_job_stale_sec() - 1
+    main._BATCH_JOBS[job_id] = job
+
+    assert client.get(f"/guideon/batch/{job_id}").json()["status"] == "pending"
+    assert _wait(job_id)["status"] == "done"
+    # Un batch con worker vivo no se reclama dos veces
+    assert not main._batch_job_claim(job_id)
+
+
+class _NoThread:
+    def __init__(self, *a, **kw):
+        pass
+
+    def start(self):
+        pass
@@ -0,0 +1,52 @@
+import pytest
+
+import main
+
+
+def test_failed_init_is_retried_after_backoff(monkeypatch):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("pg down")
+        return "ok"
+
+    init = main._LazyInit("test_flaky", flaky)
+    try:
+        assert init.get() is None
+        st = init.state()
+        assert st["done"] and not st["ok"] and st["error"] == "pg down" and st["retry_in"] > 0
+        assert init.get() is None and len(calls) == 1  # dentro del backoff no reintenta
+
+        monkeypatch.setattr(init, "_retry_at", 0.0)
+        assert init.get() == "ok"
+        assert init.state()["ok"] and init.state()["retry_in"] is None
+        assert init.get() == "ok" and len(calls) == 2
+    finally:
+        main._BOOTSTRAP.pop("test_flaky", None)
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(main, "BOOT_RETRY_SEC", 1.0)
+    monkeypatch.setattr(main, "BOOT_RETRY_MAX_SEC", 3.0)
+    init = main._LazyInit("test_down", lambda: 1 / 0)
+    try:
+        waits = []
+        for _ in range(4):
+            monkeypatch.setattr(init, "_retry_at", 0.0)
+            t0 = main.time.time()
+            init.get()
+            waits.append(round(init._retry_at - t0))
+        assert waits == [1, 2, 3, 3]
+    finally:
+        main._BOOTSTRAP.pop("test_down", None)
+
+
+def test_job_store_init_raises_on_failure(monkeypatch):
+    def boom(*a, **k):
+        raise RuntimeError("db unavailable")
+
+    monkeypatch.setattr(main, "_job_store_exec", boom)
+    with pytest.raises(RuntimeError, match="db unavailable"):
+        main._ensure_job_store()
@@ -0,0 +1,76 @@
+"""Budgets por recurso: límite de slots, cola acotada y rechazo con 503 + Retry-After."""
+import threading
+import time
+
+import pytest
+
+import main
+from test_jobs import _req
+
+
+def test_budget_caps_concurrency():
+    budget = main._Budget("test", limit=2, max_waiting=10)
+    state = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def work():
+        with budget.slot(timeout=5):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.05)
+            with lock:
+                state["active"] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert state["peak"] == 2 and budget.active == 0 and budget.waiting == 0
+
+
+def test_budget_rejects_when_queue_is_full_or_wait_times_out():
+    budget = main._Budget("test", limit=1, max_waiting=1)
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with budget.slot():
+            held.set()
+            release.wait(2)
+
+    t = threading.Thread(target=holder)
+    t.start()
+    held.wait(2)
+    # Un interactivo espera (timeout corto) y el siguiente ya no cabe en la cola
+    waiter_error = []
+
+    def waiter():
+        try:
+            with budget.slot(timeout=0.5):
+                pass
+        except main._Overloaded as e:
+            waiter_error.append(e)
+
+    w = threading.Thread(target=waiter)
+    w.start()
+    time.sleep(0.1)
+    with pytest.raises(main._Overloaded) as exc:
+        with budget.slot(timeout=0.5):
+            pass
+    assert exc.value.resource == "test" and exc.value.retry_after >= 1
+    w.join()
+    assert len(waiter_error) == 1  # el que esperaba agotó su timeout
+    release.set()
+    t.join()
+    assert budget.rejected == 2 and budget.active == 0
+
+
+def test_overloaded_becomes_503_with_retry_after(client, monkeypatch):
+    def full(req):
+        raise main._Overloaded("jobs", 7, "Cola de jobs llena.")
+
+    monkeypatch.setattr(main, "_create_or_join_job", full)
+    r = client.post("/job/submit", json=_req(980))
+    assert r.status_code == 503 and r.headers["retry-after"] == "7"
+    assert r.json()["error"] == "overloaded"
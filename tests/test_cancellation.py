@@ -0,0 +1,118 @@
+"""Cancelación: DELETE /job/{id} mata subprocesos, despierta a los que esperan turno y devuelve el uso."""
+import sys
+import threading
+import time
+
+import main
+from test_jobs import _req, _wait_final
+from test_scheduling import _wait_until
+
+SLEEPER = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+def test_run_subprocess_is_killed_on_cancel():
+    cancel, outcome = threading.Event(), []
+
+    def run():
+        with main._work_context(cancel=cancel):
+            try:
+                main._run_subprocess(SLEEPER)
+            except main._Cancelled:
+                outcome.append(time.time())
+
+    t = threading.Thread(target=run)
+    t.start()
+    time.sleep(0.3)
+    t0 = time.time()
+    cancel.set()
+    t.join(5)
+    assert outcome and outcome[0] - t0 < 2  # no espera los 30 s del proceso
+
+
+def test_cancelled_job_stops_its_subprocess_and_releases_usage(client, fake_pg, monkeypatch):
+    started = threading.Event()
+
+    def run(req, emit):
+        started.set()
+        main._run_subprocess(SLEEPER)
+        return {"items": [{"url": "https://x/1", "script": "ok"}]}, 200
+
+    monkeypatch.setattr(main, "_run_job", run)
+    monkeypatch.setattr(main, "USAGE_LIMIT_STARTER", 5)
+    jid = client.post("/job/submit", json=_req(990, user_id="cancel-user", plan="starter", refresh=True)).json()["job_id"]
+    assert started.wait(5)
+    assert fake_pg.used("cancel-user", "analyze_profiles") == 1
+
+    t0 = time.time()
+    r = client.delete(f"/job/{jid}").json()
+    assert r["cancelled"] is True
+    job = _wait_final(jid)
+    assert time.time() - t0 < 3
+    assert job["status"] == "cancelled" and job["result"]["error"] == "cancelled"
+    assert fake_pg.used("cancel-user", "analyze_profiles") == 0
+
+
+def test_cancel_wakes_a_job_waiting_for_a_budget_slot(client, monkeypatch):
+    budget = main._BUDGETS["asr"]
+    entered = []
+
+    def run(req, emit):
+        with budget.slot():
+            entered.append(req.user_id)
+        return {"items": []}, 200
+
+    monkeypatch.setattr(main, "_run_job", run)
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with budget.slot():
+            held.set()
+            release.wait(10)
+
+    h = threading.Thread(target=holder)
+    h.start()
+    held.wait(2)
+    try:
+        waiting = budget.waiting
+        jid = client.post("/job/submit", json=_req(991, refresh=True)).json()["job_id"]
+        _wait_until(lambda: budget.waiting == waiting + 1)
+        client.delete(f"/job/{jid}")
+        job = _wait_final(jid)
+        assert job["status"] == "cancelled" and not entered
+        assert budget.waiting == waiting  # soltó su lugar en la cola
+    finally:
+        release.set()
+        h.join(5)
+
+
+def test_budget_waiter_raises_cancelled_on_wake():
+    budget = main._Budget("test", limit=1, max_waiting=5)
+    cancel, errors = threading.Event(), []
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with budget.slot():
+            held.set()
+            release.wait(5)
+
+    def waiter():
+        with main._work_context(bulk=True, cancel=cancel):
+            try:
+                with budget.slot():
+                    pass
+            except main._Cancelled as e:
+                errors.append(e)
+
+    h = threading.Thread(target=holder)
+    h.start()
+    held.wait(2)
+    w = threading.Thread(target=waiter)
+    w.start()
+    _wait_until(lambda: budget.waiting == 1)
+    cancel.set()
+    budget.wake()
+    w.join(2)
+    release.set()
+    h.join(2)
+    assert len(errors) == 1 and budget.waiting == 0 and budget.active == 0
+
@@ -0,0 +1,60 @@
+"""API asíncrona de jobs: /job/submit, estado y progreso por SSE, y /job/start en NDJSON."""
+import json
+
+import main
+from test_jobs import _req, _submit, _wait_final
+
+
+def _staged_run(req, emit):
+    emit({"type": "stage", "stage": "collect"})
+    emit({"type": "stage", "stage": "rank", "posts": 1})
+    return {"items": [{"url": "https://x/1", "script": "ok"}]}, 200
+
+
+def test_submit_returns_at_once_and_status_follows_the_job(client, monkeypatch):
+    monkeypatch.setattr(main, "_run_job", _staged_run)
+    r = client.post("/job/submit", json=_req(960, refresh=True)).json()
+    assert r["job_id"] and r["status"] in ("queued", "running", "done") and r["coalesced"] is False
+    _wait_final(r["job_id"])
+    status = client.get(f"/job/{r['job_id']}").json()
+    assert status["status"] == "done" and status["stage"] == "rank"
+    assert client.get("/job/nope").status_code == 404
+
+
+def test_job_events_sse_resumes_from_last_event_id(client, monkeypatch):
+    monkeypatch.setattr(main, "_run_job", _staged_run)
+    jid, _ = _submit(_req(951, refresh=True))
+    _wait_final(jid)
+    full = client.get(f"/job/{jid}/events").text
+    ids = [int(line[4:]) for line in full.splitlines() if line.startswith("id: ")]
+    assert ids == list(range(len(ids))) and "event: done" in full
+    resumed = client.get(f"/job/{jid}/events", headers={"Last-Event-ID": str(ids[1])}).text
+    assert [int(line[4:]) for line in resumed.splitlines() if line.startswith("id: ")] == ids[2:]
+    assert client.get("/job/nope/events").status_code == 404
+
+
+def _itemized_run(req, emit):
+    emit({"type": "stage", "stage": "collect"})
+    items = []
+    for i in range(2):
+        items.append({"url": f"https://x/{i}", "script": f"guion {i}"})
+        emit({"type": "item", "index": i, "item": items[-1], "done": i + 1, "total": 2})
+    return {"items": items, "hint": "ok"}, 200
+
+
+def test_job_start_streams_ndjson(client, monkeypatch):
+    monkeypatch.setattr(main, "_run_job", _staged_run)
+    r = client.post("/job/start?stream=1", json=_req(950, refresh=True))
+    lines = [json.loads(line) for line in r.text.splitlines() if line]
+    assert [ln.get("stage") for ln in lines[:-1]] == ["collect", "rank"]
+    assert lines[-1]["type"] == "done" and lines[-1]["status_code"] == 200 and "items" not in lines[-1]
+
+
+def test_ndjson_streams_each_card_then_the_rest_of_the_payload(client, monkeypatch):
+    monkeypatch.setattr(main, "_run_job", _itemized_run)
+    r = client.post("/job/start", json=_req(952, refresh=True), headers={"Accept": "application/x-ndjson"})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines() if line]
+    cards = [ln for ln in lines if ln["type"] == "item"]
+    assert [c["item"]["script"] for c in cards] == ["guion 0", "guion 1"] and cards[-1]["done"] == 2
+    assert lines[-1] == {"hint": "ok", "type": "done", "status_code": 200}
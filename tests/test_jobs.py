@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def _req(i=0, **kw):
+    body = {"user_id": f"u{i}", "mode": "collector", "window": "7d", "num_scripts": 1,
+            "profiles": [{"platform": "tiktok", "url": f"https://www.tiktok.com/@p{i}"}]}
+    body.update(kw)
+    return body
+
+
+@pytest.fixture
+def fake_run(monkeypatch):
+    """_run_job falso que registra cuántos corren a la vez."""
+    state = {"active": 0, "peak": 0, "calls": 0, "lock": threading.Lock(), "delay": 0.2}
+
+    def run(req, emit):
+        with state["lock"]:
+            state["active"] += 1
+            state["calls"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        try:
+            time.sleep(state["delay"])
+            return {"items": [{"url": "https://x/1", "metrics": {}, "script": "ok"}]}, 200
+        finally:
+            with state["lock"]:
+                state["active"] -= 1
+
+    monkeypatch.setattr(main, "_run_job", run)
+    return state
+
+
+def test_job_start_respects_worker_cap(client, fake_run):
+    results = []
+
+    def call(i):
+        results.append(client.post("/job/start", json=_req(100 + i, refresh=True)).status_code)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(main.JOB_WORKERS + 2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert results == [200] * len(threads)
+    assert fake_run["peak"] <= main.JOB_WORKERS
+
+
+def _wait_final(job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if main._JOBS[job_id]["status"] in main._JOB_FINAL:
+            return main._JOBS[job_id]
+        time.sleep(0.02)
+    raise AssertionError("job did not finish")
+
+
+def _submit(req_body):
+    # Requiere el lifespan activo (executor de jobs): los tests que lo usan piden `client`
+    req = main.JobReq(**req_body)
+    jid, created = main._create_or_join_job(req)
+    if created:
+        main._job_enqueue(jid, req)
+    return jid, created
+
+
+@pytest.mark.parametrize("payload", [
+    {"items": [{"url": "https://example.com/post/1", "script": "[DEMO] Guion 1"}], "demo": True},
+    {"items": [{"url": "https://x/1", "script": "(Error transcribiendo este video) boom"}], "failed_items": 1},
+])
+def test_placeholder_results_are_not_replayed(client, monkeypatch, payload):
+    calls = []
+    monkeypatch.setattr(main, "_run_job", lambda req, emit: (calls.append(1) or dict(payload), 200))
+    body = _req(200 + len(payload))
+    first, created = _submit(body)
+    assert created
+    _wait_final(first)
+    second, created = _submit(body)
+    assert created and second != first  # se recalcula, no se sirve el placeholder
+    _wait_final(second)
+    assert len(calls) == 2
+
+
+def test_complete_results_are_replayed(client, monkeypatch):
+    monkeypatch.setattr(main, "_run_job", lambda req, emit: ({"items": [{"url": "https://x/1", "script": "ok"}]}, 200))
+    body = _req(300)
+    first, _ = _submit(body)
+    _wait_final(first)
+    second, created = _submit(body)
+    assert not created
+    assert main._JOBS[second]["cached"]["source_job_id"] == first
+
+
+def test_store_lookup_runs_outside_jobs_lock(client, monkeypatch):
+    seen = []
+
+    def find(fp, max_age):
+        # Otro hilo debe poder tomar el lock (p. ej. _job_emit) mientras se consulta el store
+        t = threading.Thread(target=lambda: seen.append(main._JOBS_LOCK.acquire(timeout=1) and main._JOBS_LOCK.release() is None))
+        t.start()
+        t.join()
+        return None
+
+    monkeypatch.setattr(main, "_job_store_find", find)
+    monkeypatch.setattr(main, "_run_job", lambda req, emit: ({"items": []}, 200))
+    jid, created = _submit(_req(400))
+    assert created and seen == [True]
+    _wait_final(jid)
+
+
+def test_job_start_admission_does_not_block_event_loop(client, fake_run, monkeypatch):
+    def slow_reserve(user_id, feature):
+        time.sleep(0.8)
+        return None
+
+    monkeypatch.setattr(main, "_usage_reserve", slow_reserve)
+    t = threading.Thread(target=lambda: client.post("/job/start", json=_req(900)))
+    t.start()
+    time.sleep(0.2)
+    t0 = time.time()
+    assert client.get("/health").status_code == 200
+    assert time.time() - t0 < 0.5
+    t.join()
+
+
+def test_job_start_limit_reached_still_returns_409(client, monkeypatch):
+    def full(user_id, feature):
+        raise main._LimitReached(feature, 3, 3)
+
+    monkeypatch.setattr(main, "_usage_reserve", full)
+    r = client.post("/job/start", json=_req(901))
+    assert r.status_code == 409
+    assert r.json()["error"] == "limit_reached"
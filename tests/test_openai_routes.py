@@ -0,0 +1,64 @@
+import json
+
+import main
+
+
+class FakeResp:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self._body
+
+
+def _call(monkeypatch, resp):
+    monkeypatch.setattr(main._HTTP, "post", lambda *a, **k: resp)
+    route = {"endpoint": "chat", "model": "gpt-test", "params": {}}
+    return main._openai_call_route(route, "sys", "user", {})[1]
+
+
+def test_rate_limit_mentioning_model_is_transient(monkeypatch):
+    resp = FakeResp(429, {"error": {"message": "Rate limit reached for model gpt-test", "code": "rate_limit_exceeded"}})
+    assert _call(monkeypatch, resp) == "error"
+
+
+def test_server_error_is_transient(monkeypatch):
+    assert _call(monkeypatch, FakeResp(503, {"error": {"message": "model overloaded"}})) == "error"
+
+
+def test_model_not_found_is_unsupported(monkeypatch):
+    assert _call(monkeypatch, FakeResp(400, {"error": {"message": "x", "code": "model_not_found"}})) == "unsupported"
+    assert _call(monkeypatch, FakeResp(404, {"error": {"message": "Not found"}})) == "unsupported"
+
+
+def test_wrong_endpoint_is_unsupported(monkeypatch):
+    body = {"error": {"message": "This model is only supported in v1/responses and not in v1/chat/completions."}}
+    assert _call(monkeypatch, FakeResp(400, body)) == "unsupported"
+
+
+def test_empty_200_is_transient(monkeypatch):
+    assert _call(monkeypatch, FakeResp(200, {"choices": []})) == "error"
+
+
+def test_transient_error_does_not_cache_fallback_route(monkeypatch):
+    calls = []
+
+    def post(url, headers=None, data=None, timeout=None):
+        calls.append(json.loads(data)["model"])
+        return FakeResp(429, {"error": {"message": "Rate limit reached for model gpt-test"}})
+
+    monkeypatch.setattr(main, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main, "OPENAI_MODEL", "gpt-test")
+    monkeypatch.setattr(main._HTTP, "post", post)
+    key = main._openai_caps_key("gpt-test")
+    main._OPENAI_CAPS.pop(key)
+    assert main._openai_messages("sys", "user") is None
+    assert calls == ["gpt-test"]
+    assert main._OPENAI_CAPS.get(key) is None
+
+
+def test_provider_keys_are_blank_in_tests():
+    # main lee CLAUDE_API_KEY (no ANTHROPIC_API_KEY): un .env con claves reales no debe colarse
+    assert main.CLAUDE_API_KEY == "" and main.OPENAI_API_KEY == ""
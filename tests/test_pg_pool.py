@@ -0,0 +1,102 @@
+"""Pool de PostgreSQL contra un driver falso."""
+import threading
+import time
+import types
+
+import pytest
+
+import main
+
+
+class _FakeConn:
+    def __init__(self, registry):
+        self.closed = False
+        self.autocommit = False
+        registry.append(self)
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        if self.closed:
+            raise _FakePg.OperationalError("server closed the connection")
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+class _FakePg:
+    class OperationalError(Exception):
+        pass
+
+    class InterfaceError(Exception):
+        pass
+
+    extensions = types.SimpleNamespace(TRANSACTION_STATUS_IDLE=0)
+
+
+@pytest.fixture
+def fake_psycopg(monkeypatch):
+    opened = []
+    fake = types.SimpleNamespace(connect=lambda *a, **kw: _FakeConn(opened), OperationalError=_FakePg.OperationalError,
+                                 InterfaceError=_FakePg.InterfaceError, extensions=_FakePg.extensions)
+    monkeypatch.setattr(main, "_psycopg2", lambda: fake)
+    monkeypatch.setattr(main, "PG_POOL_TIMEOUT_SEC", 0.2)
+    return opened
+
+
+def test_pg_pool_reuses_connections_and_rejects_when_exhausted(fake_psycopg):
+    pool = main._PgPool(0, 2)
+    with pool.connection() as c1:
+        pass
+    with pool.connection() as c2:
+        assert c2 is c1  # vuelve al pool y se reutiliza
+        with pool.connection():
+            with pytest.raises(main._Overloaded) as exc:
+                with pool.connection():
+                    pass
+    assert exc.value.resource == "pg"
+    view = pool.view()
+    assert len(fake_psycopg) == 2 and view["size"] == 2 and view["in_use"] == 0 and view["timeouts"] == 1
+
+
+def test_pg_pool_discards_broken_connections(fake_psycopg):
+    pool = main._PgPool(0, 1)
+    with pytest.raises(_FakePg.OperationalError):
+        with pool.connection() as conn:
+            conn.closed = True
+            conn.cursor().execute("SELECT 1")
+    # El hueco se liberó: la siguiente conexión es nueva
+    with pool.connection() as again:
+        assert again is not conn and not again.closed
+    assert pool.view()["discarded"] == 1 and len(fake_psycopg) == 2
+
+
+def test_pg_pool_waiter_gets_released_connection(fake_psycopg, monkeypatch):
+    monkeypatch.setattr(main, "PG_POOL_TIMEOUT_SEC", 2)
+    pool = main._PgPool(0, 1)
+    got = []
+
+    def waiter():
+        with pool.connection() as c:
+            got.append(c)
+
+    with pool.connection() as first:
+        t = threading.Thread(target=waiter)
+        t.start()
+        time.sleep(0.1)
+        assert pool.view()["waiting"] == 1
+    t.join()
+    assert got == [first] and len(fake_psycopg) == 1
@@ -0,0 +1,71 @@
+"""`Post` produce el mismo JSON que los dicts que armaban antes los fetchers."""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+
+
+def _old_post(post_id, url, dt, views=0, likes=0, comments=0, duration=0, media_url="", media_type=""):
+    # Forma exacta del dict de fetch_instagram_posts_apify / fetch_tiktok_posts_apify antes de Post
+    return {
+        "platform_post_id": str(post_id),
+        "url": str(url),
+        "posted_at": dt.isoformat(),
+        "views": int(views) if views else 0,
+        "likes": int(likes) if likes else 0,
+        "comments": int(comments) if comments else 0,
+        "duration_sec": int(duration) if duration else 0,
+        "media_url": str(media_url) if media_url else "",
+        "is_video": (media_type == "video"),
+        "media_type": media_type,
+    }
+
+
+DATES = [
+    datetime(2024, 3, 1, 12, 30, 5, tzinfo=timezone.utc),
+    datetime.fromtimestamp(1_700_000_000, tz=timezone.utc),
+    datetime.fromisoformat("2024-01-02T03:04:05.000Z".replace("Z", "+00:00")),
+    datetime.strptime("20240215", "%Y%m%d").replace(tzinfo=timezone.utc),
+]
+
+
+@pytest.mark.parametrize("dt", DATES)
+@pytest.mark.parametrize("media", [("https://cdn/x.mp4", "video", 31), ("", "image", 0), ("", "", None)])
+def test_to_dict_matches_old_dict(dt, media):
+    media_url, media_type, duration = media
+    args = ("C123", "https://www.instagram.com/p/C123/", dt, "1500", 40, None, duration, media_url, media_type)
+    post = main.dc_replace(main._new_post("instagram", *args), score=87.5)
+    old = dict(_old_post(*args), score=87.5)
+    new = post.to_dict()
+    assert new.pop("platform") == "instagram"
+    assert new == old
+    assert json.dumps(new, sort_keys=True) == json.dumps(old, sort_keys=True)
+
+
+def test_offset_dates_keep_the_instant():
+    dt = datetime.fromisoformat("2024-05-01T10:00:00+02:00")
+    post = main._new_post("tiktok", 1, "https://x/1", dt)
+    assert post.posted_at == "2024-05-01T08:00:00+00:00"
+    assert datetime.fromisoformat(post.posted_at) == dt
+
+
+def test_job_items_keep_metric_shape(monkeypatch):
+    now = datetime.now(timezone.utc)
+    posts = [main._new_post("instagram", i, f"https://x/{i}", now - timedelta(days=i), 1000 * (i + 1), 10 * i, i,
+                            media_type="image") for i in range(3)]
+    monkeypatch.setattr(main, "_collect_posts", lambda profiles, start, end, emit: posts)
+    req = main.JobReq(user_id="u", mode="collector", window="7d", num_scripts=3,
+                      profiles=[{"platform": "instagram", "url": "https://www.instagram.com/x"}])
+    payload, status = main._run_job(req, lambda ev: None)
+    assert status == 200
+    by_url = {p.url: p for p in posts}
+    items = json.loads(json.dumps(payload))["items"]
+    assert len(items) == 3
+    for item in items:
+        assert set(item) == {"url", "metrics", "script"}
+        p = by_url[item["url"]]
+        assert item["metrics"] == {"views": p.views, "likes": p.likes, "comments": p.comments,
+                                   "score": item["metrics"]["score"]}
+        assert isinstance(item["metrics"]["score"], float)
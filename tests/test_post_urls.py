@@ -0,0 +1,51 @@
+import pytest
+
+import main
+
+
+def test_youtube_videos_keep_distinct_keys():
+    a = main._normalize_post_url("https://www.youtube.com/watch?v=AAAA")
+    b = main._normalize_post_url("https://www.youtube.com/watch?v=BBBB")
+    assert a != b
+    assert a == "https://youtube.com/watch?v=AAAA"
+
+
+@pytest.mark.parametrize("url", [
+    "https://youtu.be/AAAA?si=xyz",
+    "https://m.youtube.com/watch?v=AAAA&feature=share&t=42",
+    "https://www.youtube.com/watch?utm_source=ig&v=AAAA#comments",
+])
+def test_youtube_variants_share_key(url):
+    assert main._normalize_post_url(url) == "https://youtube.com/watch?v=AAAA"
+
+
+def test_tracking_params_are_dropped():
+    assert (main._normalize_post_url("https://www.instagram.com/reel/Cx1/?igshid=abc&utm_medium=copy")
+            == "https://instagram.com/reel/Cx1")
+    assert (main._normalize_post_url("https://www.tiktok.com/@u/video/123?is_from_webapp=1&sender_device=pc")
+            == "https://tiktok.com/@u/video/123")
+
+
+def test_content_params_are_kept_sorted():
+    assert (main._normalize_post_url("https://example.com/post?b=2&id=7")
+            == main._normalize_post_url("https://example.com/post/?id=7&b=2"))
+
+
+def test_profile_handle_still_resolves():
+    assert main._profile_handle("https://www.instagram.com/Foo/?igshid=1") == "foo"
+    assert main._profile_handle("https://www.youtube.com/channel/UC123") == "uc123"
+
+
+def test_transcript_cache_keeps_youtube_videos_apart(monkeypatch):
+    calls = []
+
+    def fake(url, media_url=None, key=None):
+        calls.append(url)
+        return f"texto {url[-4:]}", [], None, None
+
+    monkeypatch.setattr(main, "_transcribe_link_segments", fake)
+    a = main.transcribe_link_segments("https://www.youtube.com/watch?v=AAAA")[0]
+    b = main.transcribe_link_segments("https://www.youtube.com/watch?v=BBBB")[0]
+    again = main.transcribe_link_segments("https://youtu.be/AAAA")[0]
+    assert (a, b, again) == ("texto AAAA", "texto BBBB", "texto AAAA")
+    assert len(calls) == 2
@@ -0,0 +1,52 @@
+import multiprocessing
+import threading
+
+import main
+
+
+def _post(i, views=100, ts=None):
+    return main.Post(platform="tiktok", platform_post_id=f"p{i}", url=f"https://www.tiktok.com/@foo/video/{i}",
+                     posted_ts=ts if ts is not None else 1_700_000_000 + i, views=views, likes=10, comments=2)
+
+
+def _ingest_range(handle, start, count):
+    for i in range(start, start + count):
+        main._PROFILE_STATS.ingest("tiktok", handle, [_post(i)])
+
+
+def test_ingest_updates_aggregates():
+    state = main._PROFILE_STATS.ingest("tiktok", "agg", [_post(1, 100), _post(2, 300), _post(3, 200)])
+    assert state["n"] == 3 and state["median_views"] == 200
+    # Un post re-scrapeado actualiza su conteo en vez de sumarse otra vez
+    state = main._PROFILE_STATS.ingest("tiktok", "agg", [_post(2, 900)])
+    assert state["n"] == 3 and state["median_views"] == 200 and state["mean_views"] == 400
+    assert main._PROFILE_STATS.baseline("tiktok", "agg") == 200
+
+
+def test_concurrent_ingests_from_threads_are_not_lost():
+    threads = [threading.Thread(target=_ingest_range, args=("threads", k * 10, 10)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert main._PROFILE_STATS.get("tiktok", "threads")["n"] == 40
+
+
+def test_concurrent_ingests_from_processes_are_not_lost():
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_ingest_range, args=("procs", k * 10, 10)) for k in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+        assert p.exitcode == 0
+    assert main._PROFILE_STATS.get("tiktok", "procs")["n"] == 40
+
+
+def test_profile_stats_endpoint(client):
+    main._PROFILE_STATS.ingest("tiktok", "endpoint", [_post(i) for i in range(5)])
+    r = client.get("/profile/stats", params={"url": "https://www.tiktok.com/@endpoint"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["handle"] == "endpoint" and body["n"] == 5 and "posts" not in body
+    assert client.get("/profile/stats", params={"url": "https://www.tiktok.com/@nobody"}).status_code == 404
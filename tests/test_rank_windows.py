@@ -0,0 +1,28 @@
+"""Varias ventanas rankeadas sobre una sola recolección: igual que seleccionar cada ventana por separado."""
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+import main
+from test_ranking import T0, _ids, _posts, _ref_baseline, _ref_select
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rank_windows_matches_per_window_selection(seed):
+    rng = random.Random(seed)
+    posts = _posts(rng, rng.randrange(0, 150))
+    windows = {}
+    for k in range(4):
+        lo = T0 + rng.randrange(-5, 30) * 3600
+        hi = lo + rng.randrange(0, 20) * 3600
+        windows[f"w{k}"] = (datetime.fromtimestamp(lo, tz=timezone.utc), datetime.fromtimestamp(hi, tz=timezone.utc))
+    sort_by = rng.choice(main._RANK_KEYS)
+    order = rng.choice(("desc", "asc"))
+    ranked = main.rank_windows(posts, windows, 3, sort_by, order)
+    for label, (start, end) in windows.items():
+        inside = [p for p in posts if start.timestamp() <= p.posted_ts <= end.timestamp()]
+        assert ranked[label]["posts"] == len(inside)
+        expected = _ref_select(inside, 3, sort_by, order) if inside else []
+        assert _ids(ranked[label]["top"]) == expected
+        assert ranked[label]["baseline"] == round(_ref_baseline(inside), 2)
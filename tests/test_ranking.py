@@ -0,0 +1,71 @@
+"""El ranking vectorizado (numpy) contra una referencia en Python puro con sort estable."""
+import random
+
+import pytest
+
+import main
+
+T0 = 1_700_000_000
+
+
+def _posts(rng, n, profiles=("",)):
+    # Rangos chicos a propósito: muchos empates de fecha, views y likes
+    return [main.Post(platform="tiktok", platform_post_id=str(i), url=f"https://x/{i}",
+                      posted_ts=T0 + rng.randrange(0, 30) * 3600, views=rng.choice([0, -5, *range(0, 5000, 250)]),
+                      likes=rng.randrange(0, 40), comments=rng.randrange(-2, 10), profile=rng.choice(profiles))
+            for i in range(n)]
+
+
+def _ref_baseline(posts):
+    recent = sorted(posts, key=lambda p: p.posted_ts)[-10:]
+    return max(sum(max(p.views, 0) for p in recent) / len(recent), 1.0) if recent else 1.0
+
+
+def _ref_score(p, baseline):
+    views = max(p.views, 0)
+    eng = (max(p.likes, 0) + max(p.comments, 0)) / max(views, 1)
+    growth = (views - baseline) / max(baseline, 1)
+    return round(100.0 * (0.6 * growth + 0.4 * eng), 2)
+
+
+def _ref_select(posts, num_scripts, sort_by, order, profile_baselines=None):
+    fallback = _ref_baseline(posts)
+    scored = [(p, _ref_score(p, (profile_baselines or {}).get(p.profile) or fallback)) for p in posts]
+    key = (lambda ps: ps[1]) if sort_by == "score" else (lambda ps: getattr(ps[0], sort_by))
+    ranked = sorted(scored, key=key, reverse=order != "asc")
+    return [(p.platform_post_id, s) for p, s in ranked[:max(1, min(num_scripts, 5))]]
+
+
+def _ids(posts):
+    return [(p.platform_post_id, p.score) for p in posts]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_select_top_posts_matches_reference(seed):
+    rng = random.Random(seed)
+    posts = _posts(rng, rng.randrange(1, 120))
+    for sort_by in main._RANK_KEYS:
+        for order in ("desc", "asc"):
+            n = rng.randrange(1, 7)
+            assert _ids(main.select_top_posts(posts, n, sort_by, order)) == _ref_select(posts, n, sort_by, order)
+
+
+def test_select_top_posts_uses_profile_baselines(monkeypatch):
+    rng = random.Random(99)
+    stats = {"a": 800.0, "b": None, "c": 3000.0}
+    monkeypatch.setattr(main._PROFILE_STATS, "baseline", lambda platform, handle: stats.get(handle))
+    for _ in range(20):
+        posts = _posts(rng, rng.randrange(1, 80), profiles=("a", "b", "c", ""))
+        assert _ids(main.select_top_posts(posts, 5)) == _ref_select(posts, 5, "score", "desc", stats)
+
+
+def test_top_n_indices_matches_stable_sort():
+    import numpy as np
+    rng = np.random.default_rng(5)
+    for _ in range(200):
+        values = rng.integers(0, 6, rng.integers(1, 60)).astype(np.float64)
+        n = int(rng.integers(0, 70))
+        for descending in (True, False):
+            ref = sorted(range(len(values)), key=lambda i: values[i], reverse=descending)[:n]
+            assert main._top_n_indices(values, n, descending).tolist() == ref
+
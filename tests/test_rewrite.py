@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import main
+
+SCRIPT = "Gancho inicial potente // corte Desarrollo con dos ideas // corte Sígueme para más"
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+
+    def fake(system_text, user_text, max_tokens=None):
+        calls.append({"system": system_text, "user": user_text, "max_tokens": max_tokens})
+        if "SECCIÓN_A_CAMBIAR" in user_text:
+            return json.dumps({"variants": [{"section": f"nuevo {i}"} for i in range(5)]})
+        return json.dumps({"variants": [{"script": f"guion {i}", "hooks": [], "cta": ""} for i in range(5)]})
+
+    monkeypatch.setattr(main, "_llm_messages", fake)
+    return calls
+
+
+def test_variants_respect_model_output_limit(llm):
+    out = main.rewrite_with_guideon(SCRIPT, "hazlo más divertido", n_variants=3, section="full")
+    assert llm[0]["max_tokens"] <= main.GUIDEON_MAX_OUTPUT_TOKENS
+    # 1400 x 3 no cabe en 4096: se piden (y devuelven) sólo las que caben
+    assert len(out["variants"]) == main.GUIDEON_MAX_OUTPUT_TOKENS // main.GUIDEON_MAX_TOKENS
+
+
+def test_section_variants_keep_full_count(llm):
+    out = main.rewrite_with_guideon(SCRIPT, "cambia el gancho", n_variants=3)
+    assert llm[0]["max_tokens"] == main.GUIDEON_SECTION_MAX_TOKENS * 3
+    assert len(out["variants"]) == 3
+
+
+def test_payloads_are_clamped():
+    assert main._anthropic_payload("s", "u", max_tokens=10_000)["max_tokens"] == main.GUIDEON_MAX_OUTPUT_TOKENS
+    route = {"endpoint": "chat", "model": "m", "params": {"max_tokens": True}}
+    assert main._openai_route_payload(route, "s", "u", 10_000)[1]["max_tokens"] == main.GUIDEON_MAX_OUTPUT_TOKENS
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("Cambia el gancho por una pregunta", "hook"),
+    ("Haz los hooks más cortos", "hook"),
+    ("Reescribe la primera frase", "hook"),
+    ("Mejora el CTA", "cta"),
+    ("Cambia la llamada a la acción", "cta"),
+    ("Hazlo más directa y corta", None),
+    ("La frase final no es correcta, déjala perfecta", None),
+    ("Revísalo desde el inicio hasta el final", None),
+    ("Dale un mejor cierre y un comienzo más fuerte", None),
+    ("Cambia el gancho y el CTA", None),
+])
+def test_rewrite_target_section(prompt, expected):
+    assert main._rewrite_target_section(prompt) == expected
+
+
+def test_explicit_section_wins():
+    assert main._rewrite_target_section("hazlo más directa", "cta") == "cta"
+    assert main._rewrite_target_section("cambia el gancho", "full") is None
+
+
+HEADED = ("[HOOKS]\n- Gancho A\n- Gancho B\n\n\n[CTA]\nSígueme\n\n[GUION]\n"
+          "  Gancho A  //  corte\n Desarrollo: dos ideas,  con espacios raros.\n// corte\tPrueba social\n//corte Sígueme ")
+
+
+@pytest.fixture
+def section_llm(monkeypatch):
+    calls = []
+
+    def fake(system_text, user_text, max_tokens=None):
+        calls.append(user_text)
+        return json.dumps({"section": "Gancho nuevo"})
+
+    monkeypatch.setattr(main, "_llm_messages", fake)
+    return calls
+
+
+def test_hook_splice_keeps_other_sections_byte_for_byte(section_llm):
+    out = main.rewrite_with_guideon(HEADED, "cambia el gancho")
+    assert out["section"] == "hook"
+    body = HEADED.split("[GUION]\n", 1)[1]
+    assert out["script"] == body.replace("Gancho A", "Gancho nuevo", 1).strip()
+    # Sólo viajan la sección y su vecino, no el guion entero
+    assert "Prueba social" not in section_llm[0]
+    # La cabecera refleja el gancho nuevo (en el lugar del viejo) y conserva el resto
+    assert out["hooks"] == ["Gancho nuevo", "Gancho B"] and out["cta"] == "Sígueme"
+
+
+def test_hook_splice_prepends_when_hook_not_in_header(section_llm):
+    out = main.rewrite_with_guideon(HEADED.replace("  Gancho A  //", "  Otro gancho  //"), "cambia el gancho")
+    assert out["hooks"] == ["Gancho nuevo", "Gancho A", "Gancho B"]
+
+
+def test_cta_splice_replaces_header_cta(section_llm, monkeypatch):
+    monkeypatch.setattr(main, "_llm_messages", lambda s, u, max_tokens=None: json.dumps({"section": "Comenta YA"}))
+    out = main.rewrite_with_guideon(HEADED, "mejora el CTA")
+    body = HEADED.split("[GUION]\n", 1)[1]
+    assert out["script"] == body.replace("Sígueme ", "Comenta YA ").strip()
+    assert out["cta"] == "Comenta YA" and out["hooks"] == ["Gancho A", "Gancho B"]
@@ -0,0 +1,116 @@
+"""Prioridad (interactivo antes que bulk) y reparto justo por usuario, ponderado por plan."""
+import threading
+import time
+
+import pytest
+
+import main
+from test_jobs import _req
+
+
+def _wait_until(cond, timeout=2):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.005)
+
+
+class _Harness:
+    """Budget de 1 slot ocupado por un dueño; los que esperan se encolan en un orden conocido y,
+    al soltar el slot, registran el orden en que se les concedió."""
+
+    def __init__(self):
+        self.budget = main._Budget("test", limit=1, max_waiting=50)
+        self.order, self.threads = [], []
+        self._release = threading.Event()
+        held = threading.Event()
+
+        def holder():
+            with self.budget.slot():
+                held.set()
+                self._release.wait(5)
+
+        self.threads.append(threading.Thread(target=holder))
+        self.threads[0].start()
+        held.wait(2)
+
+    def queue(self, name, hold=0.02, **ctx):
+        def run():
+            with main._work_context(**ctx):
+                with self.budget.slot(timeout=10):
+                    self.order.append(name)
+                    time.sleep(hold)
+
+        before = self.budget.waiting
+        t = threading.Thread(target=run)
+        t.start()
+        _wait_until(lambda: self.budget.waiting == before + 1)
+        self.threads.append(t)
+
+    def run(self):
+        self._release.set()
+        for t in self.threads:
+            t.join(5)
+        return self.order
+
+
+def test_interactive_waiter_goes_before_earlier_bulk_waiter():
+    h = _Harness()
+    h.queue("bulk", bulk=True, user_id="a")
+    h.queue("interactive", bulk=False, user_id="b")
+    assert h.run() == ["interactive", "bulk"]
+
+
+def test_heavy_user_backlog_does_not_starve_another_user():
+    h = _Harness()
+    for i in range(3):
+        h.queue(f"heavy{i}", bulk=True, user_id="heavy")
+    h.queue("light", bulk=True, user_id="light")
+    assert h.run() == ["heavy0", "light", "heavy1", "heavy2"]
+
+
+def test_plan_weight_gives_more_turns():
+    h = _Harness()
+    for i in range(2):
+        h.queue(f"starter{i}", hold=0.05, bulk=True, user_id="s", plan="starter")
+        h.queue(f"pro{i}", hold=0.05, bulk=True, user_id="p", plan="pro")
+    # Mismo tiempo de slot, pero "pro" pesa el doble: su segundo turno llega antes que el del otro
+    assert h.run() == ["starter0", "pro0", "pro1", "starter1"]
+
+
+@pytest.fixture
+def dispatch(monkeypatch):
+    """Cola de jobs aislada: _job_dispatch elige el siguiente y se registra en vez de ejecutarlo."""
+    jobs, pending, order = {}, [], []
+    monkeypatch.setattr(main, "_JOBS", jobs)
+    monkeypatch.setattr(main, "_JOBS_PENDING", pending)
+    monkeypatch.setattr(main, "_JOBS_SHARE", {})
+    monkeypatch.setattr(main, "_JOBS_VCLOCK", [0.0])
+    monkeypatch.setattr(main, "_job_worker", lambda job_id, req: order.append(job_id))
+
+    def add(job_id, user, plan=""):
+        jobs[job_id] = {"status": "queued", "created_at": len(jobs)}
+        pending.append((job_id, main.JobReq(**_req(len(jobs), user_id=user, plan=plan))))
+
+    def drain():
+        while pending:
+            main._job_dispatch()
+        return order
+
+    return add, drain
+
+
+def test_job_queue_interleaves_users(dispatch):
+    add, drain = dispatch
+    for i in range(3):
+        add(f"heavy{i}", "heavy")
+    add("light", "light")
+    assert drain() == ["heavy0", "light", "heavy1", "heavy2"]
+
+
+def test_job_queue_weights_by_plan(dispatch):
+    add, drain = dispatch
+    for i in range(3):
+        add(f"starter{i}", "s", "starter")
+        add(f"pro{i}", "p", "pro")
+    assert drain() == ["starter0", "pro0", "pro1", "starter1", "pro2", "starter2"]
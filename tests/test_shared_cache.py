@@ -0,0 +1,44 @@
+"""Cache compartida entre procesos (SQLite WAL) con interfaz tipo dict."""
+import time
+
+import main
+
+
+def test_get_set_and_pop_returns_the_stored_value():
+    cache = main._SharedCache("test.pop", ttl_sec=60)
+    cache["k"] = {"a": 1}
+    assert cache.get("k") == {"a": 1}
+    assert cache.pop("k") == {"a": 1}
+    assert cache.get("k") is None
+    assert cache.pop("k", "nada") == "nada"
+
+
+def test_expired_values_are_not_returned():
+    cache = main._SharedCache("test.ttl", ttl_sec=-1)
+    cache["k"] = 1
+    assert cache.get("k") is None
+    assert cache.pop("k", "nada") == "nada"
+
+
+def test_get_many_and_set_many():
+    cache = main._SharedCache("test.many", ttl_sec=60)
+    cache.set_many({"a": 1, ("t", 2): [2]})
+    assert cache.get_many(["a", ("t", 2), "zz"]) == {"a": 1, '["t", 2]': [2]}
+
+
+def test_update_is_atomic_and_none_leaves_the_row():
+    cache = main._SharedCache("test.update", ttl_sec=60)
+    assert cache.update("n", lambda v: (v or 0) + 1) == 1
+    assert cache.update("n", lambda v: (v or 0) + 1) == 2
+    assert cache.update("n", lambda v: None) is None
+    assert cache.get("n") == 2
+
+
+def test_lru_cap_evicts_least_recently_used():
+    cache = main._SharedCache("test.lru", ttl_sec=60, max_entries=2)
+    cache["a"] = 1
+    time.sleep(0.01)
+    cache["b"] = 2
+    time.sleep(0.01)
+    cache["c"] = 3
+    assert cache.get("a") is None and cache.get("b") == 2 and cache.get("c") == 3
@@ -0,0 +1,74 @@
+"""Single-flight: trabajos idénticos en curso (transcripciones, jobs) se hacen una sola vez."""
+import threading
+import time
+
+import main
+from test_jobs import _req, _wait_final
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = main._SingleFlight("test")
+    calls, results = [], []
+    gate = threading.Event()
+
+    def work():
+        calls.append(1)
+        gate.wait(2)
+        return "resultado"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", work))) for _ in range(6)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    assert flight.inflight() == 1
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1 and results == ["resultado"] * 6 and flight.inflight() == 0
+
+
+def test_single_flight_shares_the_leader_error():
+    flight = main._SingleFlight("test")
+    gate = threading.Event()
+    errors = []
+
+    def boom():
+        gate.wait(2)
+        raise ValueError("falló")
+
+    def call():
+        try:
+            flight.do("k", boom)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert errors == ["falló"] * 3
+    assert flight.do("k", lambda: "ok") == "ok"  # no queda una llamada colgada con la clave
+
+
+def test_identical_concurrent_jobs_are_coalesced(client, monkeypatch):
+    calls, gate = [], threading.Event()
+
+    def run(req, emit):
+        calls.append(1)
+        gate.wait(2)
+        return {"items": [{"url": "https://x/1", "script": "ok"}]}, 200
+
+    monkeypatch.setattr(main, "_run_job", run)
+    body = _req(970, refresh=True)
+    first = client.post("/job/submit", json=body).json()
+    second = client.post("/job/submit", json=body).json()
+    other = client.post("/job/submit", json=_req(971, refresh=True)).json()
+    assert second["job_id"] == first["job_id"] and second["coalesced"] is True
+    assert other["job_id"] != first["job_id"]
+    gate.set()
+    _wait_final(first["job_id"])
+    _wait_final(other["job_id"])
+    assert len(calls) == 2
@@ -0,0 +1,37 @@
+"""`import main` no abre conexiones ni escribe archivos: todo eso corre en el lifespan."""
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # psycopg2 falso: si algo conectara al importar, dejaría la marca (y tardaría 30 s)
+    stub = tmp_path / "stub" / "psycopg2"
+    stub.mkdir(parents=True)
+    marker = tmp_path / "connected"
+    (stub / "__init__.py").write_text(
+        "import time\n"
+        "class OperationalError(Exception): pass\n"
+        "class InterfaceError(Exception): pass\n"
+        "def connect(*a, **kw):\n"
+        f"    open({str(marker)!r}, 'w').close()\n"
+        "    time.sleep(30)\n")
+    (stub / "extras.py").write_text("")
+    data = tmp_path / "data"
+    data.mkdir()
+    env = dict(os.environ,
+               PYTHONPATH=str(tmp_path / "stub"),
+               DATABASE_URL="postgresql://u:p@10.255.255.1:5432/db?connect_timeout=30",
+               SHARED_CACHE_PATH=str(data / "cache.sqlite3"),
+               JOB_STORE_PATH=str(data / "jobs.sqlite3"),
+               ASR_WARMUP="1")
+    code = "import main; assert main.PG_ENABLED"
+    t0 = time.time()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, timeout=60,
+                   stdout=subprocess.DEVNULL)
+    assert time.time() - t0 < 20
+    assert not marker.exists()
+    assert os.listdir(data) == []
@@ -0,0 +1,57 @@
+import json
+import threading
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def fake_transcribe(monkeypatch):
+    state = {"active": 0, "peak": 0, "lock": threading.Lock()}
+
+    def one(url, media_url, with_segments):
+        with state["lock"]:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.05)
+        with state["lock"]:
+            state["active"] -= 1
+        return {"url": url, "script": f"texto {url}"}
+
+    monkeypatch.setattr(main, "_transcribe_batch_one", one)
+    return state
+
+
+def _lines(resp):
+    return [json.loads(line) for line in resp.text.splitlines() if line.strip()]
+
+
+def test_batch_streams_items_and_releases_admission(client, fake_transcribe):
+    items = [{"url": f"https://www.tiktok.com/@u/video/{i}"} for i in range(6)]
+    items.append({"url": "https://www.tiktok.com/@u/video/0?utm_source=x"})  # duplicado
+    resp = client.post("/transcribe/batch", json={"items": items})
+    lines = _lines(resp)
+    assert lines[-1] == {"type": "done", "total": 6, "ok": 6, "failed": 0, "duplicates": 1}
+    assert sum(1 for l in lines if l["type"] == "item") == 6
+    assert fake_transcribe["peak"] <= main.TRANSCRIBE_BATCH_CONCURRENCY
+    assert main._TRANSCRIBE_BATCH_ADMITTED[0] == 0
+
+
+def test_batch_rejected_when_backlog_full(client, fake_transcribe, monkeypatch):
+    monkeypatch.setattr(main, "TRANSCRIBE_BATCH_QUEUE_MAX", 3)
+    resp = client.post("/transcribe/batch", json={"items": [{"url": f"https://x.com/v/{i}"} for i in range(4)]})
+    assert resp.status_code == 503
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert resp.json()["error"] == "overloaded"
+    assert main._TRANSCRIBE_BATCH_ADMITTED[0] == 0
+
+
+def test_batch_rejected_when_stage_budget_saturated(client, fake_transcribe, monkeypatch):
+    asr = main._BUDGETS["asr"]
+    monkeypatch.setattr(asr, "active", asr.limit)
+    monkeypatch.setattr(asr, "max_waiting", 0)
+    resp = client.post("/transcribe/batch", json={"items": [{"url": "https://x.com/v/1"}]})
+    assert resp.status_code == 503
+    assert resp.json()["resource"] == "asr"
@@ -0,0 +1,39 @@
+import main
+
+
+def _segs(texts, step=5.0):
+    return [{"start": i * step, "end": (i + 1) * step, "text": t} for i, t in enumerate(texts)]
+
+
+def test_under_budget_passes_through():
+    text = "Hoy te enseño tres trucos. Guárdalo para después."
+    assert main._compact_transcript(text, budget_tokens=500) == text
+
+
+def test_removes_fillers_repeats_and_whisper_loops():
+    segs = _segs(["Eh, hoy hoy te enseño algo.", "Suscríbete ya.", "Suscríbete ya.", "suscríbete, ya"])
+    assert main._compact_transcript("", segs, budget_tokens=500) == "hoy te enseño algo. Suscríbete ya."
+
+
+def test_keeps_hook_and_cta_and_marks_gaps():
+    middle = [f"Idea número {i} con bastante detalle sobre el tema {i} para rellenar." for i in range(40)]
+    segs = _segs(["Nadie te cuenta esto sobre el ahorro."] + middle + ["Sígueme para la segunda parte."])
+    out = main._compact_transcript("", segs, budget_tokens=120)
+    assert out.startswith("Nadie te cuenta esto sobre el ahorro.")
+    assert out.endswith("Sígueme para la segunda parte.")
+    assert "…" in out
+    assert main._count_tokens(out) <= 120 + 10  # huecos "…" aparte
+
+
+def test_oversized_last_segment_is_trimmed_not_dropped():
+    cta = " ".join(f"palabra{i}" for i in range(200)) + " comenta GUIA y te lo mando"
+    segs = _segs(["Gancho corto.", "Desarrollo breve del tema.", cta])
+    out = main._compact_transcript("", segs, budget_tokens=90)
+    assert out.endswith("comenta GUIA y te lo mando")
+    assert "palabra0 " not in out
+    tail = out[out.index("… palabra"):]
+    assert main._count_tokens(tail) <= 90 // 3 + 2
+
+
+def test_trim_tokens_tail_keeps_at_least_one_word():
+    assert main._trim_tokens_tail("una frase larguísima", 0) == "… larguísima"
@@ -0,0 +1,74 @@
+import pytest
+
+import main
+
+
+def test_reserve_counts_up_to_the_limit(fake_pg, monkeypatch):
+    monkeypatch.setattr(main, "USAGE_LIMIT_STARTER", 2)
+    fake_pg.set_plan("u1", "starter")
+    r1 = main._usage_reserve("u1", "generate_scripts")
+    r2 = main._usage_reserve("u1", "generate_scripts")
+    assert fake_pg.used("u1", "generate_scripts") == 2
+    with pytest.raises(main._LimitReached) as exc:
+        main._usage_reserve("u1", "generate_scripts")
+    assert exc.value.used == 2 and exc.value.limit == 2
+    main._usage_commit(r1)
+    main._usage_release(r2)
+    assert fake_pg.used("u1", "generate_scripts") == 1
+
+
+def test_zero_limit_never_grants_the_first_use(fake_pg, monkeypatch):
+    monkeypatch.setattr(main, "USAGE_LIMIT_STARTER", 0)
+    fake_pg.set_plan("u0", "starter")
+    with pytest.raises(main._LimitReached) as exc:
+        main._usage_reserve("u0", "analyze_profiles")
+    assert exc.value.used == 0
+    assert fake_pg.used("u0", "analyze_profiles") is None
+
+
+def test_release_is_idempotent_and_skips_committed(fake_pg, monkeypatch):
+    monkeypatch.setattr(main, "USAGE_LIMIT_STARTER", 5)
+    r = main._usage_reserve("u2", "analyze_profiles")
+    main._usage_release(r)
+    main._usage_release(r)
+    assert fake_pg.used("u2", "analyze_profiles") == 0
+    r = main._usage_reserve("u2", "analyze_profiles")
+    main._usage_commit(r)
+    main._usage_release(r)
+    assert fake_pg.used("u2", "analyze_profiles") == 1
+
+
+def test_unknown_or_missing_plan_gets_the_strictest_limit(fake_pg, monkeypatch):
+    monkeypatch.setattr(main, "USAGE_LIMIT_STARTER", 1)
+    monkeypatch.setattr(main, "USAGE_LIMIT_PRO", 3)
+    fake_pg.set_plan("u3", "business")
+    main._usage_reserve("u3", "analyze_profiles")
+    with pytest.raises(main._LimitReached) as exc:
+        main._usage_reserve("u3", "analyze_profiles")
+    assert exc.value.limit == 1
+    main._usage_reserve("u4", "analyze_profiles")  # sin fila en user_plans
+    with pytest.raises(main._LimitReached):
+        main._usage_reserve("u4", "analyze_profiles")
+
+
+def test_client_plan_does_not_raise_the_quota(client, fake_pg, monkeypatch):
+    monkeypatch.setattr(main, "USAGE_LIMIT_STARTER", 1)
+    monkeypatch.setattr(main, "USAGE_LIMIT_PRO", 3)
+    fake_pg.set_plan("u5", "starter")
+    for plan in ("business", "", "pro"):
+        r = client.post("/usage/increment", json={"user_id": "u5", "feature": "generate_scripts", "plan": plan})
+        assert r.status_code == (200 if plan == "business" else 409), plan
+        assert r.json()["limit"] == 1
+    r = client.get("/usage/remaining", params={"user_id": "u5", "feature": "generate_scripts", "plan": "pro"})
+    assert r.json()["plan"] == "starter" and r.json()["limit"] == 1 and r.json()["remaining"] == 0
+    assert fake_pg.used("u5", "generate_scripts") == 1
+
+
+def test_server_plan_sets_the_limit(fake_pg, monkeypatch):
+    monkeypatch.setattr(main, "USAGE_LIMIT_PRO", 2)
+    fake_pg.set_plan("u6", "pro")
+    main._usage_reserve("u6", "generate_scripts")
+    main._usage_reserve("u6", "generate_scripts")
+    with pytest.raises(main._LimitReached) as exc:
+        main._usage_reserve("u6", "generate_scripts")
+    assert exc.value.limit == 2